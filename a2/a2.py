@@ -28,15 +28,60 @@ Lujie (Adam) Zhao, #1006879086
 # Adam - EVEN
 # (according to the a2.pdf handout in the function definition)
 
+import array
+import bisect
+import collections
+import concurrent.futures
 import datetime as dt
+import functools
+import heapq
+import itertools
+import random
+import select
+import threading
+import time
 import psycopg2 as pg
+import psycopg2.errors as pg_errors
 import psycopg2.extensions as pg_ext
 import psycopg2.extras as pg_extras
-from typing import Optional, TextIO
+import psycopg2.pool as pg_pool
+from typing import Callable, Iterable, Iterator, Optional, TextIO
+
+
+# all trucks travel at an average of 5 kph
+TRUCK_SPEED = 5
+# trucks and drivers need more than this much time between two trips
+TRIP_BUFFER = dt.timedelta(minutes=30)
+# working hours, every trip has to start and end within them
+DAY_START = dt.time(8, 0)
+DAY_END = dt.time(16, 0)
+# SlotCalendar splits working hours into slots of this length
+SLOT_LENGTH = dt.timedelta(minutes=5)
+SLOT_COUNT = (dt.datetime.combine(dt.date.min, DAY_END)
+              - dt.datetime.combine(dt.date.min, DAY_START)) // SLOT_LENGTH
+assert SLOT_COUNT <= 128, 'a SlotCalendar row holds two 64-bit words'
+# times schedule_trip tries again after the exclusion constraints of
+# waste_wrangler_exclusion.sql rejected its crew
+EXCLUSION_RETRIES = 3
+# days of Occupancy schedule_maintenance reads at first; the window doubles
+# every time the technician calendar needs a later day
+OCCUPANCY_WINDOW = 8
 
 
 # helper functions
 
+# returns the time a trip on a route of <length> km started at <start> ends
+def trip_end(start: dt.datetime, length: float) -> dt.datetime:
+    return start + dt.timedelta(hours=length / TRUCK_SPEED)
+
+
+# returns the earliest whole minute at which the same truck or driver can
+# start another trip after a trip ending at <end>, strictly more than
+# TRIP_BUFFER later
+def next_trip_start(end: dt.datetime) -> dt.datetime:
+    return (end + TRIP_BUFFER).replace(second=0, microsecond=0) + dt.timedelta(minutes=1)
+
+
 # function that takes in two dt.date variables
 # Returns true if the dates are on different days
 # checks if the first date starts 30 minutes before the second date or 
@@ -80,25 +125,1667 @@ def valid_truck_time(truck_time: dt.datetime, given_time: dt.datetime, length: i
         return True
 
 
+# returns the two words of a bitset with a bit set for every slot of SLOT_LENGTH
+# from DAY_START on the day of <day_start> that [start, end] touches, widened
+# by TRIP_BUFFER on both sides if <buffered>; times outside working hours
+# count as the first or last slot, which never misses an overlap since the
+# mapping from times to slots is monotone
+@functools.lru_cache(maxsize=4096)
+def slot_mask(day_start: dt.datetime, start: dt.datetime, end: dt.datetime,
+              buffered: bool = False) -> tuple[int, int]:
+    if (buffered):
+        start, end = start - TRIP_BUFFER, end + TRIP_BUFFER
+    first = min(max((start - day_start) // SLOT_LENGTH, 0), SLOT_COUNT - 1)
+    last = min(max((end - day_start) // SLOT_LENGTH, 0), SLOT_COUNT - 1)
+    mask = ((1 << (last - first + 1)) - 1) << first
+    return mask & 0xFFFF_FFFF_FFFF_FFFF, mask >> 64
+
+
+# returns the two words of a bitset with a bit set for every slot that lies
+# entirely within [start, end], leaving out the first and last slot since
+# they also stand for the times outside working hours
+def core_mask(day_start: dt.datetime, start: dt.datetime, end: dt.datetime) -> tuple[int, int]:
+    first = max(-((day_start - start) // SLOT_LENGTH), 1)
+    last = min((end - day_start) // SLOT_LENGTH - 1, SLOT_COUNT - 2)
+    if (first > last):
+        return 0, 0
+    mask = ((1 << (last - first + 1)) - 1) << first
+    return mask & 0xFFFF_FFFF_FFFF_FFFF, mask >> 64
+
+
+class SlotCalendar:
+    """The busy slots of many trucks or drivers on one day, as bitsets per
+    truck or driver with a bit per SLOT_LENGTH of working hours. The bitsets
+    are rows of arrays of 64-bit words, so a whole fleet takes a few
+    kilobytes.
+
+    Slots are coarser than trip times. A slot without any booking in it
+    proves that a trip there is free, and a slot entirely inside a booking
+    proves that it isn't; both are a mask AND. Only a trip that touches
+    partly booked slots and no fully booked one is undecided, and BusyDay
+    looks at the trips themselves for it.
+
+    === Instance Attributes ===
+    day_start: DAY_START on the day of the first booking, None before that.
+    """
+    day_start: Optional[dt.datetime]
+    _rows: dict[int, int]
+    _touched: array.array
+    _covered: array.array
+    _query: tuple
+
+    def __init__(self) -> None:
+        self.day_start = None
+        self._rows = {} # {<id>: <index of its first of two words in the arrays>}
+        self._touched = array.array('Q') # slots a booking touches
+        self._covered = array.array('Q') # slots entirely inside a booking
+        # (<start>, <end>, <mask>) of the last conflict check, which is usually
+        # about the same trip for one truck or driver after another
+        self._query = (None, None, (0, 0))
+
+    def book(self, key: int, start: dt.datetime, end: dt.datetime) -> None:
+        """Mark the slots from <start> to <end> busy for <key>."""
+        if (self.day_start is None):
+            self.day_start = dt.datetime.combine(start.date(), DAY_START)
+        touched = slot_mask(self.day_start, start, end)
+        covered = core_mask(self.day_start, start, end)
+        row = self._rows.get(key)
+        if (row is None):
+            self._rows[key] = len(self._touched)
+            self._touched.extend(touched)
+            self._covered.extend(covered)
+            return
+        self._touched[row] |= touched[0]
+        self._touched[row + 1] |= touched[1]
+        self._covered[row] |= covered[0]
+        self._covered[row + 1] |= covered[1]
+
+    def conflict(self, key: int, start: dt.datetime, end: dt.datetime) -> Optional[bool]:
+        """Return False if <key> certainly has no booking within TRIP_BUFFER
+        of [<start>, <end>], True if it certainly has one, and None if the
+        slots can't tell.
+        """
+        row = self._rows.get(key)
+        if (row is None):
+            return False
+        query = self._query
+        if (query[0] is not start or query[1] is not end):
+            query = self._query = (start, end, slot_mask(self.day_start, start, end, True))
+        low, high = query[2]
+        if (not (self._touched[row] & low or self._touched[row + 1] & high)):
+            return False
+        if (self._covered[row] & low or self._covered[row + 1] & high):
+            return True
+        return None
+
+    def rebook(self, key: int, intervals: Iterable[tuple[dt.datetime, dt.datetime]]) -> None:
+        """Clear the slots of <key> and mark those of every (<start>, <end>)
+        in <intervals> busy, to take a booking back.
+        """
+        row = self._rows.get(key)
+        if (row is not None):
+            for word in (row, row + 1):
+                self._touched[word] = 0
+                self._covered[word] = 0
+        for start, end in intervals:
+            self.book(key, start, end)
+
+    def copy(self) -> 'SlotCalendar':
+        """Return a copy that can be booked into without changing this one."""
+        calendar = SlotCalendar()
+        calendar.day_start = self.day_start
+        calendar._rows = dict(self._rows)
+        calendar._touched = array.array('Q', self._touched)
+        calendar._covered = array.array('Q', self._covered)
+        return calendar
+
+    def nbytes(self) -> int:
+        """Return the size of the bitsets in bytes."""
+        return (len(self._touched) + len(self._covered)) * self._touched.itemsize
+
+
+class BusyDay:
+    """Everything that keeps trucks and drivers busy on a single day.
+
+    Busy lists hold (start, end) tuples sorted by start time. The trips of one
+    truck or driver never overlap, so only the neighbours of a proposed trip
+    have to be looked at, which is a binary search instead of a scan. The
+    slot calendars mostly answer without the search.
+
+    === Instance Attributes ===
+    trucks: {<tid>: [(<start>, <end>), ...]}
+    drivers: {<eid>: [(<start>, <end>), ...]}
+    maintenance: tIDs of the trucks that have maintenance on this day.
+    routes: rIDs of the routes that already have a trip on this day.
+    truck_slots: the busy slots of every truck in <trucks>.
+    driver_slots: the busy slots of every driver in <drivers>.
+    """
+    trucks: dict[int, list[tuple[dt.datetime, dt.datetime]]]
+    drivers: dict[int, list[tuple[dt.datetime, dt.datetime]]]
+    maintenance: set[int]
+    routes: set[int]
+    truck_slots: SlotCalendar
+    driver_slots: SlotCalendar
+
+    def __init__(self) -> None:
+        self.trucks = {}
+        self.drivers = {}
+        self.maintenance = set()
+        self.routes = set()
+        self.truck_slots = SlotCalendar()
+        self.driver_slots = SlotCalendar()
+
+    def add_trip(self, rid: int, tid: int, eid1: int, eid2: int,
+                 start: dt.datetime, end: dt.datetime) -> None:
+        """Record a trip on route <rid> by truck <tid> with drivers <eid1> and
+        <eid2> running from <start> to <end>.
+        """
+        self.routes.add(rid)
+        self.add_truck_busy(tid, start, end)
+        for eid in (eid1, eid2):
+            self.add_driver_busy(eid, start, end)
+
+    def add_truck_busy(self, tid: int, start: dt.datetime, end: dt.datetime) -> None:
+        """Record that truck <tid> is busy from <start> to <end>."""
+        bisect.insort(self.trucks.setdefault(tid, []), (start, end))
+        self.truck_slots.book(tid, start, end)
+
+    def add_driver_busy(self, eid: int, start: dt.datetime, end: dt.datetime) -> None:
+        """Record that driver <eid> is busy from <start> to <end>."""
+        bisect.insort(self.drivers.setdefault(eid, []), (start, end))
+        self.driver_slots.book(eid, start, end)
+
+    def remove_trip(self, rid: int, tid: int, eid1: int, eid2: int,
+                    start: dt.datetime, end: dt.datetime) -> None:
+        """Take back a trip recorded with add_trip, such as a reserved crew
+        whose insert failed. Everything else booked on this day stays.
+        """
+        self.routes.discard(rid)
+        _remove_busy(self.trucks, self.truck_slots, tid, start, end)
+        for eid in (eid1, eid2):
+            _remove_busy(self.drivers, self.driver_slots, eid, start, end)
+
+    def copy(self) -> 'BusyDay':
+        """Return a copy of this BusyDay that can be booked into without
+        changing this one.
+        """
+        busy = BusyDay()
+        busy.trucks = {tid: list(intervals) for tid, intervals in self.trucks.items()}
+        busy.drivers = {eid: list(intervals) for eid, intervals in self.drivers.items()}
+        busy.maintenance = set(self.maintenance)
+        busy.routes = set(self.routes)
+        busy.truck_slots = self.truck_slots.copy()
+        busy.driver_slots = self.driver_slots.copy()
+        return busy
+
+    def truck_free(self, tid: int, start: dt.datetime,
+                   end: dt.datetime) -> bool:
+        """Return True iff truck <tid> can do a trip from <start> to <end>."""
+        if tid in self.maintenance:
+            return False
+        conflict = self.truck_slots.conflict(tid, start, end)
+        if conflict is None:
+            return not _overlaps(self.trucks.get(tid, []), start, end)
+        return not conflict
+
+    def driver_free(self, eid: int, start: dt.datetime,
+                    end: dt.datetime) -> bool:
+        """Return True iff driver <eid> can do a trip from <start> to <end>."""
+        conflict = self.driver_slots.conflict(eid, start, end)
+        if conflict is None:
+            return not _overlaps(self.drivers.get(eid, []), start, end)
+        return not conflict
+
+
+# removes the interval from start to end of key from busy and its slots, if
+# it is there
+def _remove_busy(busy: dict[int, list[tuple[dt.datetime, dt.datetime]]], slots: SlotCalendar,
+                 key: int, start: dt.datetime, end: dt.datetime) -> None:
+    intervals = busy.get(key, [])
+    if (start, end) in intervals:
+        intervals.remove((start, end))
+        slots.rebook(key, intervals)
+
+
+# returns true if a trip from start to end comes within TRIP_BUFFER of any
+# interval in busy (sorted by start time, non-overlapping)
+def _overlaps(busy: list[tuple[dt.datetime, dt.datetime]],
+              start: dt.datetime, end: dt.datetime) -> bool:
+    i = bisect.bisect_left(busy, (start,))
+    if i > 0 and busy[i - 1][1] + TRIP_BUFFER >= start: # trip right before
+        return True
+    if i < len(busy) and busy[i][0] <= end + TRIP_BUFFER: # trip right after
+        return True
+    return False
+
+
+# picks the truck and the two drivers for a trip on route rid starting at start
+# trucks: [(<tid>, <trucktype>)] in priority order (capacity, then tid)
+# drivers: [(<eid>, [<trucktype>, ...])] in priority order (hiredate, then eid)
+# returns (<tid>, <eid1>, <eid2>) with eid1 > eid2, or None if the trip can't
+# be scheduled
+def choose_crew(busy: BusyDay, rid: int, start: dt.datetime, length: float,
+                trucks: list[tuple[int, str]],
+                drivers: list[tuple[int, list[str]]]) -> Optional[tuple[int, int, int]]:
+    end = trip_end(start, length)
+
+    # the trip has to fit within working hours
+    if (start.time() < DAY_START or end.date() != start.date() or end.time() > DAY_END):
+        return None
+
+    # if a trip has already been scheduled for this rid on the same day
+    if (rid in busy.routes):
+        return None
+
+    final_tid = -1
+    final_trucktype = None
+    for tid, trucktype in trucks:
+        if (busy.truck_free(tid, start, end)): # no maintenance or trip too close
+            final_tid = tid
+            final_trucktype = trucktype
+            break
+    if (final_tid == -1): # no suitable truck
+        return None
+
+    # first driver is always the most experienced free one
+    first_eid = -1
+    first_can_drive = False
+    for eid, trucktypes in drivers:
+        if (not busy.driver_free(eid, start, end)):
+            continue
+        can_drive = final_trucktype in trucktypes
+        if (first_eid == -1):
+            first_eid = eid
+            first_can_drive = can_drive
+        elif (first_can_drive or can_drive):
+            # if the first driver can't drive the truck, the second one has to
+            return (final_tid, max(first_eid, eid), min(first_eid, eid))
+
+    return None # no suitable drivers
+
+
+# solves a min-cost bipartite matching where every column costs the same for
+# every row it can be matched with
+# rows: [{<column>, ...}] the columns each row may be matched with
+# columns: every column, cheapest first
+# returns the column matched with each row, or None for unmatched rows; as
+# many rows as possible are matched, with the lowest total cost among those
+# matchings
+# the sets of columns that can all be matched form a (transversal) matroid,
+# so adding columns cheapest first whenever an augmenting path keeps all
+# matched columns matched is optimal, in O(columns * edges) at worst and
+# close to O(edges) when most columns are free
+def min_cost_matching(rows: list[set], columns: list) -> list[Optional[object]]:
+    matched = [None] * len(rows)
+    owner = {} # {<matched column>: <row>}
+    column_rows = {} # {<column>: [<row>, ...]}
+    for i, row in enumerate(rows):
+        for column in row:
+            column_rows.setdefault(column, []).append(i)
+    matchable = sum(1 for row in rows if len(row) > 0)
+
+    count = 0
+    for column in columns:
+        if count == matchable:
+            break
+        # breadth first search for a free row, moving matched rows along
+        came_from = {} # {<row>: <column it would be matched with>}
+        queue = collections.deque([column])
+        free_row = None
+        while queue and free_row is None:
+            current = queue.popleft()
+            for i in column_rows.get(current, []):
+                if i in came_from:
+                    continue
+                came_from[i] = current
+                if matched[i] is None:
+                    free_row = i
+                    break
+                queue.append(matched[i])
+        if free_row is None:
+            continue
+        i = free_row
+        while True: # flip the augmenting path back to <column>
+            taken = came_from[i]
+            previous_owner = owner.get(taken)
+            matched[i] = taken
+            owner[taken] = i
+            if taken == column:
+                break
+            i = previous_owner
+        count += 1
+    return matched
+
+
+# picks trucks and drivers for trips that all overlap each other, so no truck
+# or driver can do two of them, at once instead of one after the other
+# requests: [(<rid>, <start>, <length>, <wastetype>)]
+# trucks: [(<tid>, <trucktype>, {<wastetype>, ...})] in priority order
+# (capacity, then tid)
+# drivers: as in choose_crew
+# the cost of a truck or driver is its position in <trucks> or <drivers>, so
+# the group as a whole gets the best crews it can instead of the first
+# requests taking them all
+# crews are matched in three rounds: trucks, then a driver who can drive the
+# truck, then any other driver; if some requests get a first driver but no
+# second one, the last of them is dropped and the driver rounds run again, so
+# scarce drivers aren't all spent on first drivers
+# each round is optimal on its own, but this is a staged approximation of
+# picking trucks and drivers jointly (a 3-dimensional matching, which is
+# NP-hard): a request whose truck no free driver can drive stays unscheduled
+# even if another truck would have had drivers, so fewer requests may be
+# scheduled than possible; it schedules as many as possible when every free
+# driver can drive every truck
+# returns (<tid>, <eid1>, <eid2>) with eid1 > eid2 or None for every request
+def choose_crews(busy: BusyDay, requests: list[tuple[int, dt.datetime, float, str]],
+                 trucks: list[tuple[int, str, set[str]]],
+                 drivers: list[tuple[int, list[str]]]) -> list[Optional[tuple[int, int, int]]]:
+    n = len(requests)
+    ends = [trip_end(start, length) for _, start, length, _ in requests]
+
+    # a row only needs its n cheapest columns: in any optimal matching, a row
+    # matched further down could swap to one of those that is left free
+    def cheapest(candidates: Iterable, allowed: Callable[[object], bool]) -> set:
+        return set(itertools.islice(filter(allowed, candidates), n))
+
+    rids = set()
+    truck_rows = []
+    for (rid, start, _, wastetype), end in zip(requests, ends):
+        row = set()
+        # within working hours, and only one trip per route and day
+        if (start.time() >= DAY_START and end.date() == start.date() and end.time() <= DAY_END
+                and rid not in busy.routes and rid not in rids):
+            rids.add(rid)
+            row = cheapest(((tid, trucktype) for tid, trucktype, wastetypes in trucks
+                            if wastetype in wastetypes),
+                           lambda truck: busy.truck_free(truck[0], start, end))
+        truck_rows.append(row)
+    chosen_trucks = min_cost_matching(truck_rows, [(tid, trucktype) for tid, trucktype, _ in trucks])
+
+    eids = [eid for eid, _ in drivers]
+    can_drive = {eid: set(trucktypes) for eid, trucktypes in drivers}
+    first_rows = []
+    for truck, start, end in zip(chosen_trucks, (request[1] for request in requests), ends):
+        first_rows.append(set() if truck is None else
+                          cheapest(eids, lambda eid: (truck[1] in can_drive[eid]
+                                                      and busy.driver_free(eid, start, end))))
+    while True:
+        first_drivers = min_cost_matching(first_rows, eids)
+        taken = set(first_drivers)
+        second_rows = []
+        for first, start, end in zip(first_drivers, (request[1] for request in requests), ends):
+            second_rows.append(set() if first is None else
+                               cheapest(eids, lambda eid: (eid not in taken
+                                                           and busy.driver_free(eid, start, end))))
+        second_drivers = min_cost_matching(second_rows, eids)
+        stranded = [i for i, (first, second) in enumerate(zip(first_drivers, second_drivers))
+                    if first is not None and second is None]
+        if len(stranded) == 0:
+            break
+        first_rows[stranded[-1]] = set()
+
+    return [None if second is None else (truck[0], max(first, second), min(first, second))
+            for truck, first, second in zip(chosen_trucks, first_drivers, second_drivers)]
+
+
+# plans the trips of truck tid on date like schedule_trips does: the lowest
+# free eid that can drive trucktype and the lowest other free eid drive it on
+# the free routes of the wastetypes it carries from DAY_START, until a trip
+# would end less than TRIP_BUFFER before DAY_END; unlike schedule_trips, each
+# trip starts at next_trip_start of the one before, so the plan keeps the
+# TRIP_BUFFER that schedule_trip and the exclusion constraints require
+# routes: [(<rid>, <wastetype>, <length>)] in rid order
+# drivers: [(<eid>, {<trucktype>, ...})] in eid order
+# taken_drivers, taken_routes: eIDs and rIDs that already have a trip on date,
+# updated with the planned trips
+# returns [(<rid>, <tid>, <ttime>, <eid1>, <eid2>)] with eid1 > eid2
+def plan_truck_day(tid: int, trucktype: str, wastetypes: set[str], date: dt.date,
+                   routes: list[tuple[int, str, float]],
+                   drivers: list[tuple[int, set[str]]],
+                   taken_drivers: set[int], taken_routes: set[int]
+                   ) -> list[tuple[int, int, dt.datetime, int, int]]:
+    first = next((eid for eid, trucktypes in drivers
+                  if eid not in taken_drivers and trucktype in trucktypes), None)
+    second = next((eid for eid, _ in drivers
+                   if eid != first and eid not in taken_drivers), None)
+    if (first is None or second is None):
+        return []
+
+    planned = []
+    start = dt.datetime.combine(date, DAY_START)
+    last_end = dt.datetime.combine(date, DAY_END) - TRIP_BUFFER
+    for rid, r_wastetype, length in routes:
+        if (r_wastetype not in wastetypes or rid in taken_routes):
+            continue
+        end = trip_end(start, length)
+        if (end > last_end):
+            break
+        planned.append((rid, tid, start, max(first, second), min(first, second)))
+        taken_routes.add(rid)
+        start = next_trip_start(end)
+    if (len(planned) > 0):
+        taken_drivers.update((first, second))
+    return planned
+
+
+# plans every truck on every day from first_day to last_day inclusive with
+# plan_truck_day, days in order and trucks in the order of <trucks>
+# trucks: {<tid>: (<trucktype>, {<wastetype>, ...})}
+# taken_drivers, taken_routes, busy_trucks: {<date>: {<id>, ...}} what already
+# has a trip (or maintenance, for trucks) on each day, updated with the plan
+# returns [(<rid>, <tid>, <ttime>, <eid1>, <eid2>)]
+def plan_fleet(first_day: dt.date, last_day: dt.date,
+               trucks: dict[int, tuple[str, set[str]]],
+               routes: list[tuple[int, str, float]],
+               drivers: list[tuple[int, set[str]]],
+               taken_drivers: dict[dt.date, set[int]], taken_routes: dict[dt.date, set[int]],
+               busy_trucks: dict[dt.date, set[int]]) -> list[tuple[int, int, dt.datetime, int, int]]:
+    planned = []
+    date = first_day
+    while (date <= last_day):
+        for tid, (trucktype, wastetypes) in trucks.items():
+            if (tid in busy_trucks.get(date, ())):
+                continue
+            planned.extend(plan_truck_day(tid, trucktype, wastetypes, date, routes, drivers,
+                                          taken_drivers.setdefault(date, set()),
+                                          taken_routes.setdefault(date, set())))
+        date += dt.timedelta(days=1)
+    return planned
+
+
+# splits a fleet planning problem into parts that share no truck, route or
+# driver, so they can be planned independently
+# trucks, routes, drivers: as in plan_fleet
+# waste types are in the same part when a truck carries both of them; a
+# driver goes to the part they can drive trucks of, and drivers who can drive
+# in several parts or in none are dealt out in eid order to whichever of those
+# parts is furthest below two drivers per truck, the lowest part on ties
+# returns [(<trucks>, <routes>, <drivers>)] ordered by smallest waste type
+def partition_fleet(trucks: dict[int, tuple[str, set[str]]],
+                    routes: list[tuple[int, str, float]],
+                    drivers: list[tuple[int, set[str]]]
+                    ) -> list[tuple[dict[int, tuple[str, set[str]]],
+                                    list[tuple[int, str, float]],
+                                    list[tuple[int, set[str]]]]]:
+    # waste types carried by the same truck end up in the same part
+    parts = [] # [{<wastetype>, ...}]
+    for _, wastetypes in trucks.values():
+        joined = set(wastetypes)
+        for part in [part for part in parts if part & wastetypes]:
+            joined |= part
+            parts.remove(part)
+        parts.append(joined)
+    parts.sort(key=min)
+    part_of = {wastetype: i for i, part in enumerate(parts) for wastetype in part}
+
+    part_trucks = [{} for _ in parts]
+    part_of_trucktype = {}
+    for tid, (trucktype, wastetypes) in trucks.items():
+        i = part_of[min(wastetypes)]
+        part_trucks[i][tid] = (trucktype, wastetypes)
+        part_of_trucktype[trucktype] = i
+    part_routes = [[] for _ in parts]
+    for route in routes:
+        if (route[1] in part_of):
+            part_routes[part_of[route[1]]].append(route)
+
+    part_drivers = [[] for _ in parts]
+    deficit = [2 * len(part) for part in part_trucks]
+    shared = []
+    for eid, trucktypes in drivers:
+        qualified = {part_of_trucktype[t] for t in trucktypes if t in part_of_trucktype}
+        if (len(qualified) == 1):
+            i = qualified.pop()
+            part_drivers[i].append((eid, trucktypes))
+            deficit[i] -= 1
+        else:
+            shared.append((eid, trucktypes, qualified or set(range(len(parts)))))
+    for eid, trucktypes, candidates in shared:
+        i = min(candidates, key=lambda j: (-deficit[j], j))
+        part_drivers[i].append((eid, trucktypes))
+        deficit[i] -= 1
+    for part in part_drivers:
+        part.sort(key=lambda driver: driver[0])
+
+    return list(zip(part_trucks, part_routes, part_drivers))
+
+
+# plans like plan_fleet, but splits the fleet with partition_fleet and plans
+# the parts in a pool of up to <processes> processes; the plans are joined in
+# part order, so the result only depends on the data
+def plan_fleet_parallel(first_day: dt.date, last_day: dt.date,
+                        trucks: dict[int, tuple[str, set[str]]],
+                        routes: list[tuple[int, str, float]],
+                        drivers: list[tuple[int, set[str]]],
+                        taken_drivers: dict[dt.date, set[int]], taken_routes: dict[dt.date, set[int]],
+                        busy_trucks: dict[dt.date, set[int]],
+                        processes: int) -> list[tuple[int, int, dt.datetime, int, int]]:
+    parts = partition_fleet(trucks, routes, drivers)
+    planned = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(processes, len(parts) or 1)) as pool:
+        futures = [pool.submit(plan_fleet, first_day, last_day, part_trucks, part_routes,
+                               part_drivers, taken_drivers, taken_routes, busy_trucks)
+                   for part_trucks, part_routes, part_drivers in parts]
+        for future in futures: # in part order, whichever finishes first
+            planned.extend(future.result())
+    return planned
+
+
+# chooses where reroute_waste_bulk sends the trips of every outage: to the
+# facility with the smallest fid that takes the same wastetype and is not down
+# at any point during the outage, a facility being down during its own
+# outages; outages of unknown facilities or without such a facility are left
+# out
+# outages: [(<fid>, <first day>, <last day>)]
+# waste_types: {<fid>: <wastetype>}
+# facilities: {<wastetype>: [<fid>, ...]} smallest fid first
+# returns [(<fid>, <replacement fid>, <from>, <until>)] in outage order, from
+# the first midnight of the outage until the midnight after it
+def choose_replacements(outages: list[tuple[int, dt.date, dt.date]], waste_types: dict[int, str],
+                        facilities: dict[str, list[int]]
+                        ) -> list[tuple[int, int, dt.datetime, dt.datetime]]:
+    reroutes = []
+    for fid, first_day, last_day in outages:
+        if (fid not in waste_types):
+            continue
+        # facilities that are down at some point during this outage
+        down = {other for other, other_first, other_last in outages
+                if other_first <= last_day and first_day <= other_last}
+        for replacement in facilities[waste_types[fid]]:
+            if (replacement not in down):
+                reroutes.append((fid, replacement,
+                                 dt.datetime.combine(first_day, dt.time(0, 0)),
+                                 dt.datetime.combine(last_day + dt.timedelta(days=1), dt.time(0, 0))))
+                break
+    return reroutes
+
+
+# counts the rerouted trips per fid for reroute_waste_bulk
+# outages: [(<fid>, <first day>, <last day>)]
+# rerouted: the old fid of every rerouted trip
+# returns {<fid>: <number of rerouted trips>} for every fid in <outages>, 0
+# for the ones nothing was rerouted from
+def count_reroutes(outages: list[tuple[int, dt.date, dt.date]], rerouted: Iterable[int]) -> dict[int, int]:
+    counts = {fid: 0 for fid, _, _ in outages}
+    for fid in rerouted:
+        counts[fid] += 1
+    return counts
+
+
+class AvailabilityIndex:
+    """An in-memory index of when trucks and drivers are busy, loaded from the
+    database one day at a time the first time that day is asked for.
+
+    WasteWrangler keeps this up to date with every Trip and Maintenance row
+    it inserts itself. Changes made by anyone else are only picked up after
+    invalidate() is called.
+
+    Callers that check a BusyDay and then book into it have to hold <lock>
+    for both steps when the index is shared between threads. Days are read
+    from the database without holding <lock>, so get the BusyDay with day()
+    before taking it.
+
+    === Instance Attributes ===
+    days: {<date>: <BusyDay>} for every day loaded so far.
+    lock: guards <days> and every BusyDay in it.
+    occupancy: True if days are loaded from the Occupancy table of
+    waste_wrangler_occupancy.sql rather than from Trip and Maintenance.
+    """
+    days: dict[dt.date, BusyDay]
+    lock: threading.RLock
+    occupancy: bool
+
+    def __init__(self) -> None:
+        self.days = {}
+        self.lock = threading.RLock()
+        self.occupancy = False
+
+    def day(self, cur: pg_ext.cursor, date: dt.date, fresh: bool = False) -> BusyDay:
+        """Return the BusyDay for <date>, loading it with <cur> if needed or
+        if <fresh>.
+
+        <lock> is only held to look up and store the day, not while loading
+        it. If another thread loads the same day meanwhile, the BusyDay stored
+        first is kept, unless <fresh>, in which case the new one replaces it.
+        """
+        if not fresh:
+            with self.lock:
+                busy = self.days.get(date)
+            if busy is not None:
+                return busy
+
+        busy = self._load(cur, date)
+        with self.lock:
+            if fresh:
+                self.days[date] = busy
+                return busy
+            return self.days.setdefault(date, busy)
+
+    # the BusyDay of <date> from the database, without storing it
+    def _load(self, cur: pg_ext.cursor, date: dt.date) -> BusyDay:
+        if (self.occupancy):
+            return self._occupied_day(cur, date)
+
+        busy = BusyDay()
+        day_start = dt.datetime.combine(date, dt.time(0, 0))
+        day_end = day_start + dt.timedelta(days=1)
+        cur.execute('select t.rid, t.tid, t.eid1, t.eid2, t.ttime, r.length '
+                    'from Trip t join Route r on t.rid = r.rid '
+                    'where t.ttime >= %s and t.ttime < %s;',
+                    (day_start, day_end))
+        for rid, tid, eid1, eid2, ttime, length in cur.fetchall():
+            busy.add_trip(rid, tid, eid1, eid2, ttime, trip_end(ttime, length))
+        cur.execute('select tid from Maintenance where mdate = %s;', (date,))
+        busy.maintenance.update(row[0] for row in cur.fetchall())
+        return busy
+
+    # the BusyDay of <date> from the Occupancy rows of that day
+    def _occupied_day(self, cur: pg_ext.cursor, date: dt.date) -> BusyDay:
+        busy = BusyDay()
+        cur.execute('select kind, id, lower(r), upper(r) from Occupancy, unnest(busy) r '
+                    'where day = %s order by kind, id, lower(r), upper(r);', (date,))
+        for kind, resource, start, end in cur.fetchall():
+            if (kind == 'truck'):
+                busy.add_truck_busy(resource, start, end)
+            elif (kind == 'driver'):
+                busy.add_driver_busy(resource, start, end)
+            elif (kind == 'route'):
+                busy.routes.add(resource)
+            elif (kind == 'maintenance'):
+                busy.maintenance.add(resource)
+        return busy
+
+    def add_trip(self, rid: int, tid: int, eid1: int, eid2: int,
+                 start: dt.datetime, length: float) -> None:
+        """Record a newly inserted trip, if its day has been loaded."""
+        with self.lock:
+            busy = self.days.get(start.date())
+            if busy is not None:
+                busy.add_trip(rid, tid, eid1, eid2, start, trip_end(start, length))
+
+    def remove_trip(self, rid: int, tid: int, eid1: int, eid2: int,
+                    start: dt.datetime, length: float) -> None:
+        """Take back a trip recorded with add_trip or booked into a BusyDay
+        of this index, if its day is loaded.
+        """
+        with self.lock:
+            busy = self.days.get(start.date())
+            if busy is not None:
+                busy.remove_trip(rid, tid, eid1, eid2, start, trip_end(start, length))
+
+    def add_maintenance(self, tid: int, date: dt.date) -> None:
+        """Record newly inserted maintenance, if its day has been loaded."""
+        with self.lock:
+            busy = self.days.get(date)
+            if busy is not None:
+                busy.maintenance.add(tid)
+
+    def preload(self, days: dict[dt.date, BusyDay]) -> None:
+        """Replace the loaded days in <days> with the given BusyDays."""
+        with self.lock:
+            self.days.update(days)
+
+    def invalidate(self, date: Optional[dt.date] = None) -> None:
+        """Forget <date>, or every day if <date> is None, so that it is
+        reloaded from the database the next time it is needed.
+        """
+        with self.lock:
+            if date is None:
+                self.days.clear()
+            else:
+                self.days.pop(date, None)
+
+
+class WorkmateIndex:
+    """A disjoint-set (union-find) index of employees who have been on a trip
+    together, directly or through other workmates. Every group of connected
+    employees is one set, so a workmate sphere is the set of its employee.
+
+    Trips are only ever added to the index. If trips are changed or removed
+    in the database, the index has to be rebuilt.
+
+    === Instance Attributes ===
+    parent: {<eid>: <parent eid>}, roots are their own parent.
+    members: {<root eid>: {<eid>, ...}} everyone in the set of each root.
+    lock: guards <parent> and <members>.
+    """
+    parent: dict[int, int]
+    members: dict[int, set[int]]
+    lock: threading.RLock
+
+    def __init__(self, pairs: Iterable[tuple[int, int]] = ()) -> None:
+        """Initialize this index with every (<eid1>, <eid2>) pair in <pairs>."""
+        self.parent = {}
+        self.members = {}
+        self.lock = threading.RLock()
+        for eid1, eid2 in pairs:
+            self.union(eid1, eid2)
+
+    def find(self, eid: int) -> int:
+        """Return the root of the set containing <eid>."""
+        with self.lock:
+            if eid not in self.parent:
+                self.parent[eid] = eid
+                self.members[eid] = {eid}
+                return eid
+            while self.parent[eid] != eid:
+                # path halving
+                self.parent[eid] = self.parent[self.parent[eid]]
+                eid = self.parent[eid]
+            return eid
+
+    def union(self, eid1: int, eid2: int) -> None:
+        """Record that <eid1> and <eid2> have been on a trip together."""
+        with self.lock:
+            root1 = self.find(eid1)
+            root2 = self.find(eid2)
+            if root1 == root2:
+                return
+            # merge the smaller set into the larger one
+            if len(self.members[root1]) < len(self.members[root2]):
+                root1, root2 = root2, root1
+            self.parent[root2] = root1
+            self.members[root1] |= self.members.pop(root2)
+
+    def sphere(self, eid: int) -> list[int]:
+        """Return the workmate sphere of <eid>, not including <eid>."""
+        with self.lock:
+            if eid not in self.parent:
+                return []
+            return [other for other in self.members[self.find(eid)]
+                    if other != eid]
+
+    def groups(self) -> set[frozenset[int]]:
+        """Return every set of connected employees in this index."""
+        with self.lock:
+            return {frozenset(group) for group in self.members.values()}
+
+
+class TechnicianCalendar:
+    """Assigns technicians to truck maintenance, one truck at a time, on the
+    earliest day a qualified technician and the truck are both free, breaking
+    ties by the lowest eID.
+
+    Each truck type has a heap of (<next free day>, <eid>) for the technicians
+    that can maintain it, so placing a truck costs O(log k) for k technicians.
+    A technician who can maintain several truck types is in several heaps;
+    once they are booked their entries in the other heaps are out of date and
+    get corrected when they reach the top.
+
+    === Instance Attributes ===
+    next_free: {<eid>: <first day eid has no maintenance>}
+    heaps: {<trucktype>: [(<day>, <eid>)]} entries may be too early, never
+    too late.
+    tech_busy: {<eid>: {<date>, ...}} days each technician already has
+    maintenance, including the days booked by assign.
+    truck_busy: {<tid>: {<date>, ...}} days each truck already has a trip or
+    maintenance.
+    load: fills in <tech_busy> and <truck_busy> from a first to a last day
+    inclusive, None if they are complete from the start.
+    loaded_until: the first day <load> hasn't filled in yet.
+    """
+    next_free: dict[int, dt.date]
+    heaps: dict[str, list[tuple[dt.date, int]]]
+    tech_busy: dict[int, set[dt.date]]
+    truck_busy: dict[int, set[dt.date]]
+    load: Optional[Callable[[dt.date, dt.date], None]]
+    loaded_until: dt.date
+    _window: int
+
+    def __init__(self, first_day: dt.date, techs: Iterable[tuple[int, str]],
+                 tech_busy: dict[int, set[dt.date]],
+                 truck_busy: dict[int, set[dt.date]],
+                 load: Optional[Callable[[dt.date, dt.date], None]] = None,
+                 window: int = OCCUPANCY_WINDOW) -> None:
+        """Initialize a calendar starting on <first_day> for every
+        (<eid>, <trucktype>) pair in <techs>.
+
+        If <load> is given, <tech_busy> and <truck_busy> start out empty and
+        <load> is called for the first <window> days, then for twice as many
+        days after those whenever a later day is looked at.
+        """
+        self.next_free = {}
+        self.heaps = {}
+        self.tech_busy = tech_busy
+        self.truck_busy = truck_busy
+        self.load = load
+        self.loaded_until = first_day
+        self._window = window
+        for eid, trucktype in techs:
+            self.next_free[eid] = first_day
+            self.heaps.setdefault(trucktype, []).append((first_day, eid))
+        for heap in self.heaps.values():
+            heapq.heapify(heap)
+
+    def assign(self, tid: int, trucktype: str) -> Optional[tuple[int, dt.date]]:
+        """Book truck <tid> of type <trucktype> with a technician and return
+        (<eid>, <day>), or None if nobody can maintain <trucktype>.
+        """
+        heap = self.heaps.get(trucktype)
+        if not heap:
+            return None
+
+        best = None
+        popped = []
+        # usually the top technician works right away, but if the truck is
+        # busy on their day a later technician may be free earlier
+        while True:
+            top = self._top(heap)
+            if top is None or (best is not None and top > best):
+                break
+            popped.append(heapq.heappop(heap))
+            day, eid = top
+            while self._busy(self.truck_busy, tid, day) or day in self.tech_busy.get(eid, ()):
+                day += dt.timedelta(days=1)
+            if best is None or (day, eid) < best:
+                best = (day, eid)
+        for entry in popped:
+            heapq.heappush(heap, entry)
+
+        # a technician booked after next_free is still free on the days in
+        # between, which another truck may need
+        day, eid = best
+        self.tech_busy.setdefault(eid, set()).add(day)
+        while self.next_free[eid] in self.tech_busy[eid]:
+            self.next_free[eid] += dt.timedelta(days=1)
+        return eid, day
+
+    def _top(self, heap: list[tuple[dt.date, int]]) -> Optional[tuple[dt.date, int]]:
+        """Return the up to date smallest entry of <heap>, fixing out of date
+        entries on the way.
+        """
+        while heap:
+            day, eid = heap[0]
+            actual = self.next_free[eid]
+            while self._busy(self.tech_busy, eid, actual):
+                actual += dt.timedelta(days=1)
+            if actual == day:
+                return heap[0]
+            heapq.heapreplace(heap, (actual, eid))
+        return None
+
+    def _busy(self, busy: dict[int, set[dt.date]], key: int, day: dt.date) -> bool:
+        """Return whether <key> is busy on <day> according to <busy>, loading
+        <day> first if needed.
+        """
+        if (self.load is not None and day >= self.loaded_until):
+            last = max(day, self.loaded_until + dt.timedelta(days=self._window - 1))
+            self.load(self.loaded_until, last)
+            self._window = 2 * (last - self.loaded_until).days + 2
+            self.loaded_until = last + dt.timedelta(days=1)
+        return day in busy.get(key, ())
+
+
+# queries on the scheduling hot path, prepared once per connection by
+# PreparedStatements and then executed by name
+# {<name>: <query with $1, $2, ... parameters>}
+PREPARED_QUERIES = {
+    # schedule_trip
+    'ww_route': 'select wastetype, length from Route where rid = $1',
+    'ww_first_facility': 'select fid from facility where wastetype = $1 order by fid limit 1',
+    'ww_trucks_for_waste': 'select tid, trucktype from truck natural join trucktype where wastetype = $1 order by capacity desc, tid',
+    'ww_drivers': 'select eid, array_agg(trucktype) from driver natural join employee group by eid, hiredate order by hiredate, eid',
+    'ww_insert_trip': 'insert into Trip values ($1, $2, $3, NULL, $4, $5, $6)',
+    # schedule_trip with exclusion constraints, only the trips whose busy
+    # range overlaps the new one, found with the constraint's GiST index
+    'ww_trips_near': 'select t.rid, t.tid, t.eid1, t.eid2, t.ttime, r.length from Trip t join Route r on t.rid = r.rid where t.busy && tsrange($1, $2, \'[]\')',
+    'ww_route_on_day': 'select 1 from Trip where rid = $1 and ttime >= $2 and ttime < $3',
+    'ww_maintenance_on_day': 'select tid from Maintenance where mdate = $1',
+    # schedule_trip_batch
+    'ww_routes': 'select rid, wastetype, length from Route where rid = any($1)',
+    'ww_first_facilities': 'select distinct on (wastetype) wastetype, fid from facility order by wastetype, fid',
+    'ww_all_trucks': 'select wastetype, tid, trucktype from truck natural join trucktype order by capacity desc, tid',
+    # schedule_trips
+    'ww_truck_type': 'select trucktype from Truck where tid = $1',
+    'ww_drivers_on_day': 'select distinct eid1 as eid from Trip where ttime > $1 and ttime < $2 union select distinct eid2 as eid from Trip where ttime > $1 and ttime < $2',
+    'ww_drivers_of_type': 'select distinct eid from Driver where trucktype = $1 order by eid asc',
+    'ww_all_drivers': 'select distinct eid from Driver order by eid asc',
+    'ww_unscheduled_routes': 'select distinct rid from Route where wastetype in (select distinct wastetype from TruckType where trucktype = $1) and rid not in (select distinct rid from Trip where ttime > $2 and ttime < $3)',
+    'ww_route_waste_type': 'select wastetype from Route where rid = $1',
+    'ww_route_length': 'select length from Route where rid = $1',
+    'ww_insert_trip_with_volume': 'insert into Trip (rid, tid, ttime, volume, eid1, eid2, fid) values ($1, $2, $3, $4, $5, $6, $7)',
+    # schedule_fleet
+    'ww_trucks': 'select tid, trucktype, wastetype from truck natural join trucktype where tid = any($1) order by tid',
+    'ww_all_routes': 'select rid, wastetype, length from Route order by rid',
+    'ww_trips_between': 'select rid, tid, eid1, eid2, date(ttime) from Trip where ttime >= $1 and ttime < $2',
+    'ww_maintenance_between': 'select tid, mdate from Maintenance where mdate >= $1 and mdate <= $2',
+    # reroute_waste
+    'ww_facility_waste_type': 'select wastetype from Facility where fid = $1',
+    'ww_other_facility': 'select fid from Facility where wastetype = $1 and fid <> $2 order by fid asc',
+    'ww_reroute_trips': 'update Trip set fid = $1 where fid = $2 and ttime > $3 and ttime < $4',
+    # schedule_maintenance
+    'ww_technicians': 'select eid, trucktype from technician order by eid',
+    'ww_trucks_needing_maintenance': 'select tid, trucktype from Truck where tid not in '
+                                     '(select tid from Maintenance where mdate >= $1 and mdate <= $2) '
+                                     'order by tid',
+    # schedule_trips and schedule_maintenance with the Occupancy table of
+    # waste_wrangler_occupancy.sql, probes of its (day, kind, id) key
+    'ww_occupied_on_day': 'select id from Occupancy where day = $1 and kind = $2',
+    'ww_unscheduled_routes_occupied': 'select distinct rid from Route where wastetype in (select distinct wastetype from TruckType where trucktype = $1) and rid not in (select id from Occupancy where day = $2 and kind = \'route\')',
+    'ww_occupied_between': 'select kind, id, day from Occupancy where day between $1 and $2 and kind = any($3)',
+    # workmate_sphere, each step joins Trip on eID1 or eID2 so their indexes can be used
+    'ww_workmate_sphere': 'with recursive Sphere(eid) as ('
+                          'select $1::integer '
+                          'union '
+                          'select case when Trip.eid1 = Sphere.eid then Trip.eid2 else Trip.eid1 end '
+                          'from Sphere join Trip on Trip.eid1 = Sphere.eid or Trip.eid2 = Sphere.eid'
+                          ') select eid from Sphere where eid <> $1',
+}
+
+# prepared queries that only read slowly changing reference tables, and
+# which tables, so ReferenceCache can keep their results
+# {<name>: (<table>, ...)} table names are lowercase like in notifications
+CACHED_QUERIES = {
+    'ww_route': ('route',),
+    'ww_first_facility': ('facility',),
+    'ww_trucks_for_waste': ('truck', 'trucktype'),
+    'ww_drivers': ('driver', 'employee'),
+    'ww_first_facilities': ('facility',),
+    'ww_all_trucks': ('truck', 'trucktype'),
+    'ww_truck_type': ('truck',),
+    'ww_drivers_of_type': ('driver',),
+    'ww_all_drivers': ('driver',),
+    'ww_route_waste_type': ('route',),
+    'ww_route_length': ('route',),
+    'ww_all_routes': ('route',),
+    'ww_facility_waste_type': ('facility',),
+    'ww_other_facility': ('facility',),
+    'ww_technicians': ('technician',),
+}
+
+# channel the triggers in waste_wrangler_notify.sql send table names on
+REFERENCE_CHANNEL = 'waste_wrangler_reference'
+
+
+class PreparedStatements:
+    """Prepares the queries in PREPARED_QUERIES on the server the first time
+    each is used on a connection, and executes them by name afterwards so
+    Postgres parses and plans them only once per connection.
+
+    Connections are told apart by their backend process ID, so a connection
+    that has been reopened (e.g. by the pool after it broke) gets everything
+    prepared again.
+
+    === Instance Attributes ===
+    queries: {<name>: <query>} the statements that can be executed.
+    _prepared: {<id of connection>: (<backend pid>, {<name>, ...})}
+    """
+    queries: dict[str, str]
+    _prepared: dict[int, tuple[int, set[str]]]
+    _lock: threading.Lock
+
+    def __init__(self, queries: dict[str, str]) -> None:
+        self.queries = queries
+        self._prepared = {}
+        self._lock = threading.Lock()
+
+    def execute(self, cur: pg_ext.cursor, name: str, args: tuple = ()) -> None:
+        """Execute the statement <name> with <args> on <cur>, preparing it on
+        the cursor's connection first if needed.
+        """
+        conn = cur.connection
+        pid = conn.get_backend_pid()
+        with self._lock:
+            known_pid, names = self._prepared.get(id(conn), (None, set()))
+            if known_pid != pid: # new or reopened connection
+                names = set()
+                self._prepared[id(conn)] = (pid, names)
+            prepared = name in names
+        if not prepared:
+            cur.execute(f'prepare {name} as {self.queries[name]};')
+            with self._lock:
+                names.add(name)
+        if len(args) == 0:
+            cur.execute(f'execute {name};')
+        else:
+            cur.execute(f'execute {name} ({", ".join(["%s"] * len(args))});', args)
+
+    def forget(self, conn: pg_ext.connection) -> None:
+        """Stop tracking <conn>, e.g. because it has been closed."""
+        with self._lock:
+            self._prepared.pop(id(conn), None)
+
+
+class ReferenceCache:
+    """A process-local cache of query results on slowly changing reference
+    tables (see CACHED_QUERIES).
+
+    Entries expire after <ttl> seconds and the least recently used entry is
+    evicted once there are more than <max_entries>. When listening, a
+    background thread LISTENs on REFERENCE_CHANNEL and drops the entries of
+    every table named in a notification, so changes made anywhere are picked
+    up right away.
+
+    === Instance Attributes ===
+    ttl: seconds an entry stays valid.
+    max_entries: most entries kept at once.
+    entries: {(<query name>, <args>): (<expiry time>, <tables>, <rows>)}
+    oldest first.
+    """
+    ttl: float
+    max_entries: int
+    entries: collections.OrderedDict
+    _generation: int
+    _lock: threading.Lock
+    _stop: threading.Event
+    _listener: Optional[threading.Thread]
+
+    def __init__(self, ttl: float, max_entries: int) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self._generation = 0 # bumped on every invalidation
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._listener = None
+
+    def get(self, key: tuple, tables: tuple[str, ...],
+            load: Callable[[], list[tuple]]) -> list[tuple]:
+        """Return the cached rows for <key>, calling <load> to get them if
+        they aren't cached or have expired.
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                return entry[2]
+            generation = self._generation
+
+        rows = load()
+
+        with self._lock:
+            # don't store rows that may have been invalidated while loading
+            if generation == self._generation:
+                self.entries[key] = (time.monotonic() + self.ttl, tables, rows)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return rows
+
+    def invalidate(self, table: Optional[str] = None) -> None:
+        """Drop every entry read from <table>, or every entry if <table> is
+        None.
+        """
+        with self._lock:
+            self._generation += 1
+            if table is None:
+                self.entries.clear()
+                return
+            for key in [key for key, entry in self.entries.items()
+                        if table in entry[1]]:
+                del self.entries[key]
+
+    def listen(self, **connect_args) -> None:
+        """Start invalidating entries on notifications, using a separate
+        connection opened with <connect_args>.
+        """
+        self._listener = threading.Thread(target=self._listen, kwargs=connect_args, daemon=True)
+        self._listener.start()
+
+    def stop(self) -> None:
+        """Stop listening for notifications."""
+        self._stop.set()
+        if self._listener is not None:
+            self._listener.join()
+            self._listener = None
+
+    def _listen(self, **connect_args) -> None:
+        """Body of the listener thread. Reconnects when the connection breaks,
+        dropping every entry since notifications may have been missed.
+        """
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = pg.connect(**connect_args)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f'listen {REFERENCE_CHANNEL};')
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self.invalidate(conn.notifies.pop(0).payload)
+            except pg.Error:
+                self.invalidate()
+                self._stop.wait(1.0)
+            finally:
+                if conn is not None and not conn.closed:
+                    conn.close()
+
+
+# escapes a value for a line of COPY ... FROM STDIN in text format,
+# None becomes NULL
+def copy_escape(value: Optional[str]) -> str:
+    if value is None:
+        return '\\N'
+    return (value.replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+class CopyStream:
+    """A read-only file-like object that feeds <rows> to COPY ... FROM STDIN
+    in text format, producing lines only as they are read.
+    """
+    _lines: Iterator[str]
+    _buffer: str
+
+    def __init__(self, rows: Iterable[tuple[Optional[str], ...]]) -> None:
+        self._lines = ('\t'.join(copy_escape(value) for value in row) + '\n'
+                       for row in rows)
+        self._buffer = ''
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._buffer) < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            self._buffer += line
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def readline(self, size: int = -1) -> str:
+        if not self._buffer:
+            self._buffer = next(self._lines, '')
+        end = self._buffer.find('\n') + 1 or len(self._buffer)
+        if size >= 0:
+            end = min(end, size)
+        data, self._buffer = self._buffer[:end], self._buffer[end:]
+        return data
+
+
+# returns true if conn is open and answers a trivial query
+def _healthy(conn: pg_ext.connection) -> bool:
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute('select 1;')
+        conn.rollback()
+        return True
+    except pg.Error:
+        return False
+
+
+class ConnectionPool:
+    """A thread-safe pool holding between <min_size> and <max_size>
+    connections to the same database.
+
+    getconn blocks while all <max_size> connections are checked out, instead
+    of failing like psycopg2's pools do. Every connection is health checked
+    when it is checked out and replaced with a fresh one if it is broken.
+
+    === Instance Attributes ===
+    min_size: number of connections kept open while idle.
+    max_size: most connections that can be checked out at once.
+    """
+    min_size: int
+    max_size: int
+    _pool: pg_pool.ThreadedConnectionPool
+    _slots: threading.BoundedSemaphore
+
+    def __init__(self, min_size: int, max_size: int, **connect_args) -> None:
+        self.min_size = min_size
+        self.max_size = max_size
+        self._pool = pg_pool.ThreadedConnectionPool(min_size, max_size, **connect_args)
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    def getconn(self, timeout: Optional[float] = None) -> pg_ext.connection:
+        """Check out a healthy connection, waiting at most <timeout> seconds
+        (forever if None) for one to be returned.
+        """
+        if not self._slots.acquire(timeout=timeout):
+            raise pg_pool.PoolError('timed out waiting for a connection')
+        try:
+            conn = self._pool.getconn()
+            if not _healthy(conn):
+                # drop the broken connection, the pool opens a new one
+                self._pool.putconn(conn, close=True)
+                conn = self._pool.getconn()
+            return conn
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn: pg_ext.connection) -> None:
+        """Return <conn> to the pool. Any open transaction is rolled back and
+        broken connections are closed instead of reused.
+        """
+        try:
+            self._pool.putconn(conn, close=conn.closed != 0)
+        finally:
+            self._slots.release()
+
+    def closeall(self) -> None:
+        """Close every connection in the pool."""
+        self._pool.closeall()
+
+
+# the call being measured on the current thread and the explainer of its
+# Instrumentation, read by InstrumentedCursor
+_current_call = threading.local()
+
+
+class CallRecord:
+    """What a single call of a public WasteWrangler method did.
+
+    === Instance Attributes ===
+    method: name of the method.
+    queries: number of statements executed.
+    rows: number of rows the statements returned or changed.
+    db_time: seconds spent waiting for the database.
+    total_time: seconds the whole call took.
+    """
+    method: str
+    queries: int
+    rows: int
+    db_time: float
+    total_time: float
+
+    def __init__(self, method: str) -> None:
+        self.method = method
+        self.queries = 0
+        self.rows = 0
+        self.db_time = 0.0
+        self.total_time = 0.0
+
+    @property
+    def python_time(self) -> float:
+        """Seconds of the call spent outside the database."""
+        return max(0.0, self.total_time - self.db_time)
+
+
+class InstrumentedCursor(pg_ext.cursor):
+    """A cursor that adds every statement it runs to the CallRecord of the
+    current thread, if one is being measured, and hands it to the explainer
+    of the Instrumentation first if there is one. Otherwise it costs one
+    attribute lookup per statement.
+    """
+
+    def execute(self, query, vars=None):
+        record = getattr(_current_call, 'record', None)
+        if record is None:
+            return super().execute(query, vars)
+        explainer = getattr(_current_call, 'explainer', None)
+        if explainer is not None:
+            explainer(record.method, self, self.mogrify(query, vars).decode())
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record.db_time += time.perf_counter() - start
+            record.queries += 1
+            record.rows += max(self.rowcount, 0)
+
+    def copy_expert(self, sql, file, size=8192):
+        record = getattr(_current_call, 'record', None)
+        if record is None:
+            return super().copy_expert(sql, file, size)
+        start = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            record.db_time += time.perf_counter() - start
+            record.queries += 1
+            record.rows += max(self.rowcount, 0)
+
+
+class Histogram:
+    """Counts of observed values in buckets with fixed upper bounds.
+
+    === Instance Attributes ===
+    bounds: upper bound of every bucket but the last, ascending.
+    counts: number of values in each bucket, the last one is unbounded.
+    count: number of values observed.
+    total: sum of the values observed.
+    """
+    bounds: list[float]
+    counts: list[int]
+    count: int
+    total: float
+
+    def __init__(self, bounds: list[float]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        """Add <value> to this histogram."""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def quantile(self, q: float) -> float:
+        """Return the upper bound of the bucket holding the <q> quantile
+        (infinity for the last bucket, 0 if nothing was observed).
+        """
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= q * self.count:
+                return self.bounds[i] if i < len(self.bounds) else float('inf')
+        return 0.0
+
+    def summary(self) -> dict:
+        """Return count, mean, p50, p90, p99 and the buckets as a dict."""
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'buckets': dict(zip([*map(str, self.bounds), 'inf'], self.counts)),
+        }
+
+
+# bucket bounds for seconds (100us to ~100s) and for counts
+TIME_BUCKETS = [0.0001 * 2 ** i for i in range(21)]
+COUNT_BUCKETS = [float(2 ** i) for i in range(21)]
+
+
+class Instrumentation:
+    """Opt-in per-method statistics for a WasteWrangler: queries, rows, time
+    in the database and time in Python for each call of a public method, kept
+    in histograms.
+
+    === Instance Attributes ===
+    enabled: whether calls are measured at all.
+    exporter: called with the CallRecord of every measured call, or None.
+    explainer: called with the method, the cursor and the text of every
+    statement a measured call executes, right before it is executed, or
+    None. It must not use that cursor (see plans.py).
+    histograms: {<method>: {'queries' | 'rows' | 'db_time' | 'python_time':
+    <Histogram>}}
+    """
+    enabled: bool
+    exporter: Optional[Callable[[CallRecord], None]]
+    explainer: Optional[Callable[[str, pg_ext.cursor, str], None]]
+    histograms: dict[str, dict[str, Histogram]]
+    _lock: threading.Lock
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.exporter = None
+        self.explainer = None
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def measure(self, method: str, call: Callable, *args, **kwargs):
+        """Call <call> with <args> and <kwargs>, recording it as a call of
+        <method>. Calls made while another call is being measured on the same
+        thread count towards the outer call.
+        """
+        if getattr(_current_call, 'record', None) is not None:
+            return call(*args, **kwargs)
+        record = CallRecord(method)
+        _current_call.record = record
+        _current_call.explainer = self.explainer
+        start = time.perf_counter()
+        try:
+            return call(*args, **kwargs)
+        finally:
+            record.total_time = time.perf_counter() - start
+            _current_call.record = None
+            _current_call.explainer = None
+            self._add(record)
+
+    def _add(self, record: CallRecord) -> None:
+        with self._lock:
+            histograms = self.histograms.get(record.method)
+            if histograms is None:
+                histograms = {'queries': Histogram(COUNT_BUCKETS),
+                              'rows': Histogram(COUNT_BUCKETS),
+                              'db_time': Histogram(TIME_BUCKETS),
+                              'python_time': Histogram(TIME_BUCKETS)}
+                self.histograms[record.method] = histograms
+            histograms['queries'].observe(record.queries)
+            histograms['rows'].observe(record.rows)
+            histograms['db_time'].observe(record.db_time)
+            histograms['python_time'].observe(record.python_time)
+        if self.exporter is not None:
+            self.exporter(record)
+
+    def stats(self) -> dict[str, dict[str, dict]]:
+        """Return {<method>: {<measure>: <Histogram summary>}} for every
+        method measured so far.
+        """
+        with self._lock:
+            return {method: {name: histogram.summary()
+                             for name, histogram in histograms.items()}
+                    for method, histograms in self.histograms.items()}
+
+    def reset(self) -> None:
+        """Forget everything measured so far."""
+        with self._lock:
+            self.histograms = {}
+
+
+# errors a serializable transaction may fail with that go away on a retry
+RETRYABLE_ERRORS = (pg_errors.SerializationFailure, pg_errors.DeadlockDetected)
+# the methods SerializableRetry runs at SERIALIZABLE and retries
+SERIALIZABLE_METHODS = {'schedule_trip', 'schedule_trip_batch', 'schedule_trips',
+                        'schedule_fleet', 'schedule_maintenance'}
+
+
+class SerializableRetry:
+    """Runs the scheduling methods of a WasteWrangler at the SERIALIZABLE
+    isolation level, so that dispatchers in other processes can't book the
+    same truck or driver. When Postgres aborts a transaction because it
+    conflicted with another one, the method is called again after a random
+    exponential backoff.
+
+    Only transactions that actually read and wrote overlapping data
+    conflict, so nothing is locked up front.
+
+    === Instance Attributes ===
+    enabled: whether the scheduling methods run at SERIALIZABLE.
+    max_retries: how often a call is retried before its error is raised.
+    base_delay: the longest wait in seconds before the first retry, doubled
+    for every further retry.
+    max_delay: the longest wait in seconds before any retry.
+    calls, retries, failures: {<method>: <number of>} calls, retries and
+    calls that still failed after max_retries retries.
+    """
+    enabled: bool
+    max_retries: int
+    base_delay: float
+    max_delay: float
+    calls: collections.Counter
+    retries: collections.Counter
+    failures: collections.Counter
+    _sessions: dict[int, tuple[int, bool]]
+    _lock: threading.Lock
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.max_retries = 5
+        self.base_delay = 0.01
+        self.max_delay = 1.0
+        self.calls = collections.Counter()
+        self.retries = collections.Counter()
+        self.failures = collections.Counter()
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def session(self, conn: pg_ext.connection) -> None:
+        """Make every transaction of <conn> SERIALIZABLE if enabled, or the
+        server's default otherwise. Only changes the session if needed, after
+        rolling back any transaction left open on <conn>.
+        """
+        if not self.enabled and len(self._sessions) == 0: # never enabled
+            return
+        pid = conn.get_backend_pid()
+        with self._lock:
+            known_pid, serializable = self._sessions.get(id(conn), (None, False))
+        if known_pid != pid: # new or reopened connection, still at the default
+            serializable = False
+        if serializable == self.enabled:
+            return
+        # the session can only change between transactions; the methods end
+        # their own, so one still open here was abandoned and must not be
+        # committed along with the change
+        if conn.get_transaction_status() != pg_ext.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+        with conn.cursor() as cur:
+            if self.enabled:
+                cur.execute('set session characteristics as transaction isolation level serializable;')
+            else:
+                cur.execute('reset default_transaction_isolation;')
+        conn.commit()
+        with self._lock:
+            self._sessions[id(conn)] = (pid, self.enabled)
+
+    def run(self, method: str, conn: pg_ext.connection, call: Callable, *args, **kwargs):
+        """Call <call> with <args> and <kwargs> as a call of <method> on
+        <conn>, rolling back and calling it again whenever it fails with one
+        of RETRYABLE_ERRORS, up to max_retries times.
+        """
+        with self._lock:
+            self.calls[method] += 1
+        attempt = 0
+        while True:
+            try:
+                return call(*args, **kwargs)
+            except RETRYABLE_ERRORS:
+                conn.rollback()
+                if attempt >= self.max_retries:
+                    with self._lock:
+                        self.failures[method] += 1
+                    raise
+            # full jitter, so dispatchers that collided don't collide again
+            time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+            attempt += 1
+            with self._lock:
+                self.retries[method] += 1
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """Return {<method>: {'calls': ..., 'retries': ..., 'failures': ...}}
+        for every method run so far.
+        """
+        with self._lock:
+            return {method: {'calls': self.calls[method], 'retries': self.retries[method],
+                             'failures': self.failures[method]}
+                    for method in self.calls}
+
+    def reset(self) -> None:
+        """Forget the calls, retries and failures counted so far."""
+        with self._lock:
+            self.calls.clear()
+            self.retries.clear()
+            self.failures.clear()
+
+
+# decorator for public WasteWrangler methods: in pooled mode, checks out a
+# connection for the current thread for the duration of the call so that
+# self.connection refers to it, and returns it to the pool afterwards;
+# when instrumentation is enabled, also measures the call; in serializable
+# mode, retries the scheduling methods
+def _uses_connection(method: Callable) -> Callable:
+    def run(self: 'WasteWrangler', *args, **kwargs):
+        if getattr(self._local, 'running', False): # called by another public method
+            return method(self, *args, **kwargs)
+        self._local.running = True
+        try:
+            self.serializable.session(self.connection)
+            if not (self.serializable.enabled and method.__name__ in SERIALIZABLE_METHODS):
+                return method(self, *args, **kwargs)
+            return self.serializable.run(method.__name__, self.connection, method, self, *args, **kwargs)
+        finally:
+            self._local.running = False
+
+    def call(self: 'WasteWrangler', *args, **kwargs):
+        if self.pool is None or getattr(self._local, 'connection', None) is not None:
+            return run(self, *args, **kwargs)
+        self._local.connection = self.pool.getconn()
+        try:
+            return run(self, *args, **kwargs)
+        finally:
+            conn = self._local.connection
+            self._local.connection = None
+            self.pool.putconn(conn)
+
+    @functools.wraps(method)
+    def wrapper(self: 'WasteWrangler', *args, **kwargs):
+        if not self.instrumentation.enabled:
+            return call(self, *args, **kwargs)
+        return self.instrumentation.measure(method.__name__, call, self, *args, **kwargs)
+    return wrapper
+
+
 class WasteWrangler:
     """A class that can work with data conforming to the schema in
     waste_wrangler_schema.ddl.
 
+    A WasteWrangler either owns a single connection (see connect) or a pool
+    of connections (see connect_pool). In pooled mode every public method
+    checks out its own connection, so one instance can be shared by many
+    threads.
+
     === Instance Attributes ===
     connection: connection to a PostgreSQL database of a waste management
-    service.
+    service. In pooled mode, the connection checked out by the current thread.
+    pool: the connection pool in pooled mode, None otherwise.
+    availability: busy trucks and drivers per day, used by schedule_trip.
+    statements: the prepared statements of the scheduling methods.
+    reference_cache: the cache of reference tables if it has been enabled
+    with enable_reference_cache, None otherwise.
+    instrumentation: per-method query and latency statistics, off unless
+    enable_instrumentation has been called.
+    workmates: the workmate sphere index if it has been built with
+    build_workmate_index, None otherwise.
+    exclusion_constraints: True once enable_exclusion_constraints found the
+    constraints of waste_wrangler_exclusion.sql in the database.
+    occupancy: True once enable_occupancy found the Occupancy table of
+    waste_wrangler_occupancy.sql in the database.
+    serializable: runs the scheduling methods at SERIALIZABLE with retries
+    and counts the retries, off unless enable_serializable has been called.
 
     Representation invariants:
     - The database to which connection is established conforms to the schema
       in waste_wrangler_schema.ddl.
     """
-    connection: Optional[pg_ext.connection]
+    pool: Optional[ConnectionPool]
+    availability: AvailabilityIndex
+    statements: PreparedStatements
+    reference_cache: Optional[ReferenceCache]
+    instrumentation: Instrumentation
+    workmates: Optional[WorkmateIndex]
+    exclusion_constraints: bool
+    occupancy: bool
+    serializable: SerializableRetry
+    _connection: Optional[pg_ext.connection]
+    _connect_args: dict
+    _local: threading.local
 
     def __init__(self) -> None:
         """Initialize this WasteWrangler instance, with no database connection
         yet.
         """
-        self.connection = None
+        self._connection = None
+        self._local = threading.local()
+        self.pool = None
+        self.availability = AvailabilityIndex()
+        self.statements = PreparedStatements(PREPARED_QUERIES)
+        self.reference_cache = None
+        self.instrumentation = Instrumentation()
+        self.workmates = None
+        self.exclusion_constraints = False
+        self.occupancy = False
+        self.serializable = SerializableRetry()
+        self._connect_args = {}
+
+    @property
+    def connection(self) -> Optional[pg_ext.connection]:
+        if self.pool is not None:
+            return getattr(self._local, 'connection', None)
+        return self._connection
+
+    @connection.setter
+    def connection(self, connection: Optional[pg_ext.connection]) -> None:
+        self._connection = connection
 
     def connect(self, dbname: str, username: str, password: str) -> bool:
         """Establish a connection to the database <dbname> using the
@@ -117,10 +1804,36 @@ class WasteWrangler:
         False
         """
         try:
-            self.connection = pg.connect(
+            self._connect_args = dict(
                 dbname=dbname, user=username, password=password,
-                options="-c search_path=waste_wrangler"
+                options="-c search_path=waste_wrangler",
+                cursor_factory=InstrumentedCursor
             )
+            self.connection = pg.connect(**self._connect_args)
+            self.availability = AvailabilityIndex() # new database, new indexes
+            self.workmates = None
+            return True
+        except pg.Error:
+            return False
+
+    def connect_pool(self, dbname: str, username: str, password: str,
+                     min_size: int = 1, max_size: int = 10) -> bool:
+        """Like connect, but open a pool of <min_size> to <max_size>
+        connections instead of a single connection. Public methods then check
+        out a connection per call and this WasteWrangler can be used from
+        several threads at once.
+
+        Return True if the pool was created successfully, False otherwise.
+        """
+        try:
+            self._connect_args = dict(
+                dbname=dbname, user=username, password=password,
+                options="-c search_path=waste_wrangler",
+                cursor_factory=InstrumentedCursor
+            )
+            self.pool = ConnectionPool(min_size, max_size, **self._connect_args)
+            self.availability = AvailabilityIndex() # new database, new indexes
+            self.workmates = None
             return True
         except pg.Error:
             return False
@@ -138,12 +1851,131 @@ class WasteWrangler:
         True
         """
         try:
-            if self.connection and not self.connection.closed:
-                self.connection.close()
+            if self._connection and not self._connection.closed:
+                self.statements.forget(self._connection)
+                self._connection.close()
+            if self.pool is not None:
+                self.pool.closeall()
+                self.pool = None
+            if self.reference_cache is not None:
+                self.reference_cache.stop()
+                self.reference_cache = None
             return True
         except pg.Error:
             return False
 
+    def enable_reference_cache(self, ttl: float = 300, max_entries: int = 1024,
+                               listen: bool = True) -> None:
+        """Cache the results of queries on reference tables (Route, Facility,
+        Employee, Driver, Technician, Truck and TruckType) for up to <ttl>
+        seconds, keeping at most <max_entries> results.
+
+        If <listen> is True, a background connection listens for the
+        notifications sent by the triggers in waste_wrangler_notify.sql and
+        drops cached results as soon as their tables change. Without those
+        triggers, changes are only picked up once entries expire.
+
+        Pre-condition: connect or connect_pool has been called successfully.
+        """
+        if self.reference_cache is not None:
+            self.reference_cache.stop()
+        self.reference_cache = ReferenceCache(ttl, max_entries)
+        if listen:
+            self.reference_cache.listen(**self._connect_args)
+
+    def enable_instrumentation(self, exporter: Optional[Callable[[CallRecord], None]] = None,
+                               explainer: Optional[Callable[[str, pg_ext.cursor, str], None]] = None
+                               ) -> None:
+        """Start measuring every call of a public method: number of queries,
+        rows returned or changed, time spent in the database and time spent
+        in Python. Results are available from self.instrumentation.stats()
+        and, if <exporter> is given, it is called with the CallRecord of every
+        call as soon as the call returns. If <explainer> is given, it sees
+        every statement before it runs, see Instrumentation.
+        """
+        self.instrumentation.exporter = exporter
+        self.instrumentation.explainer = explainer
+        self.instrumentation.enabled = True
+
+    def disable_instrumentation(self) -> None:
+        """Stop measuring calls. What was measured so far is kept."""
+        self.instrumentation.enabled = False
+
+    def enable_serializable(self, max_retries: int = 5, base_delay: float = 0.01,
+                            max_delay: float = 1.0) -> None:
+        """Run schedule_trip, schedule_trip_batch, schedule_trips,
+        schedule_fleet and schedule_maintenance at the SERIALIZABLE isolation
+        level, so that several dispatcher processes can schedule against the
+        same database. A call that conflicts with another dispatcher is rolled
+        back and retried up to <max_retries> times, waiting a random time of
+        up to <base_delay> seconds, doubled on every retry but never more than
+        <max_delay>. If it still fails, its error is raised.
+
+        The isolation level is set for the session, so every other method
+        runs at SERIALIZABLE too, but without retries: update_technicians
+        raises the serialization failure (it has already read its file and
+        can't be called again), reroute_waste returns 0 and
+        reroute_waste_bulk returns 0 for every facility.
+
+        Retries are counted in self.serializable.stats().
+        """
+        self.serializable.max_retries = max_retries
+        self.serializable.base_delay = base_delay
+        self.serializable.max_delay = max_delay
+        self.serializable.enabled = True
+
+    def disable_serializable(self) -> None:
+        """Go back to the default isolation level, without retries. What was
+        counted so far is kept.
+        """
+        self.serializable.enabled = False
+
+    @_uses_connection
+    def enable_exclusion_constraints(self) -> bool:
+        """Let the database reject trips that are too close to another trip
+        of their truck or drivers, using the exclusion constraints of
+        waste_wrangler_exclusion.sql. schedule_trip then only reads the trips
+        around the new one, instead of every trip of its day, and schedulers
+        in other processes can't double-book a crew.
+
+        Return True iff the constraints exist in the database, and only
+        switch to them in that case.
+        """
+        cur = self.connection.cursor()
+        try:
+            cur.execute("select count(*) from pg_constraint where conname in "
+                        "('trip_truck_busy', 'trip_driver_busy');")
+            self.exclusion_constraints = cur.fetchone()[0] == 2
+            cur.execute('commit;')
+            return self.exclusion_constraints
+        finally:
+            cur.close()
+
+    @_uses_connection
+    def enable_occupancy(self) -> bool:
+        """Read busy trucks, drivers, routes and technicians from the
+        Occupancy table of waste_wrangler_occupancy.sql, which triggers keep
+        up to date. schedule_trip, schedule_trips and schedule_maintenance
+        then only read the rows of the days they look at, one index probe
+        each, instead of re-deriving them from Trip and Maintenance.
+
+        Return True iff the table exists in the database, and only switch to
+        it in that case.
+        """
+        cur = self.connection.cursor()
+        try:
+            cur.execute("select to_regclass('waste_wrangler.occupancy') is not null;")
+            self.occupancy = cur.fetchone()[0]
+            cur.execute('commit;')
+            with self.availability.lock:
+                if (self.availability.occupancy != self.occupancy):
+                    self.availability.occupancy = self.occupancy
+                    self.availability.invalidate()
+            return self.occupancy
+        finally:
+            cur.close()
+
+    @_uses_connection
     def schedule_trip(self, rid: int, time: dt.datetime) -> bool:
         """Schedule a truck and two employees to the route identified
         with <rid> at the given time stamp <time> to pick up an
@@ -192,117 +2024,193 @@ class WasteWrangler:
         cur = self.connection.cursor()
         cur.execute('begin;')
         cur.execute('savepoint sp_schedule_trip;')
+        reserved = None # (<rid>, <tid>, <eid1>, <eid2>, <time>, <length>) booked into the index
 
         try:
-            # obtaining desired wasteType for the route
-            r_wasteType = ""
-            cur.execute(f'select wastetype from Route where rid={rid};')
-            for row in cur:
-                r_wasteType = row[0]
-            
-            r_drivers = {} # {<eid>: <hiredate>}
-            r_trucks = {} # {<tid>: <capacity>}
-
-            # filters out employees that are not drivers
-            cur.execute(f'select distinct eid, hiredate from driver natural join employee;')
-            for row in cur:
-                r_drivers[row[0]] = row[1]
-                
-            # filters out trucks that cannot handle r_wasteType and trucks scheduled for a maintenance on the same day
-            cur.execute(f'select tid, capacity from truck natural join trucktype natural join maintenance where mdate<>\'{time.date()}\' and wastetype=\'{r_wasteType}\';')
-            for row in cur:
-                r_trucks[row[0]] = int(row[1])
-
-            # Trying to filter out any trucks OR drivers that are busy (i.e. scheduled on a trip during the same time as the given time)
-            # filters out trucks that are scheduled for maintenance on the same day, matched with their routes, and filters invalid rID's
-            cur.execute('select t.tid, eid1, eid2, ttime, length, t.rid from trip t, maintenance m, Route r where t.tid=m.tid and date(ttime)<>mdate and t.rid=r.rid;')
-            for row in cur:
-                tid = row[0]
-                eid1 = row[1]
-                eid2 = row[2]
-                truck_time = row[3]
-                length = row[4]
-                rid_prime = row[5]
-                
-                # if a trip has already been scheduled for this rid on the same day
-                if (rid == rid_prime and time.date() == truck_time.date()):
-                    cur.close()
-                    return False
-            
-                # print(f"truck time: {truck_time}, given_time: {time}")
-                if (not valid_truck_time(truck_time, time, length)):
-                    # invalid time, removing invalid drivers and trucks
-                    r_drivers.pop(eid1, None)
-                    r_drivers.pop(eid2, None)
-                    r_trucks.pop(tid, None)
-                    
-
-            # if no suitable drivers or trucks
-            if (len(r_drivers) < 2 or len(r_trucks) == 0):
+            # obtaining desired wasteType and length for the route
+            rows = self._fetch(cur, 'ww_route', (rid,))
+            if (len(rows) == 0): # invalid rid
+                cur.execute('rollback;')
                 return False
-            
+            r_wasteType, length = rows[0]
+
             # picking a facility with matching r_wastetype
-            final_facility = -1
-            cur.execute(f'select fid from facility where wastetype=\'{r_wasteType}\';')
-            for row in cur:
-                final_facility = row[0]
-                break
-            if (final_facility == -1): # edge case: if no suitable facility
-                cur.close()
+            rows = self._fetch(cur, 'ww_first_facility', (r_wasteType,))
+            if (len(rows) == 0): # edge case: if no suitable facility
+                cur.execute('rollback;')
                 return False
-            
-            final_eid1 = -1
-            final_eid2 = -1
-            # oldest = dt.datetime(9999, 12, 31) # initialzie to date 9999-12-31
-            
-            # for eid1 - always the oldest hire date
-            final_eid1 = min(r_drivers, key=lambda k: r_drivers[k])
-            del r_drivers[final_eid1]
-            
-            # check if this employee can drive the wasteType
-            cur.execute(f'select exists (select * from driver natural join trucktype where eid={final_eid1} and wastetype=\'{r_wasteType}\');')
-            for row in cur:
-                if (row[0] == True):
-                    at_least_one_wasteType = True
-
-            if (at_least_one_wasteType):
-                # eid2 just has to be second oldest 
-                final_eid2 = min(r_drivers, key=lambda k: r_drivers[k]) 
-            else:
-                # eid2 has to be the oldest driver that matches the wasteType
-                sorted_drivers = sorted(r_drivers, key=lambda k: r_drivers[k]) # sort the dict into a list based on hiredate 
-                for i in sorted_drivers:
-                    cur.execute(f'select exists (select * from driver natural join trucktype where eid={i} and wastetype=\'{r_wasteType}\');')
-                    for row in cur:
-                        if (row[0] == True):
-                            final_eid2 = i
-                    if (final_eid2 != -1):
-                        break
-            
+            final_facility = rows[0][0]
 
-            final_tid = -1
-            final_cap = -1
-            for key, value in r_trucks.items(): # sort by capacity {<tid>: <capacity>}
-                if (value == final_cap): # edge case: prioritize smaller tid #
-                    final_tid = min(final_tid, key)
-                elif (value > final_cap):
-                    final_cap = value
-                    final_tid = key
+            # trucks that can handle r_wasteType, largest capacity first, then lowest tid
+            r_trucks = self._fetch(cur, 'ww_trucks_for_waste', (r_wasteType,))
 
-                
-            cur.execute(f'insert into Trip values ({rid}, {final_tid}, \'{time}\', NULL, {final_eid1}, {final_eid2}, {final_facility});')    
+            # drivers with the truck types they can drive, most experienced first, then lowest eid
+            r_drivers = self._fetch(cur, 'ww_drivers')
+
+            if (self.exclusion_constraints):
+                crew = self._schedule_trip_excluding(cur, rid, time, length, final_facility,
+                                                     r_trucks, r_drivers)
+                if (crew is None):
+                    cur.execute('rollback;')
+                    return False
+                reserved = (rid, *crew, time, length)
+                self.availability.add_trip(*reserved)
+                cur.execute('commit;')
+                self._add_workmates(crew[1], crew[2])
+                return True
+
+            # everything that is busy on this day, loaded once per day;
+            # a serializable transaction has to read it itself to see conflicts
+            busy = self.availability.day(cur, time.date(), fresh=self.serializable.enabled)
+            with self.availability.lock:
+                crew = choose_crew(busy, rid, time, length, r_trucks, r_drivers)
+                if (crew is None): # no suitable truck or drivers
+                    cur.execute('rollback;')
+                    return False
+                final_tid, final_eid1, final_eid2 = crew
+                # reserve the crew right away so no other thread can pick it
+                busy.add_trip(rid, final_tid, final_eid1, final_eid2, time, trip_end(time, length))
+                reserved = (rid, final_tid, final_eid1, final_eid2, time, length)
+
+            self.statements.execute(cur, 'ww_insert_trip',
+                                    (rid, final_tid, time, final_eid1, final_eid2, final_facility))
             cur.execute('commit;')
-            cur.close()
+            self._add_workmates(final_eid1, final_eid2)
             return True
-            
+
         except pg.Error as ex:
             # You may find it helpful to uncomment this line while debugging,
             # as it will show you all the details of the error that occurred:
-            cur.execute('rollback to sp_schedule_trip;')
-            cur.close()
+            # a retried call starts over in a new transaction, so end this one
+            # either way
+            self.connection.rollback()
+            if (reserved is not None): # take back the crew that was never inserted
+                self.availability.remove_trip(*reserved)
             raise ex
             # return False
+
+        finally:
+            cur.close()
         
+    @_uses_connection
+    def schedule_trip_batch(self, requests: Iterable[tuple[int, dt.datetime]],
+                            optimal: bool = False) -> list[bool]:
+        """Schedule a trip for every (<rid>, <time>) pair in <requests>, in
+        order, choosing trucks, drivers and facilities exactly like
+        schedule_trip does.
+
+        If <optimal>, requests are not served one after the other. Requests
+        on the same day whose trips overlap, and so can't share a truck or
+        driver, are matched with trucks and drivers together by
+        choose_crews: trucks, first drivers and second drivers are each
+        matched so that as many requests as possible get one, with the best
+        the group can get as a whole. This can schedule fewer requests than
+        possible when some drivers can't drive some of the trucks.
+
+        Reference data is read once for the whole batch and every request sees
+        the trips accepted before it. All accepted trips are inserted with a
+        single multi-row insert in one transaction.
+
+        Return a list with one entry per request, True iff that request was
+        scheduled. If the insert fails, nothing is scheduled and every entry
+        is False.
+        """
+        requests = list(requests)
+        results = [False] * len(requests)
+        if (len(requests) == 0):
+            return results
+
+        cur = self.connection.cursor()
+        cur.execute('begin;')
+        cur.execute('savepoint sp_schedule_trip_batch;')
+        if (self.serializable.enabled): # the transaction has to read the days itself
+            for _, time in requests:
+                self.availability.invalidate(time.date())
+        r_routes = {} # {<rid>: (<wastetype>, <length>)}
+        new_trips = [] # [(<rid>, <tid>, <time>, <eid1>, <eid2>, <fid>)] booked into the index
+
+        try:
+            # wasteType and length of every requested route
+            for row in self._fetch(cur, 'ww_routes', (list({rid for rid, _ in requests}),)):
+                r_routes[row[0]] = (row[1], row[2])
+
+            # lowest fid per wastetype
+            r_facilities = {} # {<wastetype>: <fid>}
+            for row in self._fetch(cur, 'ww_first_facilities'):
+                r_facilities[row[0]] = row[1]
+
+            # trucks per wastetype, largest capacity first, then lowest tid
+            r_trucks = {} # {<wastetype>: [(<tid>, <trucktype>)]}
+            all_trucks = self._fetch(cur, 'ww_all_trucks')
+            for row in all_trucks:
+                r_trucks.setdefault(row[0], []).append((row[1], row[2]))
+
+            # drivers with the truck types they can drive, most experienced first, then lowest eid
+            r_drivers = self._fetch(cur, 'ww_drivers')
+
+            if (optimal):
+                # trucks with every waste type they can carry, in priority order
+                r_fleet = {} # {<tid>: (<trucktype>, {<wastetype>, ...})}
+                for wastetype, tid, trucktype in all_trucks:
+                    r_fleet.setdefault(tid, (trucktype, set()))[1].add(wastetype)
+                r_fleet = [(tid, trucktype, wastetypes) for tid, (trucktype, wastetypes) in r_fleet.items()]
+
+                for group in self._overlapping_groups(requests, r_routes, r_facilities):
+                    group_requests = [] # [(<rid>, <time>, <length>, <wastetype>)]
+                    for i in group:
+                        rid, time = requests[i]
+                        r_wasteType, length = r_routes[rid]
+                        group_requests.append((rid, time, length, r_wasteType))
+                    busy = self.availability.day(cur, requests[group[0]][1].date())
+                    with self.availability.lock:
+                        crews = choose_crews(busy, group_requests, r_fleet, r_drivers)
+                        for i, (rid, time, length, r_wasteType), crew in zip(group, group_requests, crews):
+                            if (crew is None):
+                                continue
+                            busy.add_trip(rid, crew[0], crew[1], crew[2], time, trip_end(time, length))
+                            new_trips.append((rid, crew[0], time, crew[1], crew[2], r_facilities[r_wasteType]))
+                            results[i] = True
+            else:
+                for i, (rid, time) in enumerate(requests):
+                    if (rid not in r_routes):
+                        continue
+                    r_wasteType, length = r_routes[rid]
+                    if (r_wasteType not in r_facilities):
+                        continue
+
+                    # book accepted trips straight into the index so later
+                    # requests in the batch (and other threads) see them
+                    busy = self.availability.day(cur, time.date())
+                    with self.availability.lock:
+                        crew = choose_crew(busy, rid, time, length, r_trucks.get(r_wasteType, []), r_drivers)
+                        if (crew is None):
+                            continue
+                        final_tid, final_eid1, final_eid2 = crew
+                        busy.add_trip(rid, final_tid, final_eid1, final_eid2, time, trip_end(time, length))
+                    new_trips.append((rid, final_tid, time, final_eid1, final_eid2, r_facilities[r_wasteType]))
+                    results[i] = True
+
+            if (len(new_trips) > 0):
+                pg_extras.execute_values(cur, 'insert into Trip (rid, tid, ttime, eid1, eid2, fid) values %s;',
+                                         new_trips, page_size=len(new_trips))
+            cur.execute('commit;')
+            cur.close()
+            for _, _, _, eid1, eid2, _ in new_trips:
+                self._add_workmates(eid1, eid2)
+            return results
+
+        except pg.Error as ex:
+            if (not self._retryable(ex)):
+                cur.execute('rollback to sp_schedule_trip_batch;')
+            cur.close()
+            # take back the trips that were booked but never inserted
+            for rid, tid, time, eid1, eid2, _ in new_trips:
+                self.availability.remove_trip(rid, tid, eid1, eid2, time, r_routes[rid][1])
+            if (self._retryable(ex)):
+                raise ex
+            return [False] * len(requests)
+
+    @_uses_connection
     def schedule_trips(self, tid: int, date: dt.date) -> int:
         # TODO: implement this method
         cursor = self.connection.cursor()
@@ -314,85 +2222,177 @@ class WasteWrangler:
             #cursor.execute("SELECT DISTINCT wasteType from TruckType, Truck where Truck.TruckType=TruckType.TruckType;", (tid,))
             #carryWaste = cursor.fetchall()
             #print(carryWaste)
-            cursor.execute("SELECT TruckType from Truck where tid = %s;", (tid,))
-            tT = cursor.fetchone()[0]
+            tT = self._fetch(cursor, 'ww_truck_type', (tid,))[0][0]
             dayOne = dt.datetime.combine(date, dt.datetime.min.time())
             dayTwo = dt.datetime.combine(date+ dt.timedelta(days=1), dt.datetime.min.time())
-            cursor.execute("SELECT DISTINCT eid1 as eid FROM Trip where tTIME > %s and tTime < %s "
-                           "UNION "
-                           "SELECT DISTINCT eid2 as eid FROM Trip where tTIME > %s and tTime < %s;", (dayOne,dayTwo,dayOne,dayTwo,))
+            if (self.occupancy):
+                self.statements.execute(cursor, 'ww_occupied_on_day', (date, 'driver'))
+            else:
+                self.statements.execute(cursor, 'ww_drivers_on_day', (dayOne, dayTwo))
             Disqualified = cursor.fetchall()
             dis = []
             for item in Disqualified:
                 dis.append(item[0])
 
-            cursor.execute("SELECT DISTINCT eID from Driver "
-                           " where TruckType=%s "
-                            "ORDER BY eid ASC;", (tT,))
-            firstDriver = cursor.fetchall()
-            i = 0
-            while(True):
-                if(firstDriver[i][0] is not None):
-                    if(firstDriver[i][0] not in Disqualified):
-                        firstD = firstDriver[i][0]
-                        break
-                    i += 1
-                else:
-                    return 0
-            if(len(firstDriver) == 0):
+            # first driver: lowest eid that can drive the truck and has no trip that day
+            firstDriver = self._fetch(cursor, 'ww_drivers_of_type', (tT,))
+            firstD = -1
+            for row in firstDriver:
+                if(row[0] not in dis):
+                    firstD = row[0]
+                    break
+            if(firstD == -1):
                 return 0
-            firstD = firstDriver[0][0]
-            
 
-            cursor.execute("SELECT DISTINCT eID from Driver"
-                           " ORDER BY eid ASC;")
-            secDriver = cursor.fetchall()
-            i = 0
-            while(True):
-                if(secDriver[i][0] is not None):
-                    secD = secDriver[i][0]
-                    if((secD != firstD) and (secD not in Disqualified)):
-                        break
-                    i+= 1
-                else:
-                    return 0
+            # second driver: lowest other eid that has no trip that day
+            secDriver = self._fetch(cursor, 'ww_all_drivers')
+            secD = -1
+            for row in secDriver:
+                if((row[0] != firstD) and (row[0] not in dis)):
+                    secD = row[0]
+                    break
+            if(secD == -1):
+                return 0
 
-            cursor.execute("Select distinct rID from Route where "
-                           " Route.WasteType in (Select DISTINCT TruckType.WasteType from TruckType where TruckType.TruckType = %s) and "
-                            " rID not in (SELECT DISTINCT rID FROM Trip where tTime > %s and tTime < %s)", (tT,dayOne,dayTwo,))
+            if (self.occupancy):
+                self.statements.execute(cursor, 'ww_unscheduled_routes_occupied', (tT, date))
+            else:
+                self.statements.execute(cursor, 'ww_unscheduled_routes', (tT, dayOne, dayTwo))
             notTrip = cursor.fetchall()
             yesnt = True
             tripped = 0
+            scheduled = [] # [(<rid>, <eid1>, <eid2>, <time>, <length>)] for the index, once committed
             givenTime = dt.datetime.combine(date, dt.time(hour=0, minute=0, second=0))
             givenTime = givenTime + dt.timedelta(hours=8)
             
             while(yesnt and (tripped < len(notTrip))):
-                cursor.execute("Select WasteType from Route where rID = %s;", (notTrip[tripped],))
-                WasteID = cursor.fetchone()
-                cursor.execute("Select fID from Facility where wasteType = %s order by fID ASC;", (WasteID,))
-                fID = cursor.fetchone()
-                cursor.execute("Select length from Route where rID = %s;", (notTrip[tripped],))
-                length = cursor.fetchone()
+                WasteID = self._fetch(cursor, 'ww_route_waste_type', (notTrip[tripped][0],))[0]
+                fID = self._fetch(cursor, 'ww_first_facility', (WasteID[0],))[0]
+                length = self._fetch(cursor, 'ww_route_length', (notTrip[tripped][0],))[0]
                 projectTime = givenTime + dt.timedelta(hours=(length[0]/5))
                 if(projectTime.time() <=  dt.time(15, 30)):
                     if(firstD > secD):
-                        cursor.execute('INSERT INTO Trip (rID, tID, tTIME, volume, eID1, eID2, fID) VALUES (%s, %s, %s, %s, %s, %s, %s)', (notTrip[tripped], tid, givenTime, None, firstD, secD, fID))    
+                        self.statements.execute(cursor, 'ww_insert_trip_with_volume', (notTrip[tripped][0], tid, givenTime, None, firstD, secD, fID[0]))
                     else:
-                        cursor.execute('INSERT INTO Trip (rID, tID, tTIME, volume, eID1, eID2, fID) VALUES (%s, %s, %s, %s, %s, %s, %s)', (notTrip[tripped], tid, givenTime, None, secD, firstD, fID))
-                    cursor.execute('commit;')
+                        self.statements.execute(cursor, 'ww_insert_trip_with_volume', (notTrip[tripped][0], tid, givenTime, None, secD, firstD, fID[0]))
+                    scheduled.append((notTrip[tripped][0], max(firstD, secD), min(firstD, secD), givenTime, length[0]))
                     givenTime = projectTime
                     tripped += 1
                 else:
                     yesnt = False
-                        
+
+            # one commit for all trips, so a serializable retry or an error
+            # never leaves some of them behind
+            cursor.execute('commit;')
+            cursor.close()
+            for rid, eid1, eid2, time, length in scheduled:
+                self.availability.add_trip(rid, tid, eid1, eid2, time, length)
+            if (len(scheduled) > 0):
+                self._add_workmates(firstD, secD)
             return tripped
 
             
         except pg.Error as ex:
-            cur.execute('rollback to sp_schedule_trips;')
-            cur.close()
+            if (self._retryable(ex)):
+                cursor.close()
+                raise ex
+            cursor.execute('rollback to sp_schedule_trips;')
+            cursor.close()
             return 0
 
+    @_uses_connection
+    def schedule_fleet(self, tids: Iterable[int], first_day: dt.date,
+                       last_day: dt.date, processes: int = 1) -> dict[int, int]:
+        """Schedule trips for every truck in <tids> on every day from
+        <first_day> to <last_day> inclusive, each truck and day planned like
+        schedule_trips plans them, but with more than 30 minutes between the
+        trips of a truck (see plan_truck_day). Days are planned in order and trucks in
+        ascending order of tid, so a truck only gets drivers and routes that
+        no earlier truck got on the same day.
+
+        A truck is skipped on days it already has a trip or is scheduled for
+        maintenance.
+
+        If <processes> is more than 1, the fleet is split by waste type with
+        partition_fleet and the parts are planned in a pool of that many
+        processes. Every driver is given to one part up front, so the plans
+        can't clash and the result only depends on the data, but a driver
+        can't help out in another part. Drivers may therefore be picked
+        differently than with a single process.
+
+        Routes, trucks, drivers, facilities and the existing trips are read
+        once, and all trips are inserted with a single multi-row insert in one
+        transaction.
+
+        Return {<tid>: <number of trips scheduled>} for every tid in <tids>.
+        Your method should NOT throw an error. If an error occurs, nothing is
+        scheduled and every count is 0.
+        """
+        tids = sorted(set(tids))
+        counts = {tid: 0 for tid in tids}
+        if (len(tids) == 0 or last_day < first_day):
+            return counts
+
+        cur = self.connection.cursor()
+        cur.execute('begin;')
+        cur.execute('savepoint sp_schedule_fleet;')
+        try:
+            trucks = {} # {<tid>: (<trucktype>, {<wastetype>, ...})}
+            for tid, trucktype, wastetype in self._fetch(cur, 'ww_trucks', (tids,)):
+                trucks.setdefault(tid, (trucktype, set()))[1].add(wastetype)
+            facilities = dict(self._fetch(cur, 'ww_first_facilities')) # {<wastetype>: <fid>}
+            # routes without a facility for their waste can't be scheduled
+            routes = [route for route in self._fetch(cur, 'ww_all_routes') if route[1] in facilities]
+            waste_types = {rid: wastetype for rid, wastetype, _ in routes}
+            drivers = sorted((eid, set(trucktypes)) for eid, trucktypes in self._fetch(cur, 'ww_drivers'))
+
+            # what is already taken per day
+            taken_drivers = collections.defaultdict(set) # {<date>: {<eid>, ...}}
+            taken_routes = collections.defaultdict(set) # {<date>: {<rid>, ...}}
+            busy_trucks = collections.defaultdict(set) # {<date>: {<tid>, ...}}
+            for rid, tid, eid1, eid2, tdate in self._fetch(
+                    cur, 'ww_trips_between',
+                    (dt.datetime.combine(first_day, dt.time(0, 0)),
+                     dt.datetime.combine(last_day + dt.timedelta(days=1), dt.time(0, 0)))):
+                taken_drivers[tdate].update((eid1, eid2))
+                taken_routes[tdate].add(rid)
+                busy_trucks[tdate].add(tid)
+            for tid, mdate in self._fetch(cur, 'ww_maintenance_between', (first_day, last_day)):
+                busy_trucks[mdate].add(tid)
+
+            if (processes <= 1):
+                planned = plan_fleet(first_day, last_day, trucks, routes, drivers,
+                                     taken_drivers, taken_routes, busy_trucks)
+            else:
+                planned = plan_fleet_parallel(first_day, last_day, trucks, routes, drivers,
+                                              taken_drivers, taken_routes, busy_trucks, processes)
+
+            new_trips = [] # [(<rid>, <tid>, <time>, <eid1>, <eid2>, <fid>)]
+            for trip in planned:
+                new_trips.append(trip + (facilities[waste_types[trip[0]]],))
+                counts[trip[1]] += 1
+
+            if (len(new_trips) > 0):
+                pg_extras.execute_values(cur, 'insert into Trip (rid, tid, ttime, eid1, eid2, fid) values %s;',
+                                         new_trips, page_size=1000)
+            cur.execute('commit;')
+            cur.close()
+
+            lengths = {rid: length for rid, _, length in routes}
+            for rid, tid, time, eid1, eid2, _ in new_trips:
+                self.availability.add_trip(rid, tid, eid1, eid2, time, lengths[rid])
+                self._add_workmates(eid1, eid2)
+            return counts
+
+        except pg.Error as ex:
+            if (self._retryable(ex)):
+                cur.close()
+                raise ex
+            cur.execute('rollback to sp_schedule_fleet;')
+            cur.close()
+            return {tid: 0 for tid in counts}
+
+    @_uses_connection
     def update_technicians(self, qualifications_file: TextIO) -> int:
         """Given the open file <qualifications_file> that follows the format
         described on the handout, update the database to reflect that the
@@ -413,93 +2413,41 @@ class WasteWrangler:
               truck type.
             * The employee is a driver.
 
-        Hint: We have provided a helper _read_qualifications_file that you
-            might find helpful for completing this method.
+        The file is parsed lazily with _iter_qualifications_file, so files
+        of any size can be used.
         """
         # If the given eID is not in employee or if the given eID belongs to a driver, then it's considered an invalid entry. 
+        # The file is streamed into a staging table with COPY and validated
+        # in one statement, so it is never held in memory as a whole.
         cur = self.connection.cursor()
         cur.execute('begin;')
         cur.execute('savepoint sp_update_technicians;')
         
         try:
-            # reading and parsing text file
-            master_list = self._read_qualifications_file(qualifications_file) # [[<first>, <surname>, <trucktype]]
-            # print(master_list) # debug
-
-            # obtain all VALID employees (no drivers allowed)
-            valid_employees = {} # {<full name>: <eid>}
-            cur.execute('create temp view NonDrivers as(select eid from employee except select eid from driver);')
-            cur.execute('select name, eid from NonDrivers natural join employee;')
-            for row in cur:
-                valid_employees[row[0]] = row[1]
-            
-            # obtain all trucktypes
-            all_trucktypes = []
-            cur.execute('select distinct trucktype from trucktype;')
-            for row in cur:
-                all_trucktypes.append(row[0])
-                
-            # link all technicians with their trucktype(s)
-            all_techs = {} # {<eid>: [<trucktype1>, <trucktype2>, ...]}
-            temp_list = []
-            first_time = True
-            head_eid = 0
-            cur.execute('select eid, trucktype from technician;')
-            for row in cur:
-                # print(f"eid: {row[0]}, trucktype: {row[1]}")
-                current_eid = row[0]
-                if (first_time):
-                    head_eid = current_eid
-                    first_time = False
-                
-                if (current_eid != head_eid):
-                    # we've moved onto the next employee
-                    all_techs[head_eid] = temp_list
-                    temp_list = []
-                    head_eid = current_eid
-                
-                temp_list.append(row[1]) # appending trucktype
-            all_techs[head_eid] = temp_list # for last eid
-            
-            # print(all_techs)
-            count = 0
-            prev_inserts = [] # [[<eid>, <trucktype>]], list that holds duplicate entries
-                        
-            # cycle through the master list of all the names
-            for entry in master_list: # [[<first>, <last>, <trucktype>]]
-                # check if employee exists
-                # print(entry[0]+" "+entry[1])
-                if (valid_employees.get(entry[0]+" "+entry[1]) is None): # checks if the name is in the employee list
-                    continue # employee name DNE, gg go next
-    
-                # valid eid exists!
-                eid = valid_employees.get(entry[0]+" "+entry[1])
-            
-                # check if it's a valid truck type
-                if (entry[2] not in all_trucktypes):
-                    continue
+            # staging table lives for the session, empty it in case it was used before
+            cur.execute('create temp table if not exists QualificationStaging (name varchar(101), trucktype varchar(50));')
+            cur.execute('truncate QualificationStaging;')
+
+            # reading and parsing text file lazily, one entry at a time
+            entries = ((first + " " + last, trucktype)
+                       for first, last, trucktype in self._iter_qualifications_file(qualifications_file))
+            cur.copy_expert('copy QualificationStaging (name, trucktype) from stdin;', CopyStream(entries))
+
+            # valid entries: the employee exists and isn't a driver, the trucktype exists and
+            # the technician isn't recorded for it yet; distinct drops duplicates in the file
+            cur.execute('insert into Technician (eid, trucktype) '
+                        'select distinct e.eid, s.trucktype '
+                        'from QualificationStaging s join Employee e on e.name = s.name '
+                        'where s.trucktype in (select trucktype from TruckType) '
+                        'and e.eid not in (select eid from Driver) '
+                        'and not exists (select * from Technician t where t.eid = e.eid and t.trucktype = s.trucktype);')
+            count = cur.rowcount
+            cur.execute('truncate QualificationStaging;')
 
-                # check if this employee is not recorded as a technician yet
-                if (all_techs.get(eid) is None): 
-                    count += 1
-                    cur.execute(f'insert into Technician values ({eid}, \'{entry[2]}\');')
-                
-                else: 
-                    # check what trucktypes this technician can already work with
-                    if (entry[2] not in all_techs.get(eid)): # entry[2] is the trucktype
-                        # only insert if trucktype being inserted is new
-
-                        for sublist in prev_inserts: # edge case: inserting duplicates since the table hasn't registered yet
-                            # check if there ISN'T a duplicate entry
-                            if (not (eid == sublist[0] and entry[2] == sublist[1])): 
-                                count += 1 
-                                cur.execute(f'insert into Technician values ({eid}, \'{entry[2]}\');')
-                                break
-                            
-                        prev_inserts.append([eid, entry[2]])
-                        
             cur.execute('commit;')
             cur.close()
+            if (self.reference_cache is not None): # don't wait for the notification
+                self.reference_cache.invalidate('technician')
             return count
 
         except pg.Error as ex:
@@ -510,6 +2458,7 @@ class WasteWrangler:
             raise ex
             # return 0
 
+    @_uses_connection
     def workmate_sphere(self, eid: int) -> list[int]:
         """Return the workmate sphere of the driver identified by <eid>, as a
         list of eIDs.
@@ -527,41 +2476,136 @@ class WasteWrangler:
         Your method should NOT return an error. If an error occurs, your method
         should simply return an empty list.
         """
-        # conn = pg.connect("dbname=csc343h-zhaoluji user=zhaoluji password=")
-        # cursor = conn.cursor()
-        # cur.execute('set search_path to waste_wrangler;')
+        if (self.workmates is not None): # answer from the index
+            return self.workmates.sphere(eid)
+
         cur = self.connection.cursor()
         cur.execute('begin;')
         cur.execute('savepoint WorkSphere_Reset;')
         try:
-            # TODO: implement this method
-            # Assume Those worksphere doesn't consider time        
-            cur.execute("SELECT DISTINCT eid1 as eid FROM Trip where eid2 = %s UNION SELECT DISTINCT eid2 as eid FROM Trip where eid1 = %s;", (eid,eid,))
-            unprocessed = cur.fetchall()
-            if(len(unprocessed)==0):
-                return []
-            
-            processed = []
-            placeHolder = []
-            newEid = 0;
-            while(unprocessed):
-                 newEid = unprocessed[0]
-                 #print(newEid)
-                 unprocessed.pop(0)
-                 if(newEid[0] not in processed and newEid[0] != eid):
-                     processed.append(newEid[0])
-                     cur.execute("SELECT DISTINCT eid1 as eid FROM Trip where eid2 = %s UNION SELECT DISTINCT eid2 as eid FROM Trip where eid1 = %s;", (newEid,newEid,))
-                     placeHolder = cur.fetchall()
-                     unprocessed.extend(placeHolder)
-
-            return processed
-            
+            # Assume Those worksphere doesn't consider time
+            # the whole traversal runs as one recursive query, union (not
+            # union all) drops employees that were already reached
+            sphere = [row[0] for row in self._fetch(cur, 'ww_workmate_sphere', (eid,))]
+            cur.execute('commit;')
+            cur.close()
+            return sphere
+
         except pg.Error as ex:
             cur.execute('rollback to WorkSphere_Reset;')
             cur.close()
             raise ex
             return []
 
+    @_uses_connection
+    def workmate_spheres(self, eids: Iterable[int]) -> dict[int, list[int]]:
+        """Return {<eid>: <workmate sphere of eid>} for every eid in <eids>,
+        with the same spheres workmate_sphere would return.
+
+        Every pair of workmates is read once and each connected group of
+        employees is walked once, no matter how many of its members are in
+        <eids>.
+
+        Your method should NOT return an error. If an error occurs, your method
+        should simply return an empty dict.
+        """
+        eids = list(eids)
+        if (self.workmates is not None): # answer from the index
+            return {eid: self.workmates.sphere(eid) for eid in eids}
+
+        cur = self.connection.cursor()
+        cur.execute('begin;')
+        cur.execute('savepoint WorkSpheres_Reset;')
+        try:
+            # adjacency map of everyone who has been on a trip together
+            workmates = {} # {<eid>: {<eid>, ...}}
+            cur.execute("SELECT DISTINCT eid1, eid2 FROM Trip;")
+            for eid1, eid2 in cur.fetchall():
+                workmates.setdefault(eid1, set()).add(eid2)
+                workmates.setdefault(eid2, set()).add(eid1)
+            cur.execute('commit;')
+            cur.close()
+
+            spheres = {} # {<eid>: <set of everyone in eid's group>}
+            for eid in eids:
+                if (eid in spheres):
+                    continue
+                if (eid not in workmates): # never been on a trip
+                    spheres[eid] = {eid}
+                    continue
+                group = {eid}
+                unprocessed = [eid]
+                while (unprocessed):
+                    for other in workmates[unprocessed.pop()]:
+                        if (other not in group):
+                            group.add(other)
+                            unprocessed.append(other)
+                # everyone in the group has the same sphere
+                for member in group:
+                    spheres[member] = group
+
+            return {eid: [other for other in spheres[eid] if other != eid]
+                    for eid in eids}
+
+        except pg.Error:
+            cur.execute('rollback to WorkSpheres_Reset;')
+            cur.close()
+            return {}
+
+    @_uses_connection
+    def build_workmate_index(self) -> bool:
+        """(Re)build the workmate sphere index from every trip in the
+        database. From then on workmate_sphere and workmate_spheres are
+        answered from the index, which is kept up to date with the trips this
+        WasteWrangler schedules.
+
+        Return True iff the index was built. This method should NOT throw an
+        error.
+        """
+        try:
+            self.workmates = WorkmateIndex(self._read_workmate_pairs())
+            return True
+        except pg.Error:
+            return False
+
+    @_uses_connection
+    def verify_workmate_index(self) -> bool:
+        """Return True iff the workmate sphere index has been built and groups
+        employees exactly like the trips currently in the database do.
+
+        This method should NOT throw an error, if an error occurs it returns
+        False.
+        """
+        if (self.workmates is None):
+            return False
+        try:
+            fresh = WorkmateIndex(self._read_workmate_pairs())
+        except pg.Error:
+            return False
+        return fresh.groups() == self.workmates.groups()
+
+    @_uses_connection
+    def preload_availability(self, first_day: dt.date, last_day: dt.date) -> int:
+        """Load the busy trucks and drivers of every day from <first_day> to
+        <last_day> inclusive into the availability index at once, from a
+        columnar snapshot (see columnar.py) instead of two queries per day.
+        Needs NumPy.
+
+        Return the number of days loaded, 0 if an error occurs.
+        """
+        from columnar import ColumnarSnapshot
+        try:
+            snapshot = ColumnarSnapshot.load(self.connection, ('Trip', 'Route', 'Maintenance'),
+                                             first_day, last_day)
+        except pg.Error as ex:
+            if (self._retryable(ex)):
+                raise
+            return 0
+        days = snapshot.busy_days(first_day, last_day)
+        self.availability.preload(days)
+        return len(days)
+
+    @_uses_connection
     def schedule_maintenance(self, date: dt.date) -> int:
         """For each truck whose most recent maintenance before <date> happened
         over 90 days before <date>, and for which there is no scheduled
@@ -598,89 +2642,72 @@ class WasteWrangler:
             one_plus_date = date + dt.timedelta(days=1)
             all_trucks = {} # {<tid>: <truckType>}, can use dict b/c key, value is unique
 
-            # lists all tids that have not had a maintenance AND a trip on one_plus_date
-            cur.execute(f'create temp view RecentMaintenance as(select tid from maintenance where mdate>=\'{before_date}\' and mdate<=\'{after_date}\');')
-            cur.execute(f'create temp view TripOnDay as(select tid from trip where date(ttime)=\'{one_plus_date}\');')
-            cur.execute('create temp view NoMaintenance as((select tid from truck except select tid from RecentMaintenance)except select tid from TripOnDay);')
-            cur.execute('select tid, trucktype from NoMaintenance natural join truck order by tid;')
-            for row in cur:
+            # lists all tids that have not had a maintenance recently or scheduled soon
+            # (trips are handled per day by the calendar below)
+            for row in self._fetch(cur, 'ww_trucks_needing_maintenance', (before_date, after_date)):
                 all_trucks[row[0]] = row[1]
-                
+
             if (len(all_trucks) == 0): # edge case: no trucks need maintenance
+                cur.execute('rollback;')
                 cur.close()
                 return 0
-            
-            # print(all_trucks) # debug
 
-            # task: need to find all available techs one day = 1+date that can maintain the trucks in all_trucks
-            # note: one tech can maintain multiple trucks on the same day
-            # also, a tech can only handle one truckType
-            # Use "natural LEFT join" b/c could exist a tech that has never had a maintance record yet
-            all_techs = [] # [<eid>, <trucktype>, <availability>]
+            # every (technician, trucktype) pair, a tech can handle several trucktypes
+            all_techs = self._fetch(cur, 'ww_technicians') # [(<eid>, <trucktype>)]
+
+            # days from one_plus_date on that technicians and trucks are already busy
+            tech_busy = {} # {<eid>: {<date>, ...}}
+            truck_busy = {} # {<tid>: {<date>, ...}}
+            load = None
+            if (self.occupancy):
+                # only the days the calendar gets to, a window at a time
+                def load(first: dt.date, last: dt.date) -> None:
+                    rows = self._fetch(cur, 'ww_occupied_between',
+                                       (first, last, ['technician', 'maintenance', 'truck']))
+                    for kind, resource, day in rows:
+                        busy = tech_busy if kind == 'technician' else truck_busy
+                        busy.setdefault(resource, set()).add(day)
+            else:
+                cur.execute('select tid, eid, mdate from maintenance where mdate >= %s;', (one_plus_date,))
+                for tid, eid, mdate in cur.fetchall():
+                    tech_busy.setdefault(eid, set()).add(mdate)
+                    truck_busy.setdefault(tid, set()).add(mdate)
+                cur.execute('select distinct tid, date(ttime) from trip where ttime >= %s;', (one_plus_date,))
+                for tid, tdate in cur.fetchall():
+                    truck_busy.setdefault(tid, set()).add(tdate)
+
+            # match techs with trucks in ascending order of tids
+            # - a tech can only handle one truck per day
+            # -- earliest day first, then lowest eid
+            calendar = TechnicianCalendar(one_plus_date, all_techs, tech_busy, truck_busy, load)
             final_list = [] # [<tid>, <eid>, <date>]
-            tech_availability = {} # {<eid>: <availability>}
-
-            # obtain all available technicains 
-            cur.execute(f'create temp view UnavailableTechs as(select eid from maintenance where mdate=\'{one_plus_date}\');')
-            cur.execute('create temp view AvailableTechs as (select eid from technician except select eid from UnavailableTechs);')
-            cur.execute('select distinct eid, trucktype from AvailableTechs natural left join technician order by eid;')
-            for row in cur:
-                all_techs.append([row[0], row[1], one_plus_date])
-                tech_availability[row[0]] = one_plus_date
-            
-            # match available techs with trucks
-            # - a tech can only handel one truck per day
-            # -- if no techs available that day, schedule for next day
             for tid, trucktype in all_trucks.items():
+                match = calendar.assign(tid, trucktype)
+                if (match is not None): # None if no tech can maintain this trucktype
+                    final_list.append([tid, match[0], match[1]])
 
-                current_date = one_plus_date
-                need_to_schedule = True
-                match_possible = False
-                while (need_to_schedule):
-                
-                    count_techs = 0
-                    for techs in all_techs: # [<eid>, <trucktype>, <availability>]
-                        if (trucktype == techs[1]): # if trucktype matches (need this b/c maybe there's no tech available whatsoever)
-                            match_possible = True
-                            
-                            # if (current_date == techs[2]): # if tech is available on current_date
-                            if (current_date == tech_availability[techs[0]]): # if tech is available on current_date
-                                final_list.append([tid, techs[0], current_date])
-                                need_to_schedule = False
-                                
-                                # need to update availability for every tech instances of trucktype
-                                # techs[2] = techs[2] + dt.timedelta(days=1) # update availability for tech
-                                tech_availability[techs[0]] = tech_availability[techs[0]] + dt.timedelta(days=1) # update availability for tech
-                                break
-                            
-                        count_techs += 1
-                                
-                    # print(f"current date: {current_date}")
-                    if (not match_possible): # if no techs available for truck, we skip this truck
-                        break 
-                    elif (count_techs == len(all_techs)): # match might still be possible, but no techs available on current_date
-                        current_date = current_date + dt.timedelta(days=1)
-                                
-                        
             # insert into maintenance table
             # Maintenance(tid, eid, date)
-            for row in final_list:
-                cur.execute(f'insert into maintenance values ({row[0]}, {row[1]}, \'{row[2]}\');')
-                
-            # print(final_list) # debug
+            if (len(final_list) > 0):
+                pg_extras.execute_values(cur, 'insert into Maintenance (tid, eid, mdate) values %s;',
+                                         final_list, page_size=1000)
 
             cur.execute('commit;')
             cur.close()
+            for row in final_list:
+                self.availability.add_maintenance(row[0], row[2])
             return len(final_list) 
             
         except pg.Error as ex:
             # You may find it helpful to uncomment this line while debugging,
             # as it will show you all the details of the error that occurred:
-            cur.execute('rollback to sp_schedule_maintenance;')
+            if (not self._retryable(ex)):
+                cur.execute('rollback to sp_schedule_maintenance;')
             cur.close()
             raise ex
             # return 0
 
+    @_uses_connection
     def reroute_waste(self, fid: int, date: dt.date) -> int:
         """Reroute the trips to <fid> on day <date> to another facility that
         takes the same type of waste. If there are many such facilities, pick
@@ -699,42 +2726,191 @@ class WasteWrangler:
 
         Assume this happens before any of the trips have reached <fid>.
         """
-        
-        
         cur = self.connection.cursor()
         cur.execute('begin;')
-        cur.execute('savepoint reroute_waste;')
         try:
-            cur.execute("SELECT wasteType from Facility where fid = %s;", (fid,))
-            row = cur.fetchone()
-            sameWasteType = row[0]
-            cur.execute("SELECT fid from Facility where wasteType = %s and fid <> %s order by fid ASC;", (sameWasteType,fid,))
-            replaceFid = cur.fetchone()[0]
-            cur.execute("Select tID from Trip where fid = %s and tTIME > %s;", (fid ,date,))
-            newRow = cur.fetchall()
-            if len(newRow)==0:
+            row = self._fetch(cur, 'ww_facility_waste_type', (fid,))
+            if (len(row) == 0): # invalid fid
+                cur.execute('rollback;')
+                return 0
+            sameWasteType = row[0][0]
+            replacement = self._fetch(cur, 'ww_other_facility', (sameWasteType, fid))
+            if (len(replacement) == 0): # no other facility takes this waste type
+                cur.execute('rollback;')
                 return 0
-            cur.execute("Update Trip Set fid = %s where fid = %s and tTIME > %s and tTime < %s;", (replaceFid, fid ,date, date+dt.timedelta(days=1),))
+            replaceFid = replacement[0][0]
+            self.statements.execute(cur, 'ww_reroute_trips', (replaceFid, fid, date, date + dt.timedelta(days=1)))
+            rerouted = cur.rowcount
             cur.execute('commit;')
+            return rerouted
 
-            cur.close()
-            return True
-
-        except pg.Error as ex:
+        except pg.Error:
             # You may find it helpful to uncomment this line while debugging,
             # as it will show you all the details of the error that occurred:
             # raise ex
-            cur.execute('rollback to reroute_waste;')
+            self.connection.rollback()
+            return 0
+        finally:
             cur.close()
-            raise ex
-            return False
-        
-        
-        
-        
+
+    @_uses_connection
+    def reroute_waste_bulk(self, outages: Iterable[tuple[int, dt.date, dt.date]]) -> dict[int, int]:
+        """For every (<fid>, <first day>, <last day>) in <outages>, reroute the
+        trips to <fid> from <first day> to <last day> inclusive to another
+        facility that takes the same type of waste, like reroute_waste does.
+
+        The replacement is the facility with the smallest fID that takes the
+        same type of waste and is not down itself at any point during the
+        outage. Outages without a replacement reroute nothing.
+
+        All trips are rerouted with a single update in one transaction.
+
+        Return {<fid>: <number of re-routed trips>} for every fid in
+        <outages>. Your method should NOT return an error. If an error occurs,
+        no trips are re-routed and every count is 0.
+        """
+        outages = list(outages)
+        counts = count_reroutes(outages, ())
+        if (len(outages) == 0):
+            return counts
+
+        cur = self.connection.cursor()
+        cur.execute('begin;')
+        cur.execute('savepoint reroute_waste_bulk;')
+        try:
+            # facilities per wastetype, smallest fid first
+            waste_types = {} # {<fid>: <wastetype>}
+            facilities = {} # {<wastetype>: [<fid>, ...]}
+            cur.execute('select fid, wastetype from Facility order by fid;')
+            for fid, wastetype in cur.fetchall():
+                waste_types[fid] = wastetype
+                facilities.setdefault(wastetype, []).append(fid)
+
+            reroutes = choose_replacements(outages, waste_types, facilities)
+            if (len(reroutes) > 0):
+                rerouted = pg_extras.execute_values(
+                    cur,
+                    'update Trip set fid = o.new_fid '
+                    'from (values %s) as o(old_fid, new_fid, first_time, last_time) '
+                    'where Trip.fid = o.old_fid and Trip.ttime >= o.first_time and Trip.ttime < o.last_time '
+                    'returning o.old_fid;',
+                    reroutes, template='(%s, %s, %s::timestamp, %s::timestamp)',
+                    page_size=len(reroutes), fetch=True)
+                counts = count_reroutes(outages, (row[0] for row in rerouted))
+
+            cur.execute('commit;')
+            cur.close()
+            return counts
+
+        except pg.Error:
+            cur.execute('rollback to reroute_waste_bulk;')
+            cur.close()
+            return count_reroutes(outages, ())
 
     # =========================== Helper methods ============================= #
 
+    def _read_workmate_pairs(self) -> list[tuple[int, int]]:
+        """Helper for the workmate sphere index. Return every distinct
+        (eID1, eID2) pair in Trip.
+        """
+        cur = self.connection.cursor()
+        try:
+            cur.execute('select distinct eid1, eid2 from Trip;')
+            pairs = cur.fetchall()
+            self.connection.commit()
+            return pairs
+        finally:
+            cur.close()
+
+    def _fetch(self, cur: pg_ext.cursor, name: str, args: tuple = ()) -> list[tuple]:
+        """Helper for the scheduling methods. Execute the prepared statement
+        <name> with <args> on <cur> and return all of its rows, or return them
+        from the reference cache if it is enabled and <name> is cacheable.
+        """
+        def load() -> list[tuple]:
+            self.statements.execute(cur, name, args)
+            return cur.fetchall()
+
+        if (self.reference_cache is None or name not in CACHED_QUERIES):
+            return load()
+        return self.reference_cache.get((name, args), CACHED_QUERIES[name], load)
+
+    def _schedule_trip_excluding(self, cur: pg_ext.cursor, rid: int, time: dt.datetime,
+                                 length: float, fid: int, trucks: list[tuple[int, str]],
+                                 drivers: list[tuple[int, list[str]]]
+                                 ) -> Optional[tuple[int, int, int]]:
+        """Helper for schedule_trip with exclusion constraints. Choose a crew
+        from the trips whose busy range overlaps the new trip's and insert
+        the trip. If another scheduler got one of the crew first, the
+        database rejects the insert and the crew is chosen again, up to
+        EXCLUSION_RETRIES times.
+
+        Return (<tid>, <eid1>, <eid2>) of the inserted trip, or None if no
+        trip was inserted.
+        """
+        end = trip_end(time, length)
+        midnight = dt.datetime.combine(time.date(), dt.time(0, 0))
+        for _ in range(EXCLUSION_RETRIES + 1):
+            busy = BusyDay()
+            if (len(self._fetch(cur, 'ww_route_on_day',
+                                (rid, midnight, midnight + dt.timedelta(days=1)))) > 0):
+                busy.routes.add(rid)
+            busy.maintenance.update(row[0] for row in
+                                    self._fetch(cur, 'ww_maintenance_on_day', (time.date(),)))
+            for t_rid, t_tid, eid1, eid2, ttime, t_length in self._fetch(
+                    cur, 'ww_trips_near', (time, end + TRIP_BUFFER)):
+                busy.add_trip(t_rid, t_tid, eid1, eid2, ttime, trip_end(ttime, t_length))
+
+            crew = choose_crew(busy, rid, time, length, trucks, drivers)
+            if (crew is None):
+                return None
+            cur.execute('savepoint sp_exclusion;')
+            try:
+                self.statements.execute(cur, 'ww_insert_trip', (rid, crew[0], time, crew[1], crew[2], fid))
+                return crew
+            except pg_errors.ExclusionViolation:
+                cur.execute('rollback to sp_exclusion;')
+        return None
+
+    @staticmethod
+    def _overlapping_groups(requests: list[tuple[int, dt.datetime]],
+                            routes: dict[int, tuple[str, float]],
+                            facilities: dict[str, int]) -> list[list[int]]:
+        """Helper for schedule_trip_batch. Split the requests that have a
+        route and a facility into groups of requests on the same day whose
+        trips all overlap each other, in the order they start. Return the
+        indexes in <requests> of every group, in ascending order.
+        """
+        valid = sorted((time, i) for i, (rid, time) in enumerate(requests)
+                       if rid in routes and routes[rid][0] in facilities)
+        groups = []
+        group_end = None # everyone in the group is busy until then
+        for time, i in valid:
+            end = trip_end(time, routes[requests[i][0]][1]) + TRIP_BUFFER
+            # sorted by start, so the trip overlaps every trip in the group
+            # iff it starts before the earliest of them is free again
+            if (group_end is not None and time.date() == groups[-1][0][0].date() and time <= group_end):
+                groups[-1].append((time, i))
+                group_end = min(group_end, end)
+            else:
+                groups.append([(time, i)])
+                group_end = end
+        return [sorted(i for _, i in group) for group in groups]
+
+    def _retryable(self, ex: pg.Error) -> bool:
+        """Helper for the scheduling methods. Return True iff <ex> has to be
+        left to SerializableRetry, which rolls back the whole transaction and
+        calls the method again.
+        """
+        return self.serializable.enabled and isinstance(ex, RETRYABLE_ERRORS)
+
+    def _add_workmates(self, eid1: int, eid2: int) -> None:
+        """Helper for the methods that insert trips. Record that <eid1> and
+        <eid2> are now workmates, if the workmate sphere index is in use.
+        """
+        if (self.workmates is not None):
+            self.workmates.union(eid1, eid2)
+
     @staticmethod
     def _read_qualifications_file(file: TextIO) -> list[list[str, str, str]]:
         """Helper for update_technicians. Accept an open file <file> that
@@ -763,6 +2939,22 @@ class WasteWrangler:
 
         return result
 
+    @staticmethod
+    def _iter_qualifications_file(file: TextIO) -> Iterator[tuple[str, str, str]]:
+        """Helper for update_technicians. Like _read_qualifications_file, but
+        yield each (<first name>, <last name>, <truck type>) entry as soon as
+        it has been read instead of returning a list of all of them.
+
+        Pre-condition:
+            <file> follows the format given on the A2 handout.
+        """
+        fname, lname = None, None
+        for idx, line in enumerate(file):
+            if idx % 2 == 0:
+                fname, lname = line.strip().split(' ')[-2:]
+            else:
+                yield fname, lname, line.strip()
+
 
 def setup(dbname: str, username: str, password: str, file_path: str) -> None:
     """Set up the testing environment for the database <dbname> using the
@@ -843,6 +3035,13 @@ def test_preliminary() -> None:
         assert not scheduled_trip, \
             f"[Schedule Trip] Expected False, Got {scheduled_trip}"
 
+        # a failed call leaves no transaction open, also for an invalid rid
+        for rid in (1, 9999):
+            ww.schedule_trip(rid, dt.datetime(2023, 5, 4, 13, 0))
+            status = ww.connection.get_transaction_status()
+            assert status == pg_ext.TRANSACTION_STATUS_IDLE, \
+                f"[Schedule Trip] Expected an idle connection, Got status {status}"
+
         # """
         # -------------------- Testing schedule_trips  ------------------------#
 
@@ -903,6 +3102,728 @@ def test_preliminary() -> None:
         ww.disconnect()
 
 
+# checks that every trip in <planned> is within working hours and that every
+# two trips sharing a truck or driver are valid for each other according to
+# valid_truck_time, and more than TRIP_BUFFER apart
+# planned: [(<rid>, <tid>, <ttime>, <eid1>, <eid2>)]
+# lengths: {<rid>: <length>}
+def _check_trip_gaps(name: str, planned: list[tuple[int, int, dt.datetime, int, int]],
+                     lengths: dict[int, float]) -> None:
+    for rid, _, start, _, _ in planned:
+        assert start.time() >= DAY_START and \
+            trip_end(start, lengths[rid]) <= dt.datetime.combine(start.date(), DAY_END) - TRIP_BUFFER, \
+            f"[{name}] Expected route {rid} at {start} within working hours"
+    for a, b in itertools.combinations(sorted(planned, key=lambda trip: trip[2]), 2):
+        if (a[1] != b[1] and not {a[3], a[4]} & {b[3], b[4]}):
+            continue
+        assert valid_truck_time(a[2], b[2], lengths[b[0]]) and valid_truck_time(b[2], a[2], lengths[a[0]]), \
+            f"[{name}] Expected {a} and {b} to be valid for each other"
+        assert trip_end(a[2], lengths[a[0]]) + TRIP_BUFFER < b[2], \
+            f"[{name}] Expected more than {TRIP_BUFFER} between {a} and {b}"
+
+
+def test_min_cost_matching() -> None:
+    """Test that min_cost_matching matches as many rows as possible at the
+    lowest cost, against a brute force search on small random instances.
+    Needs no database.
+    """
+    rng = random.Random(343)
+    for _ in range(200):
+        columns = list(range(rng.randint(1, 5)))
+        rows = [set(rng.sample(columns, rng.randint(0, len(columns)))) for _ in range(rng.randint(1, 4))]
+        matched = min_cost_matching(rows, columns)
+        used = [column for column in matched if column is not None]
+        assert len(used) == len(set(used)) and \
+            all(column is None or column in row for row, column in zip(rows, matched)), \
+            f"[Min Cost Matching] Expected a matching of {rows}. Got {matched}"
+
+        # (<matched rows>, -<cost>) of the best matching
+        def best(i: int, taken: frozenset) -> tuple[int, int]:
+            if i == len(rows):
+                return 0, 0
+            options = [best(i + 1, taken)]
+            for column in rows[i] - taken:
+                count, cost = best(i + 1, taken | {column})
+                options.append((count + 1, cost - column))
+            return max(options)
+
+        expected = best(0, frozenset())
+        assert (len(used), -sum(used)) == expected, \
+            f"[Min Cost Matching] Expected {expected} for {rows}. Got {matched}"
+
+
+def test_choose_crews() -> None:
+    """Test that choose_crews only picks free, qualified crews, never
+    schedules more requests than a brute force search over joint truck and
+    driver assignments, and as many when every driver can drive every truck.
+    Needs no database.
+    """
+    rng = random.Random(343)
+    start = dt.datetime(2023, 5, 3, 9, 0)
+    # requests start at most 10 minutes apart and take at least 30, so they
+    # all overlap as choose_crews expects
+    for attempt in range(200):
+        universal = attempt % 2 == 0
+        requests = [(rid, start + dt.timedelta(minutes=rng.randint(0, 10)), rng.choice([2.5, 5]),
+                     rng.choice('WX')) for rid in range(1, rng.randint(2, 4))]
+        trucks = [(tid, rng.choice('AB'), set(rng.sample('WX', rng.randint(1, 2))))
+                  for tid in range(1, rng.randint(2, 5))]
+        drivers = [(eid, ['A', 'B'] if universal else rng.sample('AB', rng.randint(1, 2)))
+                   for eid in range(1, rng.randint(2, 8))]
+        busy = BusyDay()
+        for tid, _, _ in rng.sample(trucks, rng.randint(0, 1)):
+            busy.add_truck_busy(tid, start, start + dt.timedelta(hours=1))
+        if not universal:
+            for eid, _ in rng.sample(drivers, min(2, len(drivers))):
+                busy.add_driver_busy(eid, start, start + dt.timedelta(hours=1))
+
+        ends = [trip_end(time, length) for _, time, length, _ in requests]
+        truck_of = {tid: (trucktype, wastetypes) for tid, trucktype, wastetypes in trucks}
+        can_drive = dict(drivers)
+        crews = choose_crews(busy, requests, trucks, drivers)
+        used = [member for crew in crews if crew is not None for member in (('t', crew[0]), crew[1], crew[2])]
+        assert len(used) == len(set(used)), f"[Choose Crews] Expected distinct crews. Got {crews}"
+        for (_, time, _, wastetype), end, crew in zip(requests, ends, crews):
+            if crew is None:
+                continue
+            tid, eid1, eid2 = crew
+            assert eid1 > eid2 and wastetype in truck_of[tid][1] and busy.truck_free(tid, time, end) \
+                and busy.driver_free(eid1, time, end) and busy.driver_free(eid2, time, end) \
+                and truck_of[tid][0] in set(can_drive[eid1]) | set(can_drive[eid2]), \
+                f"[Choose Crews] Expected a free, qualified crew. Got {crew}"
+
+        # the most requests any joint assignment of trucks and drivers schedules
+        def most(i: int, taken: frozenset) -> int:
+            if i == len(requests):
+                return 0
+            _, time, _, wastetype = requests[i]
+            found = most(i + 1, taken)
+            for tid, (trucktype, wastetypes) in truck_of.items():
+                if ('t', tid) in taken or wastetype not in wastetypes \
+                        or not busy.truck_free(tid, time, ends[i]):
+                    continue
+                free = [eid for eid in can_drive
+                        if eid not in taken and busy.driver_free(eid, time, ends[i])]
+                for first in free:
+                    if trucktype not in can_drive[first]:
+                        continue
+                    for second in free:
+                        if second != first:
+                            found = max(found, 1 + most(i + 1, taken | {('t', tid), first, second}))
+            return found
+
+        scheduled = sum(1 for crew in crews if crew is not None)
+        expected = most(0, frozenset())
+        assert scheduled <= expected, \
+            f"[Choose Crews] Expected at most {expected} requests. Got {crews}"
+        if universal:
+            assert scheduled == expected, \
+                f"[Choose Crews] Expected {expected} requests with universal drivers. Got {crews}"
+
+
+def test_slot_calendar() -> None:
+    """Test that SlotCalendar.conflict never contradicts the exact check of
+    BusyDay on random bookings, and that a copy is booked into on its own.
+    Needs no database.
+    """
+    rng = random.Random(343)
+    day_start = dt.datetime.combine(dt.date(2023, 5, 3), DAY_START)
+    hours = (SLOT_COUNT * SLOT_LENGTH).total_seconds()
+    calendar = SlotCalendar()
+    busy = {} # {<key>: [(<start>, <end>)]} sorted and apart, as in BusyDay
+    for key in range(20):
+        time = day_start + dt.timedelta(seconds=rng.uniform(-1800, 3600))
+        while True:
+            end = time + dt.timedelta(seconds=rng.uniform(300, 7200))
+            if end > day_start + dt.timedelta(seconds=hours + 1800):
+                break
+            calendar.book(key, time, end)
+            busy.setdefault(key, []).append((time, end))
+            time = end + dt.timedelta(seconds=rng.uniform(0, 7200))
+
+    decided = 0
+    for _ in range(2000):
+        key = rng.randrange(21) # 20 was never booked
+        start = day_start + dt.timedelta(seconds=rng.uniform(-1800, hours))
+        end = start + dt.timedelta(seconds=rng.uniform(0, 7200))
+        conflict = calendar.conflict(key, start, end)
+        expected = _overlaps(busy.get(key, []), start, end)
+        assert conflict is None or conflict == expected, \
+            f"[Slot Calendar] Expected {expected} for {key} from {start} to {end}. Got {conflict}"
+        decided += conflict is not None
+    assert decided > 1000, f"[Slot Calendar] Expected most checks decided by slots. Got {decided}"
+
+    start, end = day_start + dt.timedelta(hours=3), day_start + dt.timedelta(hours=4)
+    copy = calendar.copy()
+    copy.book(20, start, end)
+    assert copy.conflict(20, start, end) and calendar.conflict(20, start, end) is False, \
+        "[Slot Calendar] Expected a booking in a copy to only change the copy"
+    assert calendar.nbytes() < copy.nbytes(), \
+        f"[Slot Calendar] Expected the copy to grow. Got {calendar.nbytes()} and {copy.nbytes()}"
+
+
+def test_plan_truck_day() -> None:
+    """Test that plan_truck_day leaves more than TRIP_BUFFER between the
+    trips of a truck and its drivers. Needs no database.
+    """
+    date = dt.date(2023, 5, 3)
+    routes = [(rid, 'X' if rid % 4 == 0 else 'W', length)
+              for rid, length in enumerate([5, 5, 5, 2.5, 7.5, 1, 10, 4, 3, 6, 5, 2, 0.5], start=1)]
+    lengths = {rid: length for rid, _, length in routes}
+    drivers = [(eid, {'A'} if eid % 2 else {'B'}) for eid in range(1, 9)]
+    taken_drivers, taken_routes = {2}, {3}
+
+    first = plan_truck_day(1, 'A', {'W'}, date, routes, drivers, taken_drivers, taken_routes)
+    assert len(first) >= 3, f"[Plan Truck Day] Expected at least 3 trips. Got {first}"
+    assert first[0][2] == dt.datetime.combine(date, DAY_START), \
+        f"[Plan Truck Day] Expected the first trip at {DAY_START}. Got {first[0][2]}"
+    assert first[0][3:] == (3, 1), f"[Plan Truck Day] Expected drivers (3, 1). Got {first[0][3:]}"
+    second = plan_truck_day(2, 'B', {'W', 'X'}, date, routes, drivers, taken_drivers, taken_routes)
+    assert len(second) > 0, f"[Plan Truck Day] Expected trips for truck 2. Got {second}"
+    assert 3 not in {trip[0] for trip in first + second}, \
+        "[Plan Truck Day] Expected route 3 to stay taken"
+    assert len({trip[0] for trip in first + second}) == len(first + second), \
+        "[Plan Truck Day] Expected every route at most once"
+    _check_trip_gaps('Plan Truck Day', first + second, lengths)
+
+
+def test_plan_fleet_parallel() -> None:
+    """Test that planning the fleet in several processes gives the same plan
+    as a single process when every truck's lowest free drivers belong to its
+    own part, and a plan with the required gaps when a driver is shared.
+    Needs no database.
+    """
+    first_day, last_day = dt.date(2023, 5, 1), dt.date(2023, 5, 3)
+    routes = [(rid, 'W' if rid % 2 else 'X', 1 + rid % 7) for rid in range(1, 31)]
+    lengths = {rid: length for rid, _, length in routes}
+    trucks = {1: ('B', {'X'}), 2: ('B', {'X'}), 3: ('A', {'W'}), 4: ('A', {'W'})}
+
+    def plans(drivers: list[tuple[int, set[str]]]) -> tuple[list, list]:
+        busy = {first_day: {3}}
+        single = plan_fleet(first_day, last_day, trucks, routes, drivers, {}, {}, busy)
+        parallel = plan_fleet_parallel(first_day, last_day, trucks, routes, drivers, {}, {}, busy, 2)
+        return sorted(single), sorted(parallel)
+
+    # the second driver of a truck can be anyone, so a single process only
+    # picks the same drivers if the lower eids go with the lower trucks
+    drivers = [(eid, {'B'} if eid <= 4 else {'A'}) for eid in range(1, 9)]
+    single, parallel = plans(drivers)
+    assert len(single) > 0, "[Plan Fleet Parallel] Expected trips"
+    assert single == parallel, \
+        f"[Plan Fleet Parallel] Expected the same plan. Got {single} and {parallel}"
+    _check_trip_gaps('Plan Fleet Parallel', parallel, lengths)
+
+    drivers.append((9, {'A', 'B'}))
+    for plan in plans(drivers):
+        _check_trip_gaps('Plan Fleet Parallel', plan, lengths)
+        days = [(trip[2].date(), trip[0]) for trip in plan]
+        assert len(set(days)) == len(days), "[Plan Fleet Parallel] Expected every route once a day"
+
+
+def test_technician_calendar() -> None:
+    """Test that TechnicianCalendar books every truck on the earliest day it
+    and a qualified technician are both free, lowest eid first. Needs no
+    database.
+    """
+    first_day = dt.date(2023, 5, 6)
+    # truck 1 is busy on the first day, so its technician stays free for truck 2
+    calendar = TechnicianCalendar(first_day, [(1, 'A')], {}, {1: {first_day}})
+    booked = [calendar.assign(1, 'A'), calendar.assign(2, 'A'), calendar.assign(3, 'A')]
+    expected = [(1, dt.date(2023, 5, 7)), (1, dt.date(2023, 5, 6)), (1, dt.date(2023, 5, 8))]
+    assert booked == expected, f"[Technician Calendar] Expected {expected}. Got {booked}"
+
+    calendar = TechnicianCalendar(first_day, [(3, 'A'), (2, 'A'), (2, 'B'), (4, 'C')],
+                                  {2: {first_day}}, {2: {first_day + dt.timedelta(days=1)}})
+    booked = [calendar.assign(1, 'B'), calendar.assign(2, 'A'), calendar.assign(3, 'A'),
+              calendar.assign(4, 'A'), calendar.assign(5, 'D')]
+    expected = [(2, dt.date(2023, 5, 7)), (3, dt.date(2023, 5, 6)), (3, dt.date(2023, 5, 7)),
+                (2, dt.date(2023, 5, 8)), None]
+    assert booked == expected, f"[Technician Calendar] Expected {expected}. Got {booked}"
+
+    # loading busy days a window at a time books like having them all
+    rng = random.Random(343)
+    for _ in range(50):
+        techs = [(eid, rng.choice('AB')) for eid in range(1, rng.randint(2, 5))]
+        days = [first_day + dt.timedelta(days=rng.randint(0, 60)) for _ in range(40)]
+        all_tech_busy, all_truck_busy = {}, {}
+        for i, day in enumerate(days):
+            busy = all_tech_busy if i % 2 else all_truck_busy
+            busy.setdefault(rng.randint(1, 6), set()).add(day)
+        trucks = [(tid, rng.choice('AB')) for tid in range(1, 7)]
+        calendar = TechnicianCalendar(first_day, techs, {eid: set(d) for eid, d in all_tech_busy.items()},
+                                      {tid: set(d) for tid, d in all_truck_busy.items()})
+        expected = [calendar.assign(tid, trucktype) for tid, trucktype in trucks]
+
+        tech_busy, truck_busy, loads = {}, {}, []
+        def load(first: dt.date, last: dt.date) -> None:
+            loads.append((first, last))
+            for source, target in ((all_tech_busy, tech_busy), (all_truck_busy, truck_busy)):
+                for key, busy_days in source.items():
+                    target.setdefault(key, set()).update(day for day in busy_days if first <= day <= last)
+        calendar = TechnicianCalendar(first_day, techs, tech_busy, truck_busy, load, window=2)
+        booked = [calendar.assign(tid, trucktype) for tid, trucktype in trucks]
+        assert booked == expected, f"[Technician Calendar] Expected {expected} when loading. Got {booked}"
+        assert loads[0] == (first_day, first_day + dt.timedelta(days=1)) and \
+            all(b[0] == a[1] + dt.timedelta(days=1) and b[1] - b[0] >= 2 * (a[1] - a[0])
+                for a, b in zip(loads, loads[1:])), \
+            f"[Technician Calendar] Expected consecutive, doubling windows. Got {loads}"
+
+
+def test_async_planning() -> None:
+    """Test the planning helpers of AsyncWasteWrangler.schedule_trips, and
+    that taking back a reserved trip leaves every other reservation of its
+    day alone. Needs asyncpg but no database.
+    """
+    from async_a2 import pack_trips, pick_drivers
+    assert pick_drivers([2, 4, 6], [1, 2, 3, 4, 5, 6], {2}) == (4, 1), \
+        "[Async Planning] Expected drivers (4, 1)"
+    assert pick_drivers([2], [1, 2], {1}) is None and pick_drivers([2], [2, 3], {2}) is None, \
+        "[Async Planning] Expected no drivers"
+
+    date = dt.date(2023, 5, 6)
+    start = dt.datetime.combine(date, DAY_START)
+    details = [(rid, 'W', length) for rid, length in enumerate([5, 10, 2.5, 15, 7.5, 1], start=1)]
+    packed, next_start = pack_trips(start, details)
+    expected = [(1, 8, 0), (2, 9, 0), (3, 11, 0), (4, 11, 30)]
+    got = [(rid, time.hour, time.minute) for rid, _, time, _ in packed]
+    assert got == expected and next_start is None, \
+        f"[Async Planning] Expected {expected} and a trip that doesn't fit. Got {got}, {next_start}"
+    first, middle = pack_trips(start, details[:2])
+    rest, _ = pack_trips(middle, details[2:])
+    assert first + rest == packed, "[Async Planning] Expected batches to pack like one list"
+
+    busy = BusyDay()
+    busy.add_trip(1, 1, 2, 1, start, start + dt.timedelta(hours=1))
+    busy.add_trip(2, 2, 4, 3, start, start + dt.timedelta(hours=1))
+    busy.add_trip(3, 1, 2, 1, start + dt.timedelta(hours=3), start + dt.timedelta(hours=4))
+    busy.remove_trip(2, 2, 4, 3, start, start + dt.timedelta(hours=1))
+    assert busy.truck_free(2, start, start + dt.timedelta(hours=1)) and busy.driver_free(4, start, start) \
+        and 2 not in busy.routes, "[Async Planning] Expected the removed trip's crew to be free"
+    later = start + dt.timedelta(hours=3)
+    assert not busy.truck_free(1, start, start) and not busy.driver_free(2, later, later) \
+        and busy.routes == {1, 3}, "[Async Planning] Expected the other trips to stay booked"
+    busy.remove_trip(3, 1, 2, 1, later, later + dt.timedelta(hours=1))
+    assert busy.truck_free(1, later, later) and not busy.truck_free(1, start, start), \
+        "[Async Planning] Expected only the removed trip of truck 1 to be free"
+
+
+def test_async_parity() -> None:
+    """Test that AsyncWasteWrangler schedules the same trips as
+    WasteWrangler on the sample data. Needs asyncpg and the database of
+    test_preliminary.
+    """
+    import asyncio
+    from async_a2 import AsyncWasteWrangler
+    dbname, user, password = 'csc343h-zhaoluji', 'zhaoluji', ''
+    # (<method>, <arguments>) in order
+    calls = [('schedule_trip', (1, dt.datetime(2023, 5, 4, 8, 0))),
+             ('schedule_trip', (1, dt.datetime(2023, 5, 4, 13, 0))),
+             ('schedule_trip', (7, dt.datetime(2023, 5, 4, 9, 0))),
+             ('schedule_trip', (2023, dt.datetime(2023, 5, 4, 9, 0))),
+             ('schedule_trips', (1, dt.date(2023, 5, 3))),
+             ('schedule_trips', (2, dt.date(2023, 5, 6))),
+             ('schedule_trips', (1, dt.date(2023, 5, 7)))]
+
+    def trips() -> list[tuple]:
+        conn = pg.connect(dbname=dbname, user=user, password=password,
+                          options='-c search_path=waste_wrangler')
+        try:
+            with conn.cursor() as cur:
+                cur.execute('select * from Trip order by ttime, tid;')
+                return cur.fetchall()
+        finally:
+            conn.close()
+
+    setup(dbname, user, password, './waste_wrangler_data.sql')
+    ww = WasteWrangler()
+    try:
+        assert ww.connect(dbname, user, password), "[Async Parity] Expected to connect"
+        expected = [getattr(ww, method)(*args) for method, args in calls]
+    finally:
+        ww.disconnect()
+    expected_trips = trips()
+
+    async def run() -> list:
+        aww = AsyncWasteWrangler()
+        assert await aww.connect(dbname, user, password), "[Async Parity] Expected to connect"
+        try:
+            return [await getattr(aww, method)(*args) for method, args in calls]
+        finally:
+            await aww.disconnect()
+
+    setup(dbname, user, password, './waste_wrangler_data.sql')
+    got = asyncio.run(run())
+    assert got == expected, f"[Async Parity] Expected {expected}. Got {got}"
+    assert trips() == expected_trips, "[Async Parity] Expected the same trips in Trip"
+
+
+def test_valid_truck_times() -> None:
+    """Test that the vectorized valid_truck_times in columnar.py agrees with
+    valid_truck_time. Needs NumPy but no database.
+    """
+    from columnar import valid_truck_times
+    rng = random.Random(343)
+    day = dt.datetime(2023, 5, 3)
+    # on the previous, same and next day, on whole minutes so that exact
+    # 30 minute gaps come up, and a few off the minute
+    truck_times = [day + dt.timedelta(minutes=rng.randint(-600, 2000)) for _ in range(150)]
+    truck_times += [day + dt.timedelta(seconds=rng.randint(0, 86_399)) for _ in range(50)]
+    given_times = [day + dt.timedelta(minutes=minutes) for minutes in range(0, 1440, 5)]
+    lengths = [rng.choice([0, 1.5, 2.5, 5, 7.5, 12.5, 40, 80]) for _ in given_times]
+
+    valid = valid_truck_times(truck_times, given_times, lengths)
+    assert valid.shape == (len(truck_times), len(given_times)), \
+        f"[Valid Truck Times] Expected shape {(len(truck_times), len(given_times))}. Got {valid.shape}"
+    for i, truck_time in enumerate(truck_times):
+        for j, (given_time, length) in enumerate(zip(given_times, lengths)):
+            expected = valid_truck_time(truck_time, given_time, length)
+            assert valid[i, j] == expected, \
+                f"[Valid Truck Times] {truck_time}, {given_time}, {length}: Expected {expected}. Got {valid[i, j]}"
+
+    # a single length for every given time
+    valid = valid_truck_times(truck_times, given_times, 10)
+    for i, truck_time in enumerate(truck_times):
+        for j, given_time in enumerate(given_times):
+            expected = valid_truck_time(truck_time, given_time, 10)
+            assert valid[i, j] == expected, \
+                f"[Valid Truck Times] {truck_time}, {given_time}, 10: Expected {expected}. Got {valid[i, j]}"
+
+
+def test_parse_binary_copy() -> None:
+    """Test parse_binary_copy in columnar.py on a hand-built binary COPY
+    stream, with NULLs replaced as in the COPY query, dates and timestamps
+    before and after the Postgres epoch, and a stream holding a real NULL.
+    Needs NumPy but no database.
+    """
+    import struct
+    import numpy as np
+    from columnar import parse_binary_copy
+    columns = [('rid', 'int'), ('ttime', 'timestamp'), ('volume', 'float'),
+               ('fid', 'int'), ('mdate', 'date'), ('wastetype', 'text')]
+    epoch = dt.datetime(2000, 1, 1)
+
+    def field(fmt, value):
+        return struct.pack('>i', struct.calcsize(fmt)) + struct.pack(fmt, value)
+
+    def stream(rows):
+        data = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+        for row in rows:
+            data += struct.pack('>h', len(row)) + b''.join(row)
+        return data + struct.pack('>h', -1)
+
+    # (rid, ttime, volume, fid, mdate, wastetype), NULL fid as -1, NULL
+    # volume as NaN and NULL wastetype as -1
+    rows = [(1, dt.datetime(2023, 5, 3, 8, 30, 15, 250), 12.5, 4, dt.date(2023, 5, 3), 0),
+            (2, dt.datetime(1999, 12, 31, 23, 59), float('nan'), -1, dt.date(1999, 12, 31), -1),
+            (3, epoch, 0.0, 7, dt.date(2000, 1, 1), 2)]
+    data = stream([(field('>i', rid), field('>q', (ttime - epoch) // dt.timedelta(microseconds=1)),
+                    field('>d', volume), field('>i', fid), field('>i', (mdate - epoch.date()).days),
+                    field('>i', wastetype))
+                   for rid, ttime, volume, fid, mdate, wastetype in rows])
+    result = parse_binary_copy(data, columns)
+    assert sorted(result) == sorted(column for column, _ in columns), \
+        f"[Parse Binary Copy] Expected a column per field. Got {sorted(result)}"
+    assert result['rid'].tolist() == [1, 2, 3], f"[Parse Binary Copy] Expected rids [1, 2, 3]. Got {result['rid'].tolist()}"
+    expected = [row[1] for row in rows]
+    assert result['ttime'].tolist() == expected, f"[Parse Binary Copy] Expected times {expected}. Got {result['ttime'].tolist()}"
+    volume = result['volume']
+    assert volume[0] == 12.5 and np.isnan(volume[1]) and volume[2] == 0, \
+        f"[Parse Binary Copy] Expected volumes [12.5, nan, 0]. Got {volume.tolist()}"
+    assert result['fid'].tolist() == [4, -1, 7], f"[Parse Binary Copy] Expected fids [4, -1, 7]. Got {result['fid'].tolist()}"
+    expected = [row[4] for row in rows]
+    assert result['mdate'].tolist() == expected, f"[Parse Binary Copy] Expected dates {expected}. Got {result['mdate'].tolist()}"
+    assert result['wastetype'].tolist() == [0, -1, 2], \
+        f"[Parse Binary Copy] Expected codes [0, -1, 2]. Got {result['wastetype'].tolist()}"
+
+    # no rows
+    result = parse_binary_copy(stream([]), columns)
+    assert all(len(values) == 0 for values in result.values()), "[Parse Binary Copy] Expected empty columns"
+
+    # a real NULL has a length of -1 and no data
+    two = [('rid', 'int'), ('fid', 'int')]
+    for nulls in ([(field('>i', 1), struct.pack('>i', -1))],
+                  [(field('>i', 1), struct.pack('>i', -1)), (field('>i', 2), field('>i', 3)),
+                   (field('>i', 4), struct.pack('>i', -1))]):
+        try:
+            parse_binary_copy(stream(nulls), two)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("[Parse Binary Copy] Expected ValueError for a NULL field")
+    for broken in (b'COPY', stream([])[:-2]):
+        try:
+            parse_binary_copy(broken, two)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"[Parse Binary Copy] Expected ValueError for {broken!r}")
+
+
+def test_simulate() -> None:
+    """Test that Scenarios in simulate.py schedule like WasteWrangler on a
+    hand-built Snapshot, record their changes in diff, and leave the
+    snapshot and each other alone. Needs no database.
+    """
+    from simulate import Snapshot
+    day = dt.date(2023, 5, 3)
+    snapshot = Snapshot()
+    snapshot.routes = {1: ('paper', 10), 2: ('paper', 5), 3: ('glass', 5)}
+    snapshot.facilities = {1: 'paper', 2: 'paper', 3: 'glass'}
+    snapshot.trucks = {1: ('A', 10), 2: ('B', 5)}
+    snapshot.trucktypes = {'A': {'paper'}, 'B': {'glass', 'paper'}}
+    snapshot.drivers = [(10, ['A']), (11, ['B']), (12, ['A', 'B']), (13, ['A'])]
+    snapshot.technicians = [(20, 'A'), (21, 'B')]
+    # truck 1 with drivers 10 and 11 on route 1 from 8:00 to 10:00
+    snapshot.trips = {day: [(1, 1, dt.datetime(2023, 5, 3, 8, 0), 3.0, 10, 11, 2)]}
+    snapshot.maintenance = {day + dt.timedelta(days=1): [(2, 20)]}
+    nine = dt.datetime(2023, 5, 3, 9, 0)
+
+    # truck 1 and drivers 10 and 11 are busy at 9:00, the lowest paper
+    # facility takes the trip
+    scenario = snapshot.scenario()
+    results = [scenario.schedule_trip(2, nine), scenario.schedule_trip(1, dt.datetime(2023, 5, 3, 13, 0)),
+               scenario.schedule_trip(99, nine), scenario.schedule_trip(3, dt.datetime(2023, 5, 3, 15, 30))]
+    assert results == [True, False, False, False], f"[Simulate] Expected [True, False, False, False]. Got {results}"
+    expected = [(2, 2, nine, None, 13, 12, 1)]
+    assert scenario.new_trips == expected, f"[Simulate] Expected {expected}. Got {scenario.new_trips}"
+    assert snapshot.day(day).routes == {1}, f"[Simulate] Expected the snapshot's day untouched. Got {snapshot.day(day).routes}"
+
+    # an added truck with a larger capacity goes first, a facility that is
+    # down gets no trips, and neither reaches the snapshot or other scenarios
+    other = snapshot.scenario()
+    other.add_truck(3, 'A', 20)
+    other.facility_down(1)
+    assert other.schedule_trip(2, nine), "[Simulate] Expected the added truck to take the trip"
+    expected = [(2, 3, nine, None, 13, 12, 2)]
+    assert other.new_trips == expected, f"[Simulate] Expected {expected}. Got {other.new_trips}"
+    assert 3 not in snapshot.trucks and 1 in snapshot.facilities, "[Simulate] Expected the snapshot unchanged"
+    assert 3 not in scenario.trucks and 1 in scenario.facilities, "[Simulate] Expected the first scenario unchanged"
+    other.facility_down(2)
+    assert not other.schedule_trip(2, dt.datetime(2023, 5, 4, 9, 0)), \
+        "[Simulate] Expected no trip with every paper facility down"
+
+    # truck 1 is busy on day and technician 20 the day after; truck 2 was
+    # maintained recently; the added truck 3 takes the first day
+    scenario = snapshot.scenario()
+    assert scenario.schedule_maintenance(dt.date(2023, 5, 2)) == 1, "[Simulate] Expected 1 truck maintained"
+    expected = [(1, 20, dt.date(2023, 5, 5))]
+    assert scenario.new_maintenance == expected, f"[Simulate] Expected {expected}. Got {scenario.new_maintenance}"
+    scenario = snapshot.scenario()
+    scenario.add_truck(3, 'A', 20)
+    assert scenario.schedule_maintenance(dt.date(2023, 5, 2)) == 2, "[Simulate] Expected 2 trucks maintained"
+    expected = [(1, 20, dt.date(2023, 5, 5)), (3, 20, day)]
+    assert scenario.new_maintenance == expected, f"[Simulate] Expected {expected}. Got {scenario.new_maintenance}"
+    # truck 3 is in maintenance on day, so truck 2 takes the trip
+    assert scenario.schedule_trip(2, nine), "[Simulate] Expected truck 2 to take the trip"
+    assert scenario.new_trips[0][1] == 2, f"[Simulate] Expected truck 2. Got {scenario.new_trips[0][1]}"
+    assert scenario.schedule_maintenance(dt.date(2023, 5, 2)) == 0, "[Simulate] Expected no truck left to maintain"
+
+    # rerouting moves trips of the snapshot and of the scenario; moving them
+    # back leaves nothing to update
+    scenario = snapshot.scenario()
+    scenario.schedule_trip(2, nine)
+    scenario.facility_down(1)
+    assert scenario.reroute_waste(2, day) == 0, "[Simulate] Expected no replacement while facility 1 is down"
+    scenario = snapshot.scenario()
+    scenario.facility_down(2)
+    scenario.schedule_trip(2, nine)
+    assert scenario.reroute_waste(1, day) == 0, "[Simulate] Expected no replacement while facility 2 is down"
+    scenario = snapshot.scenario()
+    scenario.add_truck(3, 'B', 1)
+    assert scenario.schedule_trip(2, nine), "[Simulate] Expected a trip on route 2"
+    results = [scenario.reroute_waste(1, day), scenario.reroute_waste(2, day + dt.timedelta(days=1)),
+               scenario.reroute_waste(3, day), scenario.reroute_waste(7, day)]
+    assert results == [1, 0, 0, 0], f"[Simulate] Expected [1, 0, 0, 0]. Got {results}"
+    diff = scenario.diff()
+    expected = {'insert': {'Truck': [(3, 'B', 1)], 'Trip': [(2, 2, nine, None, 13, 12, 2)], 'Maintenance': []},
+                'update': {'Trip': []}}
+    assert diff == expected, f"[Simulate] Expected {expected}. Got {diff}"
+    assert scenario.reroute_waste(2, day) == 2, "[Simulate] Expected both trips rerouted to facility 1"
+    diff = scenario.diff()
+    expected = {'insert': {'Truck': [(3, 'B', 1)], 'Trip': [(2, 2, nine, None, 13, 12, 1)], 'Maintenance': []},
+                'update': {'Trip': [((1, dt.datetime(2023, 5, 3, 8, 0)), {'fid': (2, 1)})]}}
+    assert diff == expected, f"[Simulate] Expected {expected}. Got {diff}"
+    assert scenario.reroute_waste(1, day) == 2, "[Simulate] Expected both trips rerouted back"
+    diff = scenario.diff()
+    assert diff['update'] == {'Trip': []}, f"[Simulate] Expected nothing to update. Got {diff['update']}"
+    assert snapshot.trips[day][0][6] == 2, "[Simulate] Expected the snapshot's trip untouched"
+
+
+def test_workmate_index() -> None:
+    """Test WorkmateIndex against a breadth-first search over the same random
+    pairs, after building it at once and after every single union. Needs no
+    database.
+    """
+    rng = random.Random(343)
+    for _ in range(100):
+        eids = range(1, rng.randint(2, 30))
+        pairs = [(rng.choice(eids), rng.choice(eids)) for _ in range(rng.randint(0, 40))]
+
+        # what the spheres are, by brute force
+        def spheres(pairs: list[tuple[int, int]]) -> dict[int, set[int]]:
+            neighbours = collections.defaultdict(set)
+            for eid1, eid2 in pairs:
+                neighbours[eid1].add(eid2)
+                neighbours[eid2].add(eid1)
+            reached = {}
+            for eid in neighbours:
+                seen = {eid}
+                queue = collections.deque([eid])
+                while queue:
+                    for other in neighbours[queue.popleft()]:
+                        if other not in seen:
+                            seen.add(other)
+                            queue.append(other)
+                reached[eid] = seen
+            return reached
+
+        def check(index: WorkmateIndex, pairs: list[tuple[int, int]]) -> None:
+            expected = spheres(pairs)
+            for eid in eids:
+                got = sorted(index.sphere(eid))
+                want = sorted(expected.get(eid, {eid}) - {eid})
+                assert got == want, f"[Workmate Index] {pairs}: Expected sphere {want} of {eid}. Got {got}"
+            want = {frozenset(group) for group in expected.values()}
+            assert index.groups() == want, f"[Workmate Index] {pairs}: Expected groups {want}. Got {index.groups()}"
+            for group in want:
+                roots = {index.find(eid) for eid in group}
+                assert len(roots) == 1, f"[Workmate Index] Expected one root for {set(group)}. Got {roots}"
+
+        check(WorkmateIndex(pairs), pairs)
+        index = WorkmateIndex()
+        for i, (eid1, eid2) in enumerate(pairs):
+            index.union(eid1, eid2)
+            check(index, pairs[:i + 1])
+
+
+def test_choose_replacements() -> None:
+    """Test the replacements and counts of reroute_waste_bulk with
+    overlapping and chained outages. Needs no database.
+    """
+    def day(n: int) -> dt.date:
+        return dt.date(2023, 5, n)
+
+    def midnight(n: int) -> dt.datetime:
+        return dt.datetime(2023, 5, n)
+
+    waste_types = {1: 'paper', 2: 'paper', 3: 'paper', 4: 'paper', 5: 'glass'}
+    facilities = {'paper': [1, 2, 3, 4], 'glass': [5]}
+    # 1 and 2 overlap on day 3, 2 and 3 on day 5; 1 is down again on day 8;
+    # 5 is the only glass facility and 9 doesn't exist
+    outages = [(1, day(1), day(3)), (2, day(3), day(5)), (3, day(5), day(6)),
+               (5, day(1), day(2)), (9, day(1), day(1)), (1, day(8), day(8))]
+    got = choose_replacements(outages, waste_types, facilities)
+    # trips of 1 go to 3 although 3 is down later, which sends them back to 1
+    expected = [(1, 3, midnight(1), midnight(4)), (2, 4, midnight(3), midnight(6)),
+                (3, 1, midnight(5), midnight(7)), (1, 2, midnight(8), midnight(9))]
+    assert got == expected, f"[Choose Replacements] Expected {expected}. Got {got}"
+
+    # every paper facility is down on day 3
+    outages = [(1, day(1), day(3)), (2, day(3), day(3)), (3, day(2), day(4)), (4, day(3), day(9))]
+    got = choose_replacements(outages, waste_types, facilities)
+    assert got == [], f"[Choose Replacements] Expected no replacements. Got {got}"
+    got = choose_replacements(outages[1:], waste_types, facilities)
+    expected = [(2, 1, midnight(3), midnight(4)), (3, 1, midnight(2), midnight(5)), (4, 1, midnight(3), midnight(10))]
+    assert got == expected, f"[Choose Replacements] Expected {expected}. Got {got}"
+    got = choose_replacements([], waste_types, facilities)
+    assert got == [], f"[Choose Replacements] Expected no replacements. Got {got}"
+
+    # every fid of an outage is counted once, however many outages it has
+    outages = [(1, day(1), day(3)), (2, day(3), day(5)), (1, day(8), day(8)), (5, day(1), day(2))]
+    got = count_reroutes(outages, [1, 2, 1, 1])
+    expected = {1: 3, 2: 1, 5: 0}
+    assert got == expected, f"[Choose Replacements] Expected {expected}. Got {got}"
+    got = count_reroutes(outages, ())
+    expected = {1: 0, 2: 0, 5: 0}
+    assert got == expected, f"[Choose Replacements] Expected {expected}. Got {got}"
+
+
+def test_histogram() -> None:
+    """Test Histogram buckets and quantiles on known samples, Instrumentation
+    per method and plans.statement_key per statement. Needs no database.
+    """
+    # a value on a bound belongs to the bucket that bound closes
+    histogram = Histogram([1.0, 2.0, 4.0])
+    assert histogram.quantile(0.5) == 0.0, f"[Histogram] Expected 0.0 when empty. Got {histogram.quantile(0.5)}"
+    for value in (0.5, 1, 1.5, 2, 3, 4, 5, 100):
+        histogram.observe(value)
+    assert histogram.counts == [2, 2, 2, 2], f"[Histogram] Expected counts [2, 2, 2, 2]. Got {histogram.counts}"
+    got = [histogram.quantile(q) for q in (0, 0.25, 0.26, 0.5, 0.75, 0.76, 1)]
+    expected = [1.0, 1.0, 2.0, 2.0, 4.0, float('inf'), float('inf')]
+    assert got == expected, f"[Histogram] Expected quantiles {expected}. Got {got}"
+    expected = {'count': 8, 'mean': 14.625, 'p50': 2.0, 'p90': float('inf'), 'p99': float('inf'),
+                'buckets': {'1.0': 2, '2.0': 2, '4.0': 2, 'inf': 2}}
+    assert histogram.summary() == expected, f"[Histogram] Expected {expected}. Got {histogram.summary()}"
+
+    histogram = Histogram(COUNT_BUCKETS)
+    for value in range(1, 101):
+        histogram.observe(value)
+    expected = [1, 1, 2, 4, 8, 16, 32, 36]
+    assert histogram.counts[:8] == expected, f"[Histogram] Expected counts {expected}. Got {histogram.counts[:8]}"
+    got = [histogram.quantile(q) for q in (0.01, 0.5, 0.64, 0.65, 0.9, 0.99)]
+    expected = [1.0, 64.0, 64.0, 128.0, 128.0, 128.0]
+    assert got == expected, f"[Histogram] Expected quantiles {expected}. Got {got}"
+    summary = histogram.summary()
+    assert (summary['count'], summary['mean']) == (100, 50.5), \
+        f"[Histogram] Expected count 100 and mean 50.5. Got {summary['count']} and {summary['mean']}"
+
+    # calls add up per method, nested calls count towards the outer one, and
+    # a call that fails is recorded too; the statements of a call are what
+    # InstrumentedCursor adds to the current record
+    instrumentation = Instrumentation()
+    exported = []
+    instrumentation.exporter = exported.append
+
+    def call(queries: int, rows: int, inner: Optional[tuple] = None) -> int:
+        _current_call.record.queries += queries
+        _current_call.record.rows += rows
+        if inner is not None:
+            instrumentation.measure('inner', call, *inner)
+        return queries
+
+    def fail() -> None:
+        _current_call.record.queries += 1
+        raise ValueError('fail')
+
+    results = [instrumentation.measure('schedule_trip', call, 3, 5),
+               instrumentation.measure('schedule_trip', call, 1, 0),
+               instrumentation.measure('reroute_waste', call, 2, 2, (4, 4))]
+    assert results == [3, 1, 2], f"[Instrumentation] Expected the results [3, 1, 2]. Got {results}"
+    try:
+        instrumentation.measure('reroute_waste', fail)
+    except ValueError:
+        pass
+    assert getattr(_current_call, 'record', None) is None, "[Instrumentation] Expected no call left measured"
+    got = [(record.method, record.queries, record.rows) for record in exported]
+    expected = [('schedule_trip', 3, 5), ('schedule_trip', 1, 0), ('reroute_waste', 6, 6), ('reroute_waste', 1, 0)]
+    assert got == expected, f"[Instrumentation] Expected records {expected}. Got {got}"
+    stats = instrumentation.stats()
+    assert sorted(stats) == ['reroute_waste', 'schedule_trip'], \
+        f"[Instrumentation] Expected two methods. Got {sorted(stats)}"
+    queries = stats['schedule_trip']['queries']
+    assert (queries['count'], queries['mean'], queries['p50'], queries['p99']) == (2, 2.0, 1.0, 4.0), \
+        f"[Instrumentation] Expected 2 calls, 2.0 queries on average, p50 1.0 and p99 4.0. Got {queries}"
+    rows = stats['reroute_waste']['rows']
+    assert (rows['count'], rows['p50'], rows['p99']) == (2, 1.0, 8.0), \
+        f"[Instrumentation] Expected 2 calls, p50 1.0 and p99 8.0. Got {rows}"
+    instrumentation.reset()
+    assert instrumentation.stats() == {}, f"[Instrumentation] Expected nothing after reset. Got {instrumentation.stats()}"
+
+    # plans are kept per statement, whatever its literals and number of rows
+    from plans import statement_key
+    keys = {statement_key(statement) for statement in (
+        "select * from Trip where fid = 3 and ttime > '2023-05-01'",
+        "SELECT *  FROM Trip\nwhere fid = 12 and ttime > 'it''s';")}
+    assert keys == {"select * from trip where fid = ? and ttime > ?"}, f"[Statement Key] Expected one key. Got {keys}"
+    keys = {statement_key(statement) for statement in (
+        "insert into Maintenance (tid, eid, mdate) values (1, 2, '2023-05-01');",
+        "insert into Maintenance (tid, eid, mdate) values (1, 2, '2023-05-01'), (3, 4, '2023-05-02')")}
+    expected = {"insert into maintenance (tid, eid, mdate) values (?, ?, ?)"}
+    assert keys == expected, f"[Statement Key] Expected {expected}. Got {keys}"
+    keys = [statement_key(statement) for statement in ('EXECUTE ww_route(1);', 'execute ww_route (2)')]
+    assert keys == ['execute ww_route', 'execute ww_route'], f"[Statement Key] Expected 'execute ww_route'. Got {keys}"
+
+
 if __name__ == '__main__':
     # Un comment-out the next two lines if you would like to run the doctest
     # examples (see ">>>" in the methods connect and disconnect)
@@ -911,4 +3832,18 @@ if __name__ == '__main__':
 
     # TODO: Put your testing code here, or call testing functions such as
     #   this one:
+    test_technician_calendar()
+    test_workmate_index()
+    test_choose_replacements()
+    test_histogram()
+    test_min_cost_matching()
+    test_choose_crews()
+    test_slot_calendar()
+    test_plan_truck_day()
+    test_plan_fleet_parallel()
+    test_valid_truck_times()
+    test_parse_binary_copy()
+    test_simulate()
+    test_async_planning()
     test_preliminary()
+    test_async_parity()
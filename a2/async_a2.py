@@ -0,0 +1,323 @@
+"""CSC343 Assignment 2 - asyncio client
+
+=== Module Description ===
+
+This file contains AsyncWasteWrangler, an asyncio version of WasteWrangler
+for services that can't block their event loop on psycopg2. It has the same
+methods with the same results, built on asyncpg and its connection pool.
+
+Lookups inside a method that don't depend on each other (e.g. the route and
+the drivers in schedule_trip) run concurrently on separate pooled
+connections. asyncpg prepares and caches every statement per connection by
+itself, so the queries are shared with WasteWrangler's PREPARED_QUERIES.
+"""
+
+import asyncio
+import datetime as dt
+from typing import Optional, TextIO
+
+import asyncpg
+
+from a2 import (PREPARED_QUERIES, BusyDay, TechnicianCalendar, WasteWrangler,
+                choose_crew, trip_end)
+
+
+Q = PREPARED_QUERIES
+
+# queries only the async client needs, the sync one builds these per call
+DAY_TRIPS = ('select t.rid, t.tid, t.eid1, t.eid2, t.ttime, r.length '
+             'from Trip t join Route r on t.rid = r.rid '
+             'where t.ttime >= $1 and t.ttime < $2')
+DAY_MAINTENANCE = 'select tid from Maintenance where mdate = $1'
+INSERT_QUALIFICATIONS = ('insert into Technician (eid, trucktype) '
+                         'select distinct e.eid, s.trucktype '
+                         'from QualificationStaging s join Employee e on e.name = s.name '
+                         'where s.trucktype in (select trucktype from TruckType) '
+                         'and e.eid not in (select eid from Driver) '
+                         'and not exists (select * from Technician t '
+                         'where t.eid = e.eid and t.trucktype = s.trucktype)')
+ROUTE_DETAILS = 'select rid, wastetype, length from Route where rid = any($1)'
+
+# routes schedule_trips looks up at once while packing a day, more than
+# usually fit between 8:00 and 15:30
+ROUTE_BATCH = 16
+
+
+# midnight at the start of <date>
+def _midnight(date: dt.date) -> dt.datetime:
+    return dt.datetime.combine(date, dt.time(0, 0))
+
+
+# picks the drivers of schedule_trips: the lowest free eid in <of_type> and
+# the lowest other free eid in <drivers>, both in ascending order
+# returns (<eid1>, <eid2>) with eid1 > eid2, or None if there aren't two
+def pick_drivers(of_type: list[int], drivers: list[int],
+                 busy: set[int]) -> Optional[tuple[int, int]]:
+    first = next((eid for eid in of_type if eid not in busy), None)
+    if first is None:
+        return None
+    second = next((eid for eid in drivers if eid != first and eid not in busy), None)
+    if second is None:
+        return None
+    return max(first, second), min(first, second)
+
+
+# packs the routes in <details> back to back from <start> like
+# schedule_trips does, until a trip would end after 15:30
+# details: [(<rid>, <wastetype>, <length>)] in the order to schedule them
+# returns [(<rid>, <wastetype>, <start>, <end>)] and the start of the next
+# trip, or None as the start once a trip didn't fit
+def pack_trips(start: dt.datetime, details: list[tuple[int, str, float]]
+               ) -> tuple[list[tuple[int, str, dt.datetime, dt.datetime]], Optional[dt.datetime]]:
+    packed = []
+    for rid, wastetype, length in details:
+        end = trip_end(start, length)
+        if end.time() > dt.time(15, 30):
+            return packed, None
+        packed.append((rid, wastetype, start, end))
+        start = end
+    return packed, start
+
+
+class AsyncWasteWrangler:
+    """An asyncio version of WasteWrangler, see WasteWrangler for what each
+    method does. Every method is a coroutine and methods never raise
+    database errors, they return their failure value instead.
+
+    === Instance Attributes ===
+    pool: the asyncpg connection pool, None until connect succeeds.
+    days: {<date>: <BusyDay>} busy trucks and drivers per day, loaded
+    lazily and kept up to date with the trips this client schedules.
+    """
+    pool: Optional[asyncpg.Pool]
+    days: dict[dt.date, BusyDay]
+    _days_lock: asyncio.Lock
+
+    def __init__(self) -> None:
+        self.pool = None
+        self.days = {}
+        self._days_lock = asyncio.Lock()
+
+    async def connect(self, dbname: str, username: str, password: str,
+                      min_size: int = 1, max_size: int = 10) -> bool:
+        """Open a pool of <min_size> to <max_size> connections to <dbname>
+        with the search path set to waste_wrangler.
+
+        Return True if the pool was created successfully, False otherwise.
+        """
+        try:
+            self.pool = await asyncpg.create_pool(
+                database=dbname, user=username, password=password,
+                min_size=min_size, max_size=max_size,
+                server_settings={'search_path': 'waste_wrangler'}
+            )
+            self.days = {}
+            return True
+        except (OSError, asyncpg.PostgresError):
+            return False
+
+    async def disconnect(self) -> bool:
+        """Close every connection in the pool.
+
+        Return True if closing was successful, False otherwise.
+        """
+        try:
+            if self.pool is not None:
+                await self.pool.close()
+                self.pool = None
+            return True
+        except (OSError, asyncpg.PostgresError):
+            return False
+
+    async def schedule_trip(self, rid: int, time: dt.datetime) -> bool:
+        """See WasteWrangler.schedule_trip."""
+        try:
+            route, drivers = await asyncio.gather(
+                self.pool.fetchrow(Q['ww_route'], rid),
+                self.pool.fetch(Q['ww_drivers']))
+            if route is None: # invalid rid
+                return False
+            wastetype, length = route
+            facility, trucks = await asyncio.gather(
+                self.pool.fetchval(Q['ww_first_facility'], wastetype),
+                self.pool.fetch(Q['ww_trucks_for_waste'], wastetype))
+            if facility is None:
+                return False
+
+            async with self._days_lock:
+                busy = await self._day(time.date())
+                crew = choose_crew(busy, rid, time, length, trucks, drivers)
+                if crew is None:
+                    return False
+                tid, eid1, eid2 = crew
+                # reserve the crew right away so no other task can pick it
+                busy.add_trip(rid, tid, eid1, eid2, time, trip_end(time, length))
+
+            try:
+                await self.pool.execute(Q['ww_insert_trip'], rid, tid, time, eid1, eid2, facility)
+            except asyncpg.PostgresError:
+                # take back only this reservation, other tasks may hold theirs
+                async with self._days_lock:
+                    busy.remove_trip(rid, tid, eid1, eid2, time, trip_end(time, length))
+                return False
+            return True
+
+        except asyncpg.PostgresError:
+            return False
+
+    async def schedule_trips(self, tid: int, date: dt.date) -> int:
+        """See WasteWrangler.schedule_trips."""
+        try:
+            day_one = _midnight(date)
+            day_two = _midnight(date + dt.timedelta(days=1))
+            trucktype, busy_rows, drivers = await asyncio.gather(
+                self.pool.fetchval(Q['ww_truck_type'], tid),
+                self.pool.fetch(Q['ww_drivers_on_day'], day_one, day_two),
+                self.pool.fetch(Q['ww_all_drivers']))
+            if trucktype is None:
+                return 0
+            busy_drivers = {row[0] for row in busy_rows}
+            of_type, routes = await asyncio.gather(
+                self.pool.fetch(Q['ww_drivers_of_type'], trucktype),
+                self.pool.fetch(Q['ww_unscheduled_routes'], trucktype, day_one, day_two))
+
+            crew = pick_drivers([row[0] for row in of_type], [row[0] for row in drivers],
+                                busy_drivers)
+            if crew is None:
+                return 0
+            eid1, eid2 = crew
+
+            # back to back from 8:00 until a trip would end after 15:30; route
+            # details are fetched ROUTE_BATCH routes at a time, since only the
+            # first few routes fit
+            rids = [row[0] for row in routes]
+            planned = [] # [(<rid>, <wastetype>, <start>, <end>)]
+            given_time = dt.datetime.combine(date, dt.time(8, 0))
+            for i in range(0, len(rids), ROUTE_BATCH):
+                batch = rids[i:i + ROUTE_BATCH]
+                details = {row[0]: row for row in await self.pool.fetch(ROUTE_DETAILS, batch)}
+                packed, given_time = pack_trips(given_time, [details[rid] for rid in batch])
+                planned += packed
+                if given_time is None:
+                    break
+
+            wastetypes = sorted({wastetype for _, wastetype, _, _ in planned})
+            facilities = dict(zip(wastetypes, await asyncio.gather(*(
+                self.pool.fetchval(Q['ww_first_facility'], wastetype) for wastetype in wastetypes))))
+
+            # all trips or none, and the index only learns about committed ones
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    for rid, wastetype, start, _ in planned:
+                        await conn.execute(Q['ww_insert_trip_with_volume'], rid, tid,
+                                           start, None, eid1, eid2, facilities[wastetype])
+            busy = self.days.get(date)
+            if busy is not None:
+                for rid, _, start, end in planned:
+                    busy.add_trip(rid, tid, eid1, eid2, start, end)
+            return len(planned)
+
+        except asyncpg.PostgresError:
+            return 0
+
+    async def update_technicians(self, qualifications_file: TextIO) -> int:
+        """See WasteWrangler.update_technicians."""
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute('create temp table if not exists QualificationStaging '
+                                       '(name varchar(101), trucktype varchar(50))')
+                    await conn.execute('truncate QualificationStaging')
+                    await conn.copy_records_to_table(
+                        'qualificationstaging', columns=['name', 'trucktype'],
+                        records=((first + ' ' + last, trucktype) for first, last, trucktype
+                                 in WasteWrangler._iter_qualifications_file(qualifications_file)))
+                    status = await conn.execute(INSERT_QUALIFICATIONS)
+                    await conn.execute('truncate QualificationStaging')
+            return int(status.split()[-1]) # 'INSERT 0 <count>'
+        except asyncpg.PostgresError:
+            return 0
+
+    async def workmate_sphere(self, eid: int) -> list[int]:
+        """See WasteWrangler.workmate_sphere."""
+        try:
+            return [row[0] for row in await self.pool.fetch(Q['ww_workmate_sphere'], eid)]
+        except asyncpg.PostgresError:
+            return []
+
+    async def schedule_maintenance(self, date: dt.date) -> int:
+        """See WasteWrangler.schedule_maintenance."""
+        try:
+            one_plus_date = date + dt.timedelta(days=1)
+            trucks, techs, maintenance, trips = await asyncio.gather(
+                self.pool.fetch(Q['ww_trucks_needing_maintenance'],
+                                date - dt.timedelta(days=90), date + dt.timedelta(days=10)),
+                self.pool.fetch(Q['ww_technicians']),
+                self.pool.fetch('select tid, eid, mdate from Maintenance where mdate >= $1',
+                                one_plus_date),
+                self.pool.fetch('select distinct tid, date(ttime) from Trip where ttime >= $1',
+                                _midnight(one_plus_date)))
+            if len(trucks) == 0:
+                return 0
+
+            tech_busy = {}
+            truck_busy = {}
+            for tid, eid, mdate in maintenance:
+                tech_busy.setdefault(eid, set()).add(mdate)
+                truck_busy.setdefault(tid, set()).add(mdate)
+            for tid, tdate in trips:
+                truck_busy.setdefault(tid, set()).add(tdate)
+
+            calendar = TechnicianCalendar(one_plus_date, techs, tech_busy, truck_busy)
+            final_list = []
+            for tid, trucktype in trucks:
+                match = calendar.assign(tid, trucktype)
+                if match is not None:
+                    final_list.append((tid, match[0], match[1]))
+
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.executemany('insert into Maintenance values ($1, $2, $3)', final_list)
+            for tid, _, mdate in final_list:
+                busy = self.days.get(mdate)
+                if busy is not None:
+                    busy.maintenance.add(tid)
+            return len(final_list)
+
+        except asyncpg.PostgresError:
+            return 0
+
+    async def reroute_waste(self, fid: int, date: dt.date) -> int:
+        """See WasteWrangler.reroute_waste."""
+        try:
+            wastetype = await self.pool.fetchval(Q['ww_facility_waste_type'], fid)
+            if wastetype is None:
+                return 0
+            replacement = await self.pool.fetchval(Q['ww_other_facility'], wastetype, fid)
+            if replacement is None:
+                return 0
+            status = await self.pool.execute(Q['ww_reroute_trips'], replacement, fid,
+                                             _midnight(date),
+                                             _midnight(date + dt.timedelta(days=1)))
+            return int(status.split()[-1]) # 'UPDATE <count>'
+        except asyncpg.PostgresError:
+            return 0
+
+    # =========================== Helper methods ============================= #
+
+    async def _day(self, date: dt.date) -> BusyDay:
+        """Return the BusyDay for <date>, loading it if needed. The caller
+        must hold _days_lock.
+        """
+        busy = self.days.get(date)
+        if busy is not None:
+            return busy
+        trips, maintenance = await asyncio.gather(
+            self.pool.fetch(DAY_TRIPS, _midnight(date), _midnight(date + dt.timedelta(days=1))),
+            self.pool.fetch(DAY_MAINTENANCE, date))
+        busy = BusyDay()
+        for rid, tid, eid1, eid2, ttime, length in trips:
+            busy.add_trip(rid, tid, eid1, eid2, ttime, trip_end(ttime, length))
+        busy.maintenance.update(row[0] for row in maintenance)
+        self.days[date] = busy
+        return busy
@@ -0,0 +1,253 @@
+"""CSC343 Assignment 2 - scaling benchmark
+
+=== Module Description ===
+
+This file times every public WasteWrangler method against a local Postgres
+database filled by generate_data.py, at one or more scale points, and writes
+a JSON report. Given the report of an earlier run, it also flags methods that
+got slower than a tolerance allows, so regressions are caught before they
+reach production data.
+
+The waste_wrangler schema in the benchmark database is dropped and recreated
+for every scale point. Never point this at a database you care about.
+
+Usage:
+    python benchmark.py --dbname bench --user me --scales tiny,small \
+        --output report.json [--baseline old_report.json] [--indexes]
+"""
+
+import argparse
+import datetime as dt
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from typing import Callable, Optional
+
+import psycopg2 as pg
+
+from a2 import WasteWrangler
+from generate_data import Scale, load
+from migrations import check_plans, migrate
+
+
+# scale points, from a quick smoke run to production size
+SCALES = {
+    'tiny': Scale(trucks=10, employees=100, routes=50, facilities=10, trips=1_000),
+    'small': Scale(trucks=100, employees=1_000, routes=500, facilities=20, trips=50_000),
+    'medium': Scale(trucks=1_000, employees=10_000, routes=5_000, facilities=50, trips=1_000_000),
+    'large': Scale(trucks=10_000, employees=100_000, routes=50_000, facilities=200, trips=10_000_000),
+}
+# a method is flagged once its median time grows by more than this share
+TOLERANCE = 0.25
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'waste_wrangler_schema.sql')
+
+
+def setup_database(connect_args: dict, scale: Scale, seed: int,
+                   indexes: bool = False) -> dict[str, int]:
+    """Recreate the waste_wrangler schema and load generated data for
+    <scale> and <seed> into it, then add the indexes from migrations.py if
+    <indexes>. Return the number of rows per table.
+    """
+    connection = pg.connect(**connect_args)
+    try:
+        with connection.cursor() as cur, open(SCHEMA_FILE) as schema_file:
+            cur.execute(schema_file.read())
+        connection.commit()
+        counts = load(connection, scale, seed)
+        if indexes:
+            migrate(connection)
+            connection.autocommit = False
+        with connection.cursor() as cur:
+            cur.execute('analyze;')
+        connection.commit()
+        return counts
+    finally:
+        connection.close()
+
+
+# a qualifications file (see the A2 handout) with <n> entries for made up
+# and generated employees
+def _qualifications(scale: Scale, n: int, rng: random.Random) -> io.StringIO:
+    lines = []
+    for _ in range(n):
+        eid = rng.randint(1, scale.employees + 10)
+        lines.append(f'First{eid} Last{eid}')
+        lines.append(rng.choice('ABCDEF'))
+    return io.StringIO('\n'.join(lines) + '\n')
+
+
+def workloads(scale: Scale, rng: random.Random) -> dict[str, Callable[[WasteWrangler], object]]:
+    """Return {<workload>: <function running it once on a WasteWrangler>}
+    for data generated at <scale>, a workload per public method and option.
+
+    Arguments are drawn from <rng> so every run of the same seed does the
+    same work. Trips are scheduled after the generated ones so they don't run
+    into them.
+    """
+    future = scale.start + dt.timedelta(days=3650)
+
+    def some_time() -> dt.datetime:
+        return dt.datetime.combine(future + dt.timedelta(days=rng.randint(0, 365)),
+                                   dt.time(rng.randint(8, 12), rng.choice([0, 15, 30, 45])))
+
+    def some_day() -> dt.date:
+        return scale.start + dt.timedelta(days=rng.randint(0, 30))
+
+    def some_week() -> tuple[dt.date, dt.date]:
+        first_day = future + dt.timedelta(days=rng.randint(731, 1095))
+        return first_day, first_day + dt.timedelta(days=6)
+
+    def some_driver() -> int:
+        return rng.randint(1, max(2, int(scale.employees * 0.6)))
+
+    return {
+        'schedule_trip': lambda ww: ww.schedule_trip(rng.randint(1, scale.routes), some_time()),
+        'schedule_trip_batch': lambda ww: ww.schedule_trip_batch(
+            [(rng.randint(1, scale.routes), some_time()) for _ in range(100)]),
+        'schedule_trip_batch_optimal': lambda ww: ww.schedule_trip_batch(
+            [(rng.randint(1, scale.routes), some_time()) for _ in range(100)], optimal=True),
+        'schedule_trips': lambda ww: ww.schedule_trips(
+            rng.randint(1, scale.trucks), future + dt.timedelta(days=rng.randint(366, 730))),
+        'schedule_fleet': lambda ww: ww.schedule_fleet(
+            rng.sample(range(1, scale.trucks + 1), min(10, scale.trucks)),
+            *some_week()),
+        'update_technicians': lambda ww: ww.update_technicians(
+            _qualifications(scale, max(10, scale.employees // 10), rng)),
+        'workmate_sphere': lambda ww: ww.workmate_sphere(some_driver()),
+        'workmate_spheres': lambda ww: ww.workmate_spheres(
+            [some_driver() for _ in range(100)]),
+        'schedule_maintenance': lambda ww: ww.schedule_maintenance(some_day()),
+        'reroute_waste': lambda ww: ww.reroute_waste(rng.randint(1, scale.facilities), some_day()),
+        'reroute_waste_bulk': lambda ww: ww.reroute_waste_bulk(
+            [(rng.randint(1, scale.facilities), some_day(), some_day() + dt.timedelta(days=6))
+             for _ in range(10)]),
+    }
+
+
+def run_scale(connect_args: dict, name: str, scale: Scale, repeat: int,
+              seed: int, indexes: bool = False) -> dict:
+    """Load the scale point <scale> called <name> and time every workload
+    <repeat> times. Return the part of the report for this scale point,
+    including the queries that don't use their index if <indexes>.
+    """
+    load_start = time.perf_counter()
+    rows = setup_database(connect_args, scale, seed, indexes)
+    load_seconds = time.perf_counter() - load_start
+    plan_problems = []
+    if indexes:
+        connection = pg.connect(**connect_args)
+        try:
+            plan_problems = check_plans(connection)
+        finally:
+            connection.close()
+
+    ww = WasteWrangler()
+    if not ww.connect(connect_args['dbname'], connect_args['user'], connect_args['password']):
+        raise RuntimeError(f"Couldn't connect to {connect_args['dbname']}")
+    rng = random.Random(seed)
+    methods = {}
+    try:
+        for method, workload in workloads(scale, rng).items():
+            timings = []
+            errors = 0
+            for _ in range(repeat):
+                start = time.perf_counter()
+                try:
+                    workload(ww)
+                except Exception: # a failing method is reported, not fatal
+                    errors += 1
+                    ww.connection.rollback()
+                timings.append(time.perf_counter() - start)
+            methods[method] = {
+                'median': statistics.median(timings),
+                'min': min(timings),
+                'max': max(timings),
+                'runs': repeat,
+                'errors': errors,
+            }
+    finally:
+        ww.disconnect()
+
+    return {'scale': scale._asdict() | {'start': scale.start.isoformat()},
+            'rows': rows, 'load_seconds': load_seconds, 'methods': methods,
+            'plan_problems': plan_problems}
+
+
+def compare(report: dict, baseline: dict, tolerance: float = TOLERANCE) -> list[str]:
+    """Return a line for every method whose median time in <report> is more
+    than <tolerance> above its median in <baseline> at the same scale point.
+    """
+    regressions = []
+    for name, result in report.items():
+        for method, timing in result['methods'].items():
+            before = baseline.get(name, {}).get('methods', {}).get(method)
+            if before is None or before['median'] <= 0:
+                continue
+            ratio = timing['median'] / before['median']
+            if ratio > 1 + tolerance:
+                regressions.append(f'{name}/{method}: {before["median"]:.4f}s -> '
+                                   f'{timing["median"]:.4f}s ({ratio:.2f}x)')
+    return regressions
+
+
+def format_report(report: dict) -> str:
+    """Return <report> as a table, one row per method and one column per
+    scale point, holding median seconds.
+    """
+    names = list(report)
+    methods = sorted({method for result in report.values() for method in result['methods']})
+    lines = ['method'.ljust(22) + ''.join(name.rjust(12) for name in names)]
+    for method in methods:
+        cells = []
+        for name in names:
+            timing = report[name]['methods'].get(method)
+            cells.append('-' if timing is None else f'{timing["median"]:.4f}')
+        lines.append(method.ljust(22) + ''.join(cell.rjust(12) for cell in cells))
+    return '\n'.join(lines)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark WasteWrangler across scales.')
+    parser.add_argument('--dbname', required=True)
+    parser.add_argument('--user', required=True)
+    parser.add_argument('--password', default='')
+    parser.add_argument('--scales', default='tiny',
+                        help=f'comma separated, out of {", ".join(SCALES)}')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=343)
+    parser.add_argument('--output', default='benchmark_report.json')
+    parser.add_argument('--baseline', help='earlier report to compare against')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--indexes', action='store_true',
+                        help='apply migrations.py and check query plans before timing')
+    args = parser.parse_args(argv)
+
+    connect_args = dict(dbname=args.dbname, user=args.user, password=args.password)
+    report = {}
+    for name in args.scales.split(','):
+        report[name] = run_scale(connect_args, name, SCALES[name], args.repeat, args.seed,
+                                 args.indexes)
+        for problem in report[name]['plan_problems']:
+            print(f'PLAN {name}/{problem}')
+
+    with open(args.output, 'w') as out:
+        json.dump(report, out, indent=2)
+    print(format_report(report))
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(report, json.load(baseline_file), args.tolerance)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,290 @@
+"""CSC343 Assignment 2 - columnar snapshots
+
+=== Module Description ===
+
+This file loads Trip, Maintenance, Driver, Truck and Route into NumPy
+arrays, one array per column, with COPY in binary format. Filtering them is
+then a vectorized operation instead of a loop over row tuples, and a row
+takes a few dozen bytes instead of a tuple of Python objects.
+
+Text columns (truckType, wasteType) are dictionary-encoded: they hold the
+index of their value in ColumnarSnapshot.strings, or -1 for NULL. The
+encoding and NULL handling happen in the COPY query, so every row has the
+same width and the whole COPY stream is parsed with a single np.frombuffer
+call. NULL integers become -1 and NULL floats become NaN.
+
+valid_truck_times checks many candidate trip times at once, the way
+valid_truck_time in a2.py checks one.
+
+Only WasteWrangler.preload_availability reads a ColumnarSnapshot. The other
+methods stay on row queries on purpose: schedule_trip and schedule_trips
+check candidates against the BusyDay of one day, which the availability
+index already holds (and which preload_availability fills from a snapshot),
+so there are no rows left to filter in bulk; update_technicians joins the
+file against Employee and Driver in the database without reading any of
+the tables this module loads. valid_truck_times is there for callers that
+check many times at once, e.g. benchmarks of the planners.
+
+NumPy is only needed by this module; a2.py imports it only when
+WasteWrangler.preload_availability is called.
+"""
+
+import datetime as dt
+import io
+from typing import Iterable, Optional
+
+import numpy as np
+import psycopg2.extensions as pg_ext
+
+from a2 import BusyDay, DAY_END, DAY_START, TRIP_BUFFER, TRUCK_SPEED
+
+
+# {<table>: [(<column>, <kind>)]}, kind is one of int, float, timestamp,
+# date and text
+TABLES = {
+    'Trip': [('rid', 'int'), ('tid', 'int'), ('ttime', 'timestamp'), ('volume', 'float'),
+             ('eid1', 'int'), ('eid2', 'int'), ('fid', 'int')],
+    'Maintenance': [('tid', 'int'), ('eid', 'int'), ('mdate', 'date')],
+    'Driver': [('eid', 'int'), ('trucktype', 'text')],
+    'Truck': [('tid', 'int'), ('trucktype', 'text'), ('capacity', 'float')],
+    'Route': [('rid', 'int'), ('wastetype', 'text'), ('length', 'float')],
+}
+# the columns that limit Trip and Maintenance to a range of days
+DAY_COLUMNS = {'Trip': 'ttime', 'Maintenance': 'mdate'}
+
+# big-endian wire format of every kind in binary COPY
+_WIRE = {'int': '>i4', 'float': '>f8', 'timestamp': '>i8', 'date': '>i4', 'text': '>i4'}
+# binary COPY header signature, see the COPY documentation
+_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+# Postgres counts timestamps and dates from 2000-01-01
+_PG_EPOCH_US = 946_684_800_000_000
+_PG_EPOCH_DAYS = 10_957
+
+
+# the select list of the COPY query for <table>, text columns as their index
+# in the %(strings)s array
+def _select_list(table: str) -> str:
+    expressions = []
+    for column, kind in TABLES[table]:
+        if kind == 'int':
+            expressions.append(f'coalesce({column}, -1)::int4')
+        elif kind == 'float':
+            expressions.append(f"coalesce({column}::float8, 'NaN')")
+        elif kind == 'text':
+            expressions.append(f'coalesce(array_position(%(strings)s::text[], {column}::text) - 1, -1)::int4')
+        else:
+            expressions.append(column)
+    return ', '.join(expressions)
+
+
+def parse_binary_copy(data: bytes, columns: list[tuple[str, str]]) -> dict[str, np.ndarray]:
+    """Return {<column>: <array>} for the output of COPY ... TO STDOUT WITH
+    (FORMAT binary) in <data>, where every row holds non-NULL values of
+    <columns> as in TABLES. NULLs must have been replaced in the query
+    (see _select_list), since a NULL field has no data and would change
+    the width of its row.
+
+    Raise ValueError if <data> isn't in that format or holds a NULL.
+    """
+    if not data.startswith(_SIGNATURE) or len(data) < 21:
+        raise ValueError('not a binary COPY stream')
+    extension = int.from_bytes(data[15:19], 'big')
+    start = 19 + extension
+    end = len(data) - 2 # trailer, a field count of -1
+    if data[end:] != b'\xff\xff':
+        raise ValueError('binary COPY stream is truncated')
+
+    dtype = np.dtype([('fields', '>i2')] +
+                     [field for column, kind in columns
+                      for field in ((f'{column}__length', '>i4'), (column, _WIRE[kind]))])
+    if (end - start) % dtype.itemsize != 0:
+        raise ValueError('binary COPY rows are not all the same width')
+    rows = np.frombuffer(data, dtype, count=(end - start) // dtype.itemsize, offset=start)
+    if len(rows) > 0 and (rows['fields'] != len(columns)).any():
+        raise ValueError('binary COPY rows have the wrong number of fields')
+    for column, kind in columns:
+        if len(rows) > 0 and (rows[f'{column}__length'] != np.dtype(_WIRE[kind]).itemsize).any():
+            raise ValueError(f'binary COPY column {column} holds NULL or has the wrong width')
+
+    result = {}
+    for column, kind in columns:
+        values = rows[column]
+        if kind == 'float':
+            result[column] = values.astype(np.float64)
+        elif kind == 'timestamp':
+            result[column] = (values.astype(np.int64) + _PG_EPOCH_US).view('datetime64[us]')
+        elif kind == 'date':
+            result[column] = (values.astype(np.int64) + _PG_EPOCH_DAYS).astype('datetime64[D]')
+        else:
+            result[column] = values.astype(np.int32)
+    return result
+
+
+# <times> as an array of datetime64[us], without a round trip through Python
+# objects if it already is an array
+def _datetimes(times: Iterable) -> np.ndarray:
+    if (not isinstance(times, np.ndarray)):
+        times = list(times)
+    return np.asarray(times, dtype='datetime64[us]')
+
+
+def valid_truck_times(truck_times: Iterable[dt.datetime], given_times: Iterable[dt.datetime],
+                      lengths) -> np.ndarray:
+    """Return a boolean matrix with a row per time in <truck_times> and a
+    column per time in <given_times>, True where valid_truck_time in a2.py
+    returns True for that truck time, given time and length.
+
+    Times may also be arrays of datetime64, which skips converting them.
+    <lengths> is the length of the route of every given time, or a single
+    length for all of them. A given time is feasible for a truck iff its
+    column is all True, i.e. matrix.all(axis=0).
+    """
+    truck = _datetimes(truck_times).reshape(-1, 1)
+    given = _datetimes(given_times).reshape(1, -1)
+    lengths = np.broadcast_to(np.asarray(lengths, dtype=np.float64), given.shape)
+    buffer = np.timedelta64(TRIP_BUFFER)
+    day_start = np.timedelta64(dt.timedelta(hours=DAY_START.hour, minutes=DAY_START.minute))
+    day_end = np.timedelta64(dt.timedelta(hours=DAY_END.hour, minutes=DAY_END.minute))
+
+    truck_day = truck.astype('datetime64[D]')
+    given_day = given.astype('datetime64[D]')
+    truck_time = truck - truck_day
+    given_time = given - given_day
+
+    # valid_truck_time only adds whole hours of driving
+    hours = np.trunc(lengths / TRUCK_SPEED).astype(np.int64)
+    end = given + hours * np.timedelta64(3_600_000_000, 'us')
+    end_time = end - end.astype('datetime64[D]')
+
+    # the truck's trip starts before the given time
+    after_truck = given - truck > buffer
+    # the truck's trip starts at or after the given time
+    before_truck = (end_time <= day_end) & (end_time < truck_time) & (truck - end > buffer)
+
+    return ((truck_day != given_day) |
+            ((given_time >= day_start) & np.where(given_time > truck_time, after_truck, before_truck)))
+
+
+class ColumnarSnapshot:
+    """Columns of Trip, Maintenance, Driver, Truck and Route as NumPy arrays,
+    see ColumnarSnapshot.load.
+
+    === Instance Attributes ===
+    strings: every truckType and wasteType value, in sorted order; text
+    columns hold indexes into this list.
+    tables: {<table>: {<column>: <array>}} with the columns in TABLES.
+    """
+    strings: list[str]
+    tables: dict[str, dict[str, np.ndarray]]
+    _codes: dict[str, int]
+
+    def __init__(self, strings: list[str], tables: dict[str, dict[str, np.ndarray]]) -> None:
+        self.strings = strings
+        self.tables = tables
+        self._codes = {value: code for code, value in enumerate(strings)}
+
+    @classmethod
+    def load(cls, connection: pg_ext.connection, tables: Optional[Iterable[str]] = None,
+             first_day: Optional[dt.date] = None, last_day: Optional[dt.date] = None
+             ) -> 'ColumnarSnapshot':
+        """Return the tables in <tables> (all of TABLES if None) of the
+        database of <connection>, with the search path set to waste_wrangler.
+        Trip and Maintenance are limited to the days from <first_day> to
+        <last_day> inclusive, if given.
+
+        Everything is read in one read-only REPEATABLE READ transaction, so
+        the tables are consistent with each other. Any open transaction on
+        <connection> is committed first.
+        """
+        tables = list(TABLES if tables is None else tables)
+        connection.commit()
+        cur = connection.cursor()
+        try:
+            cur.execute('set transaction isolation level repeatable read, read only;')
+            cur.execute('select distinct value from ('
+                        'select trucktype as value from TruckType union all '
+                        'select wastetype from TruckType union all '
+                        'select trucktype from Driver union all '
+                        'select wastetype from Route) s '
+                        'where value is not null order by value;')
+            strings = [row[0] for row in cur.fetchall()]
+
+            columns = {}
+            for table in tables:
+                conditions = []
+                if table in DAY_COLUMNS and first_day is not None:
+                    conditions.append(cur.mogrify(f'{DAY_COLUMNS[table]} >= %s',
+                                                  (dt.datetime.combine(first_day, dt.time(0, 0)),)).decode())
+                if table in DAY_COLUMNS and last_day is not None:
+                    conditions.append(cur.mogrify(f'{DAY_COLUMNS[table]} < %s',
+                                                  (dt.datetime.combine(last_day + dt.timedelta(days=1),
+                                                                       dt.time(0, 0)),)).decode())
+                where = f' where {" and ".join(conditions)}' if conditions else ''
+                query = cur.mogrify(f'copy (select {_select_list(table)} from {table}{where}) '
+                                    f'to stdout with (format binary);', {'strings': strings}).decode()
+                buffer = io.BytesIO()
+                cur.copy_expert(query, buffer)
+                columns[table] = parse_binary_copy(buffer.getvalue(), TABLES[table])
+        finally:
+            cur.close()
+            connection.rollback()
+        return cls(strings, columns)
+
+    def code(self, value: str) -> int:
+        """Return the dictionary code of <value>, -1 if no row has it."""
+        return self._codes.get(value, -1)
+
+    def decode(self, codes: np.ndarray) -> list[Optional[str]]:
+        """Return the strings of dictionary <codes>, None for -1."""
+        return [None if code < 0 else self.strings[code] for code in codes.tolist()]
+
+    def nbytes(self) -> int:
+        """Return the memory taken by all columns, in bytes."""
+        return sum(array.nbytes for columns in self.tables.values() for array in columns.values())
+
+    def trips_between(self, start: dt.datetime, end: dt.datetime) -> np.ndarray:
+        """Return a boolean mask of the loaded trips starting at or after
+        <start> and before <end>.
+        """
+        ttime = self.tables['Trip']['ttime']
+        return (ttime >= np.datetime64(start, 'us')) & (ttime < np.datetime64(end, 'us'))
+
+    def trip_ends(self) -> np.ndarray:
+        """Return when every loaded trip ends, from Route.length and
+        TRUCK_SPEED. Trips on routes that aren't loaded end when they start.
+        """
+        trips = self.tables['Trip']
+        routes = self.tables['Route']
+        lengths = np.zeros(max(int(routes['rid'].max(initial=0)), int(trips['rid'].max(initial=0))) + 1)
+        lengths[routes['rid']] = routes['length']
+        hours = lengths[np.maximum(trips['rid'], 0)]
+        return trips['ttime'] + np.rint(hours / TRUCK_SPEED * 3_600_000_000).astype('timedelta64[us]')
+
+    def busy_days(self, first_day: dt.date, last_day: dt.date) -> dict[dt.date, BusyDay]:
+        """Return a BusyDay for every day from <first_day> to <last_day>
+        inclusive, built from the loaded Trip, Route and Maintenance rows.
+        """
+        days = {}
+        date = first_day
+        while date <= last_day:
+            days[date] = BusyDay()
+            date += dt.timedelta(days=1)
+
+        trips = self.tables['Trip']
+        mask = self.trips_between(dt.datetime.combine(first_day, dt.time(0, 0)),
+                                  dt.datetime.combine(last_day + dt.timedelta(days=1), dt.time(0, 0)))
+        order = np.flatnonzero(mask)
+        order = order[np.argsort(trips['ttime'][order], kind='stable')]
+        ends = self.trip_ends()[order].tolist()
+        for rid, tid, eid1, eid2, start, end in zip(trips['rid'][order].tolist(), trips['tid'][order].tolist(),
+                                                    trips['eid1'][order].tolist(),
+                                                    trips['eid2'][order].tolist(),
+                                                    trips['ttime'][order].tolist(), ends):
+            days[start.date()].add_trip(rid, tid, eid1, eid2, start, end)
+
+        maintenance = self.tables['Maintenance']
+        mdate = maintenance['mdate']
+        mask = (mdate >= np.datetime64(first_day, 'D')) & (mdate <= np.datetime64(last_day, 'D'))
+        for tid, day in zip(maintenance['tid'][mask].tolist(), mdate[mask].tolist()):
+            days[day].maintenance.add(tid)
+        return days
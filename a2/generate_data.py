@@ -0,0 +1,292 @@
+"""CSC343 Assignment 2 - synthetic data
+
+=== Module Description ===
+
+This file generates data conforming to waste_wrangler_schema.sql at any
+scale, e.g. 10k trucks, 100k employees and 10M trips, so that WasteWrangler
+can be tested and benchmarked (see benchmark.py) against more than the
+handful of rows in waste_wrangler_data.sql.
+
+The same <seed> and Scale always produce the same data.
+
+Trips respect the rules the schema only states as comments: drivers and
+trucks are on one trip at a time with more than 30 minutes between trips,
+trucks have no trips on maintenance days, every trip is within working hours
+and at least one of its drivers can drive its truck.
+
+Usage (writes COPY blocks that psql can load):
+    python generate_data.py --trucks 10000 --employees 100000 \
+        --routes 50000 --trips 10000000 > big_data.sql
+    psql -f waste_wrangler_schema.sql -f big_data.sql
+"""
+
+import argparse
+import datetime as dt
+import random
+import sys
+from typing import Iterator, NamedTuple, Optional, TextIO
+
+import psycopg2.extensions as pg_ext
+
+from a2 import CopyStream, copy_escape, TRUCK_SPEED, TRIP_BUFFER, DAY_START, DAY_END
+
+
+# waste and truck types, the same as in waste_wrangler_data.sql
+WASTE_TYPES = ['plastic recycling', 'compost', 'paper recycling', 'landfill',
+               'aluminum containers', 'large items', 'electronic waste']
+TRUCK_TYPES = {
+    'A': ['plastic recycling', 'paper recycling'],
+    'B': ['plastic recycling'],
+    'C': ['compost', 'landfill'],
+    'D': ['large items', 'electronic waste'],
+    'E': ['aluminum containers', 'electronic waste'],
+}
+# every truck gets maintenance this often
+MAINTENANCE_EVERY = 90
+# share of employees that are drivers, the rest are technicians
+DRIVER_SHARE = 0.6
+# trucks and drivers looked at per trip before giving up on it
+ATTEMPTS = 8
+
+
+class Scale(NamedTuple):
+    """How much data to generate.
+
+    === Attributes ===
+    trucks: number of trucks.
+    employees: number of employees, drivers and technicians.
+    routes: number of routes, each has at most one trip per day.
+    facilities: number of facilities, at least one per waste type.
+    trips: number of trips, spread over as many days as needed starting on
+    <start>.
+    start: day of the first trip.
+    """
+    trucks: int
+    employees: int
+    routes: int
+    facilities: int
+    trips: int
+    start: dt.date = dt.date(2023, 1, 2)
+
+
+# table names in the order they have to be loaded in
+TABLES = ['WasteType', 'TruckType', 'Truck', 'Facility', 'Employee', 'Driver',
+          'Technician', 'Maintenance', 'Route', 'Stop', 'Trip']
+
+
+def generate(scale: Scale, seed: int = 343) -> Iterator[tuple[str, Iterator[tuple]]]:
+    """Yield (<table>, <rows>) for every table in TABLES, in that order.
+    Rows are tuples in the column order of waste_wrangler_schema.sql and are
+    produced lazily, so even the largest scales fit in memory.
+    """
+    rng = random.Random(seed)
+    truck_types = sorted(TRUCK_TYPES)
+    first_maintenance = scale.start - dt.timedelta(days=MAINTENANCE_EVERY)
+
+    yield 'WasteType', ((wastetype,) for wastetype in WASTE_TYPES)
+    yield 'TruckType', ((trucktype, wastetype)
+                        for trucktype in truck_types
+                        for wastetype in TRUCK_TYPES[trucktype])
+
+    # trucks cycle through the truck types
+    truck_type = {tid: truck_types[(tid - 1) % len(truck_types)]
+                  for tid in range(1, scale.trucks + 1)}
+    capacity = {tid: rng.randint(10, 30) for tid in truck_type}
+    yield 'Truck', ((tid, truck_type[tid], capacity[tid]) for tid in truck_type)
+
+    # the first facilities cover every waste type once
+    facility_waste = {fid: WASTE_TYPES[(fid - 1) % len(WASTE_TYPES)]
+                      if fid <= len(WASTE_TYPES) else rng.choice(WASTE_TYPES)
+                      for fid in range(1, max(scale.facilities, len(WASTE_TYPES)) + 1)}
+    yield 'Facility', ((fid, f'{fid} Facility Road', wastetype)
+                       for fid, wastetype in facility_waste.items())
+
+    # everyone is hired before the first maintenance
+    n_drivers = max(2, int(scale.employees * DRIVER_SHARE))
+    yield 'Employee', ((eid, f'First{eid} Last{eid}',
+                        first_maintenance - dt.timedelta(days=rng.randint(1, 10000)))
+                       for eid in range(1, max(scale.employees, n_drivers + 1) + 1))
+
+    # drivers are eids 1..n_drivers with one truck type, every fifth has two
+    driver_types = {}
+    for eid in range(1, n_drivers + 1):
+        types = [truck_types[eid % len(truck_types)]]
+        if eid % 5 == 0:
+            types.append(truck_types[(eid + 1) % len(truck_types)])
+        driver_types[eid] = types
+    yield 'Driver', ((eid, trucktype) for eid, types in driver_types.items()
+                     for trucktype in types)
+
+    # technicians are the other employees, each with two truck types
+    techs_of_type = {trucktype: [] for trucktype in truck_types}
+    for eid in range(n_drivers + 1, max(scale.employees, n_drivers + 1) + 1):
+        for trucktype in {truck_types[eid % len(truck_types)],
+                          truck_types[(eid + 2) % len(truck_types)]}:
+            techs_of_type[trucktype].append(eid)
+    yield 'Technician', ((eid, trucktype)
+                         for trucktype, eids in techs_of_type.items()
+                         for eid in eids)
+
+    # truck tid has maintenance every MAINTENANCE_EVERY days, offset by tid
+    n_days = _days_needed(scale)
+    last_day = scale.start + dt.timedelta(days=n_days)
+
+    def maintenance() -> Iterator[tuple]:
+        for tid in truck_type:
+            techs = techs_of_type[truck_type[tid]]
+            if not techs:
+                continue
+            day = first_maintenance + dt.timedelta(days=tid % MAINTENANCE_EVERY)
+            while day <= last_day:
+                yield tid, techs[(tid + day.toordinal()) % len(techs)], day
+                day += dt.timedelta(days=MAINTENANCE_EVERY)
+    yield 'Maintenance', maintenance()
+
+    route_waste = {rid: rng.choice(WASTE_TYPES) for rid in range(1, scale.routes + 1)}
+    route_length = {rid: rng.randint(5, 20) for rid in route_waste}
+    yield 'Route', ((rid, route_waste[rid], route_length[rid]) for rid in route_waste)
+    yield 'Stop', ((f'{stop} Route {rid} Street', rid, stop % 7 == 0)
+                   for rid in route_waste
+                   for stop in range(1, 1 + rid % 3 + 1))
+
+    yield 'Trip', _trips(scale, n_days, rng, truck_type, capacity, driver_types,
+                         facility_waste, route_waste, route_length)
+
+
+# number of days of trips needed to reach scale.trips
+def _days_needed(scale: Scale) -> int:
+    per_day = max(1, min(scale.routes, scale.trucks * 2))
+    return max(1, -(-scale.trips // per_day) * 2) # leave room for rejected trips
+
+
+# generates the trips, day by day, placing each route on the next truck
+# and drivers that are free long enough
+def _trips(scale: Scale, n_days: int, rng: random.Random,
+           truck_type: dict[int, str], capacity: dict[int, int],
+           driver_types: dict[int, list[str]], facility_waste: dict[int, str],
+           route_waste: dict[int, str], route_length: dict[int, int]) -> Iterator[tuple]:
+    trucks_of_waste = {wastetype: [] for wastetype in WASTE_TYPES}
+    for tid, trucktype in truck_type.items():
+        for wastetype in TRUCK_TYPES[trucktype]:
+            trucks_of_waste[wastetype].append(tid)
+    drivers_of_type = {trucktype: [] for trucktype in TRUCK_TYPES}
+    for eid, types in driver_types.items():
+        for trucktype in types:
+            drivers_of_type[trucktype].append(eid)
+    all_drivers = list(driver_types)
+    facilities_of_waste = {wastetype: [] for wastetype in WASTE_TYPES}
+    for fid, wastetype in facility_waste.items():
+        facilities_of_waste[wastetype].append(fid)
+
+    first_maintenance = scale.start - dt.timedelta(days=MAINTENANCE_EVERY)
+    per_day = max(1, min(scale.routes, scale.trucks * 2))
+    made = 0
+    # round robin pointers, so consecutive trips use different trucks/drivers
+    next_truck = {wastetype: 0 for wastetype in WASTE_TYPES}
+    next_driver = {trucktype: 0 for trucktype in TRUCK_TYPES}
+    next_partner = 0
+
+    for day_number in range(n_days):
+        if made >= scale.trips:
+            return
+        day = scale.start + dt.timedelta(days=day_number)
+        opening = dt.datetime.combine(day, DAY_START)
+        closing = dt.datetime.combine(day, DAY_END)
+        free = {} # {('truck' or 'driver', <id>): <first free time>}
+
+        for rid in rng.sample(range(1, scale.routes + 1), per_day):
+            if made >= scale.trips:
+                return
+            duration = dt.timedelta(hours=route_length[rid] / TRUCK_SPEED)
+            trucks = trucks_of_waste[route_waste[rid]]
+            if not trucks:
+                continue
+
+            placed = None
+            for _ in range(min(ATTEMPTS, len(trucks))):
+                tid = trucks[next_truck[route_waste[rid]] % len(trucks)]
+                next_truck[route_waste[rid]] += 1
+                if (day - first_maintenance).days % MAINTENANCE_EVERY == tid % MAINTENANCE_EVERY:
+                    continue # maintenance day
+                drivers = drivers_of_type[truck_type[tid]]
+                if not drivers:
+                    continue
+                eid1 = drivers[next_driver[truck_type[tid]] % len(drivers)]
+                next_driver[truck_type[tid]] += 1
+                eid2 = all_drivers[next_partner % len(all_drivers)]
+                next_partner += 1
+                if eid1 == eid2:
+                    eid2 = all_drivers[next_partner % len(all_drivers)]
+                    next_partner += 1
+                if eid1 == eid2:
+                    continue
+                start = max(opening, free.get(('truck', tid), opening),
+                            free.get(('driver', eid1), opening),
+                            free.get(('driver', eid2), opening))
+                if start + duration <= closing:
+                    placed = (tid, eid1, eid2, start)
+                    break
+            if placed is None:
+                continue
+
+            tid, eid1, eid2, start = placed
+            # strictly more than TRIP_BUFFER between trips
+            next_free = start + duration + TRIP_BUFFER + dt.timedelta(minutes=1)
+            for key in (('truck', tid), ('driver', eid1), ('driver', eid2)):
+                free[key] = next_free
+            made += 1
+            yield (rid, tid, start, rng.randint(1, capacity[tid]),
+                   max(eid1, eid2), min(eid1, eid2),
+                   rng.choice(facilities_of_waste[route_waste[rid]]))
+
+
+# converts a value to how COPY's text format expects it, None stays NULL
+def _text(value: object) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return str(value)
+
+
+def write_copy_script(out: TextIO, scale: Scale, seed: int = 343) -> None:
+    """Write the data for <scale> and <seed> to <out> as a psql script of
+    COPY ... FROM STDIN blocks.
+    """
+    out.write('set search_path to waste_wrangler;\n')
+    for table, rows in generate(scale, seed):
+        out.write(f'copy {table} from stdin;\n')
+        for row in rows:
+            out.write('\t'.join(copy_escape(_text(value)) for value in row) + '\n')
+        out.write('\\.\n')
+
+
+def load(connection: pg_ext.connection, scale: Scale, seed: int = 343) -> dict[str, int]:
+    """Load the data for <scale> and <seed> into the database of
+    <connection> with COPY and commit. The schema must already exist and be
+    empty.
+
+    Return {<table>: <number of rows loaded>}.
+    """
+    counts = {}
+    with connection.cursor() as cur:
+        cur.execute('set search_path to waste_wrangler;')
+        for table, rows in generate(scale, seed):
+            cur.copy_expert(f'copy {table} from stdin;',
+                            CopyStream(tuple(_text(value) for value in row) for row in rows))
+            counts[table] = cur.rowcount
+    connection.commit()
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate waste_wrangler data.')
+    parser.add_argument('--trucks', type=int, default=100)
+    parser.add_argument('--employees', type=int, default=1000)
+    parser.add_argument('--routes', type=int, default=500)
+    parser.add_argument('--facilities', type=int, default=20)
+    parser.add_argument('--trips', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=343)
+    args = parser.parse_args()
+    write_copy_script(sys.stdout, Scale(args.trucks, args.employees, args.routes,
+                                        args.facilities, args.trips), args.seed)
@@ -0,0 +1,181 @@
+"""CSC343 Assignment 2 - index migrations
+
+=== Module Description ===
+
+This file adds the secondary indexes the WasteWrangler queries filter on to
+a database created from waste_wrangler_schema.sql, and checks with EXPLAIN
+that the queries actually use them.
+
+Migrations are numbered and recorded in the SchemaMigrations table, so
+running them again only applies what is missing. Indexes are built with
+CREATE INDEX CONCURRENTLY, so Trip stays writable while they are built. A
+concurrent build that failed half way leaves an invalid index behind; it is
+dropped and built again on the next run.
+
+Trip(tID, tTime) is not in the list: the unique (tID, tTime) constraint of
+the schema already indexes it. maintenance_eid_mdate_idx is not used by any
+current query, which all filter Maintenance on mDATE alone; it is kept so
+databases that already have it stay at the same version.
+
+Usage:
+    python migrations.py --dbname bench --user me [--check]
+"""
+
+import argparse
+import sys
+from typing import Iterator, Optional
+
+import psycopg2 as pg
+import psycopg2.extensions as pg_ext
+
+from a2 import PREPARED_QUERIES
+
+
+# (<version>, <index name>, <table and columns>)
+MIGRATIONS = [
+    (1, 'trip_eid1_idx', 'Trip (eID1)'),
+    (2, 'trip_eid2_idx', 'Trip (eID2)'),
+    (3, 'trip_fid_ttime_idx', 'Trip (fID, tTime)'),
+    (4, 'trip_ttime_idx', 'Trip (tTime)'),
+    (5, 'maintenance_mdate_idx', 'Maintenance (mDATE)'),
+    (6, 'maintenance_eid_mdate_idx', 'Maintenance (eID, mDATE)'),
+    (7, 'driver_trucktype_idx', 'Driver (truckType)'),
+]
+
+# (<method>, <prepared query>, <sample arguments>, <index the plan must use>)
+# sample arguments are picked to be selective at benchmark scale
+PLAN_CHECKS = [
+    ('workmate_sphere', 'ww_workmate_sphere', (1,), 'trip_eid1_idx'),
+    ('workmate_sphere', 'ww_workmate_sphere', (1,), 'trip_eid2_idx'),
+    ('reroute_waste', 'ww_reroute_trips', (2, 1, '2023-01-10', '2023-01-11'), 'trip_fid_ttime_idx'),
+    ('schedule_trips', 'ww_drivers_on_day', ('2023-01-10', '2023-01-11'), 'trip_ttime_idx'),
+    ('schedule_trips', 'ww_drivers_of_type', ('A',), 'driver_trucktype_idx'),
+    ('schedule_trip', 'ww_route_on_day', (1, '2023-01-10', '2023-01-11'), 'trip_pkey'),
+    ('schedule_maintenance', 'ww_trucks_needing_maintenance', ('2023-01-10', '2023-01-12'),
+     'maintenance_mdate_idx'),
+]
+# queries built per call rather than prepared, same format as PLAN_CHECKS
+AD_HOC_CHECKS = [
+    ('schedule_trip', 'select t.rid, t.tid, t.eid1, t.eid2, t.ttime, r.length '
+                      'from Trip t join Route r on t.rid = r.rid '
+                      'where t.ttime >= %s and t.ttime < %s',
+     ('2023-01-10', '2023-01-11'), 'trip_ttime_idx'),
+    ('schedule_maintenance', 'select tid, eid, mdate from maintenance where mdate >= %s',
+     ('2023-12-01',), 'maintenance_mdate_idx'),
+    ('schedule_trip', 'select tid from Maintenance where mdate = %s',
+     ('2023-01-10',), 'maintenance_mdate_idx'),
+]
+
+
+def applied(connection: pg_ext.connection) -> set[int]:
+    """Return the versions already applied to the database of <connection>."""
+    with connection.cursor() as cur:
+        cur.execute('create table if not exists waste_wrangler.SchemaMigrations ('
+                    'version int primary key, name varchar(63) not null, '
+                    'applied timestamp not null default now());')
+        cur.execute('select version from waste_wrangler.SchemaMigrations;')
+        return {row[0] for row in cur.fetchall()}
+
+
+def migrate(connection: pg_ext.connection, target: Optional[int] = None) -> list[int]:
+    """Apply every migration up to version <target> (all if None) that
+    hasn't been applied yet, in order. <connection> is switched to autocommit
+    since CREATE INDEX CONCURRENTLY can't run inside a transaction.
+
+    Return the versions applied by this call.
+    """
+    connection.autocommit = True
+    done = applied(connection)
+    newly_applied = []
+    with connection.cursor() as cur:
+        for version, name, columns in MIGRATIONS:
+            if version in done or (target is not None and version > target):
+                continue
+            # a failed concurrent build leaves an invalid index with this name
+            cur.execute('select i.indisvalid from pg_index i join pg_class c on c.oid = i.indexrelid '
+                        'join pg_namespace n on n.oid = c.relnamespace '
+                        "where n.nspname = 'waste_wrangler' and c.relname = %s;", (name,))
+            row = cur.fetchone()
+            if row is not None and not row[0]:
+                cur.execute(f'drop index concurrently waste_wrangler.{name};')
+            cur.execute(f'create index concurrently if not exists {name} on waste_wrangler.{columns};')
+            cur.execute('insert into waste_wrangler.SchemaMigrations (version, name) values (%s, %s) '
+                        'on conflict (version) do nothing;', (version, name))
+            newly_applied.append(version)
+    return newly_applied
+
+
+# yields every node of an EXPLAIN (FORMAT JSON) plan
+def _nodes(plan: dict) -> Iterator[dict]:
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from _nodes(child)
+
+
+def explain(connection: pg_ext.connection, query: str, args: tuple,
+            prepared: bool = False) -> dict:
+    """Return the EXPLAIN (FORMAT JSON) plan of <query> with <args>. If
+    <prepared>, <query> is the name of a query in PREPARED_QUERIES and the
+    plan is that of executing the prepared statement.
+
+    Nothing is executed: statements are explained without ANALYZE and the
+    transaction is rolled back.
+    """
+    with connection.cursor() as cur:
+        cur.execute('set search_path to waste_wrangler;')
+        if prepared:
+            cur.execute(f'prepare check_{query} as {PREPARED_QUERIES[query]};')
+            cur.execute(f'explain (format json) execute check_{query} '
+                        f'({", ".join(["%s"] * len(args))});', args)
+            plan = cur.fetchone()[0][0]['Plan']
+            cur.execute(f'deallocate check_{query};')
+        else:
+            cur.execute(f'explain (format json) {query};', args)
+            plan = cur.fetchone()[0][0]['Plan']
+    connection.rollback()
+    return plan
+
+
+def check_plans(connection: pg_ext.connection) -> list[str]:
+    """Check that every query in PLAN_CHECKS and AD_HOC_CHECKS uses its
+    index. Only meaningful on a database of benchmark size: on tiny tables
+    the planner rightly prefers sequential scans.
+
+    Return a line for every query that doesn't use its index.
+    """
+    connection.autocommit = False
+    failures = []
+    checks = [(method, query, args, index, True) for method, query, args, index in PLAN_CHECKS]
+    checks += [(method, query, args, index, False) for method, query, args, index in AD_HOC_CHECKS]
+    for method, query, args, index, prepared in checks:
+        plan = explain(connection, query, args, prepared)
+        used = {node.get('Index Name') for node in _nodes(plan)}
+        if index not in used:
+            scans = sorted({f"{node['Node Type']} on {node['Relation Name']}"
+                            for node in _nodes(plan) if 'Relation Name' in node})
+            failures.append(f'{method}: {query if prepared else query[:40]} does not use '
+                            f'{index} ({", ".join(scans)})')
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Add the waste_wrangler indexes.')
+    parser.add_argument('--dbname', required=True)
+    parser.add_argument('--user', required=True)
+    parser.add_argument('--password', default='')
+    parser.add_argument('--target', type=int, help='last version to apply')
+    parser.add_argument('--check', action='store_true',
+                        help='check that the queries use the indexes afterwards')
+    args = parser.parse_args()
+
+    conn = pg.connect(dbname=args.dbname, user=args.user, password=args.password)
+    try:
+        versions = migrate(conn, args.target)
+        print(f'applied {versions}' if versions else 'nothing to apply')
+        if args.check:
+            problems = check_plans(conn)
+            for problem in problems:
+                print(f'PLAN {problem}')
+            sys.exit(1 if problems else 0)
+    finally:
+        conn.close()
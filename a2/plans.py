@@ -0,0 +1,260 @@
+"""CSC343 Assignment 2 - query plan baselines
+
+=== Module Description ===
+
+This file records the EXPLAIN (ANALYZE, BUFFERS) plan of every statement the
+WasteWrangler methods issue while running the benchmark workloads on
+generated data, and compares them with baselines kept in
+plan_baselines.json. It flags:
+    * plans whose shape (node types, joins, tables and indexes) changed,
+    * sequential scans that look at more rows than a threshold,
+    * statements whose estimated cost grew by more than a tolerance.
+
+Statements are explained right before they run, through the explainer of
+WasteWrangler.enable_instrumentation, so each plan sees exactly the data the
+statement does. EXPLAIN ANALYZE executes the statement; it runs inside a
+savepoint that is rolled back, so the method still makes its own changes
+only once.
+
+Baselines are normalized: they keep the plan shape, the estimated cost, the
+rows returned and the rows each sequential scan looked at, but no timings or
+literal values. Statements are keyed by their text with literals replaced by
+?, prepared statements by their name.
+
+The waste_wrangler schema in the database is dropped and recreated for every
+scale point, like benchmark.py does. Never point this at a database you care
+about.
+
+Usage:
+    python plans.py --dbname bench --user me --scales tiny --update
+    python plans.py --dbname bench --user me --scales tiny [--indexes]
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+from typing import Optional
+
+import psycopg2 as pg
+import psycopg2.extensions as pg_ext
+
+from a2 import WasteWrangler
+from benchmark import SCALES, setup_database, workloads
+from generate_data import Scale
+from migrations import _nodes
+
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'plan_baselines.json')
+# a statement is flagged once its estimated cost grows by more than this share
+TOLERANCE = 0.25
+# a sequential scan is flagged once it looks at more rows than this
+SEQ_SCAN_ROWS = 10_000
+# statements that can be explained, by their first word
+EXPLAINABLE = {'select', 'insert', 'update', 'delete', 'with', 'execute'}
+
+# literals replaced by ? in statement keys
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+# the rows of a multi-row values list, all but the first dropped from keys
+_VALUES_ROWS = re.compile(r"(values\s*)(\([^()]*\))(?:\s*,\s*\([^()]*\))+", re.IGNORECASE)
+
+
+def statement_key(statement: str) -> str:
+    """Return the key of <statement> in a baseline: 'execute <name>' for a
+    prepared statement, otherwise its text in lowercase with literals
+    replaced by ?, whitespace collapsed and only the first row of a
+    multi-row values list kept, so batches of any size share a key.
+    """
+    words = statement.split()
+    if words[0].lower() == 'execute':
+        return f'execute {words[1].split("(")[0].rstrip(";")}'
+    key = ' '.join(_LITERALS.sub('?', statement).lower().split()).rstrip(';')
+    return _VALUES_ROWS.sub(r'\1\2', key)
+
+
+def plan_shape(node: dict) -> str:
+    """Return the shape of the EXPLAIN (FORMAT JSON) plan node <node>: node
+    types, join types, tables and indexes of it and everything below it.
+    """
+    label = node['Node Type']
+    if 'Join Type' in node:
+        label += f" ({node['Join Type']})"
+    if 'Relation Name' in node:
+        label += f" on {node['Relation Name']}"
+    if 'Index Name' in node:
+        label += f" using {node['Index Name']}"
+    children = [plan_shape(child) for child in node.get('Plans', [])]
+    return f'{label} [{", ".join(children)}]' if children else label
+
+
+def normalize(plan: dict) -> dict:
+    """Return the normalized form of the EXPLAIN (ANALYZE, BUFFERS, FORMAT
+    JSON) output <plan>, as stored in baselines.
+    """
+    root = plan['Plan']
+    seq_scans = []
+    for node in _nodes(root):
+        if node['Node Type'] == 'Seq Scan':
+            # ANALYZE reports rows per loop
+            examined = (node.get('Actual Rows', 0) + node.get('Rows Removed by Filter', 0)) \
+                * node.get('Actual Loops', 1)
+            seq_scans.append({'relation': node.get('Relation Name'), 'rows': examined})
+    return {'shape': plan_shape(root),
+            'cost': root['Total Cost'],
+            'rows': root.get('Actual Rows', 0) * root.get('Actual Loops', 1),
+            'buffers': {'hit': root.get('Shared Hit Blocks', 0),
+                        'read': root.get('Shared Read Blocks', 0)},
+            'seq_scans': seq_scans}
+
+
+class PlanRecorder:
+    """An explainer for WasteWrangler.enable_instrumentation that keeps the
+    normalized plan of every explainable statement, the most expensive one
+    if a statement runs several times.
+
+    === Instance Attributes ===
+    workload: the workload being run, plans are filed under it; the method
+    name is used instead if None.
+    plans: {<workload>: {<statement key>: <normalized plan>}}
+    errors: a line for every statement that couldn't be explained.
+    """
+    workload: Optional[str]
+    plans: dict[str, dict[str, dict]]
+    errors: list[str]
+
+    def __init__(self) -> None:
+        self.workload = None
+        self.plans = {}
+        self.errors = []
+
+    def __call__(self, method: str, cur: pg_ext.cursor, statement: str) -> None:
+        words = statement.split(None, 1)
+        if len(words) == 0 or words[0].lower() not in EXPLAINABLE:
+            return
+        conn = cur.connection
+        if conn.autocommit or conn.get_transaction_status() == pg_ext.TRANSACTION_STATUS_INERROR:
+            return
+        key = statement_key(statement)
+        # a plain cursor, so the explain isn't measured or explained itself
+        with conn.cursor(cursor_factory=pg_ext.cursor) as plain:
+            plain.execute('savepoint ww_explain;')
+            try:
+                plain.execute(f'explain (analyze, buffers, format json) {statement}')
+                plan = normalize(plain.fetchone()[0][0])
+            except pg.Error as ex:
+                self.errors.append(f'{self.workload or method}: {key}: {str(ex).strip()}')
+                return
+            finally:
+                plain.execute('rollback to savepoint ww_explain;')
+                plain.execute('release savepoint ww_explain;')
+
+        plans = self.plans.setdefault(self.workload or method, {})
+        if key not in plans or plans[key]['cost'] < plan['cost']:
+            plans[key] = plan
+
+
+def record_plans(connect_args: dict, scale: Scale, seed: int,
+                 indexes: bool = False) -> tuple[dict[str, dict[str, dict]], list[str]]:
+    """Load the data of <scale> and <seed> like benchmark.py does, with the
+    indexes of migrations.py if <indexes>, and run every workload once.
+
+    Return the normalized plans of every workload and a line for every
+    statement or workload that failed.
+    """
+    setup_database(connect_args, scale, seed, indexes)
+    ww = WasteWrangler()
+    if not ww.connect(connect_args['dbname'], connect_args['user'], connect_args['password']):
+        raise RuntimeError(f"Couldn't connect to {connect_args['dbname']}")
+    recorder = PlanRecorder()
+    ww.enable_instrumentation(explainer=recorder)
+    try:
+        for workload, run in workloads(scale, random.Random(seed)).items():
+            recorder.workload = workload
+            try:
+                run(ww)
+            except Exception as ex: # a failing method is reported, not fatal
+                recorder.errors.append(f'{workload}: {ex}')
+                ww.connection.rollback()
+    finally:
+        ww.disconnect()
+    return recorder.plans, recorder.errors
+
+
+def compare_plans(plans: dict[str, dict[str, dict]], baseline: dict[str, dict[str, dict]],
+                  tolerance: float = TOLERANCE, seq_scan_rows: int = SEQ_SCAN_ROWS) -> list[str]:
+    """Return a line for every statement in <plans> that does a sequential
+    scan over more than <seq_scan_rows> rows, changed shape since <baseline>,
+    or got more than <tolerance> more expensive than in <baseline>.
+    Statements without a baseline are only checked for sequential scans.
+    """
+    problems = []
+    for workload, statements in plans.items():
+        for key, plan in statements.items():
+            for scan in plan['seq_scans']:
+                if scan['rows'] > seq_scan_rows:
+                    problems.append(f'SEQSCAN {workload}: {key}: {scan["rows"]} rows of '
+                                    f'{scan["relation"]}')
+            before = baseline.get(workload, {}).get(key)
+            if before is None:
+                continue
+            if plan['shape'] != before['shape']:
+                problems.append(f'SHAPE {workload}: {key}: {before["shape"]} -> {plan["shape"]}')
+            if before['cost'] > 0 and plan['cost'] > before['cost'] * (1 + tolerance):
+                problems.append(f'COST {workload}: {key}: {before["cost"]:.2f} -> '
+                                f'{plan["cost"]:.2f} ({plan["cost"] / before["cost"]:.2f}x)')
+    return problems
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Check WasteWrangler query plans against baselines.')
+    parser.add_argument('--dbname', required=True)
+    parser.add_argument('--user', required=True)
+    parser.add_argument('--password', default='')
+    parser.add_argument('--scales', default='tiny',
+                        help=f'comma separated, out of {", ".join(SCALES)}')
+    parser.add_argument('--seed', type=int, default=343)
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--update', action='store_true',
+                        help='record the plans as the new baseline instead of checking them')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--seq-scan-rows', type=int, default=SEQ_SCAN_ROWS)
+    parser.add_argument('--indexes', action='store_true',
+                        help='apply migrations.py before recording')
+    args = parser.parse_args(argv)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baselines = json.load(baseline_file)
+
+    connect_args = dict(dbname=args.dbname, user=args.user, password=args.password)
+    problems = []
+    for name in args.scales.split(','):
+        plans, errors = record_plans(connect_args, SCALES[name], args.seed, args.indexes)
+        for error in errors:
+            print(f'ERROR {name}/{error}')
+        if args.update:
+            baselines[name] = {'seed': args.seed, 'indexes': args.indexes, 'workloads': plans}
+            continue
+        baseline = baselines.get(name, {})
+        if baseline and (baseline['seed'] != args.seed or baseline['indexes'] != args.indexes):
+            print(f'WARNING {name}: baseline was recorded with seed {baseline["seed"]} '
+                  f'and indexes {baseline["indexes"]}')
+        problems += [f'{name}/{line}' for line in
+                     compare_plans(plans, baseline.get('workloads', {}),
+                                   args.tolerance, args.seq_scan_rows)]
+
+    if args.update:
+        with open(args.baseline, 'w') as out:
+            json.dump(baselines, out, indent=2, sort_keys=True)
+        return 0
+    for line in problems:
+        print(line)
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,331 @@
+"""CSC343 Assignment 2 - what-if scheduling
+
+=== Module Description ===
+
+This file lets planners try out changes, e.g. "what if facility 3 is down
+and we add two trucks", without touching the database.
+
+A Snapshot is a consistent copy of the waste_wrangler tables, read once in a
+single read-only REPEATABLE READ transaction. Any number of Scenarios can be
+started from it. A Scenario runs the same logic as WasteWrangler's
+schedule_trip, schedule_maintenance and reroute_waste against the snapshot
+and its own earlier changes, and collects what they would insert and update
+as a diff instead of writing it. Scenarios share the snapshot and only copy
+the days they book into, so starting one is cheap.
+
+Usage:
+    snapshot = Snapshot.load(ww.connection, since=dt.date(2023, 5, 1))
+    scenario = snapshot.scenario()
+    scenario.facility_down(3)
+    scenario.add_truck(100, 'A', 10)
+    scenario.reroute_waste(3, dt.date(2023, 5, 2))
+    scenario.schedule_trip(7, dt.datetime(2023, 5, 2, 9, 0))
+    print(scenario.diff())
+"""
+
+import datetime as dt
+from typing import Iterator, Optional
+
+import psycopg2.extensions as pg_ext
+
+from a2 import (PREPARED_QUERIES, BusyDay, TechnicianCalendar, choose_crew,
+                trip_end)
+
+
+class Snapshot:
+    """A read-only copy of the waste_wrangler tables, see Snapshot.load.
+
+    === Instance Attributes ===
+    routes: {<rid>: (<wastetype>, <length>)}
+    facilities: {<fid>: <wastetype>}
+    trucks: {<tid>: (<trucktype>, <capacity>)}
+    trucktypes: {<trucktype>: {<wastetype>, ...}}
+    drivers: [(<eid>, [<trucktype>, ...])] most experienced first, then
+    lowest eid, like schedule_trip reads them.
+    technicians: [(<eid>, <trucktype>)] in eid order.
+    trips: {<date>: [(<rid>, <tid>, <ttime>, <volume>, <eid1>, <eid2>, <fid>)]}
+    maintenance: {<date>: [(<tid>, <eid>)]}
+    since: the first day whose trips and maintenance were read, None if all
+    were.
+    """
+    routes: dict[int, tuple[str, float]]
+    facilities: dict[int, str]
+    trucks: dict[int, tuple[str, float]]
+    trucktypes: dict[str, set[str]]
+    drivers: list[tuple[int, list[str]]]
+    technicians: list[tuple[int, str]]
+    trips: dict[dt.date, list[tuple]]
+    maintenance: dict[dt.date, list[tuple[int, int]]]
+    since: Optional[dt.date]
+    _days: dict[dt.date, BusyDay]
+    _trucks_for_waste: dict[str, list[tuple[int, str]]]
+
+    def __init__(self) -> None:
+        self.routes = {}
+        self.facilities = {}
+        self.trucks = {}
+        self.trucktypes = {}
+        self.drivers = []
+        self.technicians = []
+        self.trips = {}
+        self.maintenance = {}
+        self.since = None
+        self._days = {}
+        self._trucks_for_waste = {}
+
+    @classmethod
+    def load(cls, connection: pg_ext.connection, since: Optional[dt.date] = None) -> 'Snapshot':
+        """Return a snapshot of the database of <connection>, with the search
+        path set to waste_wrangler. Only trips from <since> on and maintenance
+        from 90 days before <since> on are read, all of them if <since> is
+        None; scenarios must not ask about earlier days.
+
+        Any open transaction on <connection> is committed first.
+        """
+        snapshot = cls()
+        snapshot.since = since
+        connection.commit()
+        cur = connection.cursor()
+        try:
+            cur.execute('set transaction isolation level repeatable read, read only;')
+            cur.execute('select rid, wastetype, length from Route;')
+            snapshot.routes = {rid: (wastetype, length) for rid, wastetype, length in cur.fetchall()}
+            cur.execute('select fid, wastetype from Facility;')
+            snapshot.facilities = dict(cur.fetchall())
+            cur.execute('select tid, trucktype, capacity from Truck;')
+            snapshot.trucks = {tid: (trucktype, capacity) for tid, trucktype, capacity in cur.fetchall()}
+            cur.execute('select trucktype, wastetype from TruckType;')
+            for trucktype, wastetype in cur.fetchall():
+                snapshot.trucktypes.setdefault(trucktype, set()).add(wastetype)
+            cur.execute(PREPARED_QUERIES['ww_drivers'] + ';')
+            snapshot.drivers = cur.fetchall()
+            cur.execute(PREPARED_QUERIES['ww_technicians'] + ';')
+            snapshot.technicians = cur.fetchall()
+
+            first_trip = dt.datetime.min if since is None else dt.datetime.combine(since, dt.time(0, 0))
+            cur.execute('select rid, tid, ttime, volume, eid1, eid2, fid from Trip where ttime >= %s;',
+                        (first_trip,))
+            for trip in cur.fetchall():
+                snapshot.trips.setdefault(trip[2].date(), []).append(trip)
+            first_maintenance = dt.date.min if since is None else since - dt.timedelta(days=90)
+            cur.execute('select tid, eid, mdate from Maintenance where mdate >= %s;', (first_maintenance,))
+            for tid, eid, mdate in cur.fetchall():
+                snapshot.maintenance.setdefault(mdate, []).append((tid, eid))
+        finally:
+            cur.close()
+            connection.rollback()
+        return snapshot
+
+    def scenario(self) -> 'Scenario':
+        """Return a new Scenario with no changes yet."""
+        return Scenario(self)
+
+    def day(self, date: dt.date) -> BusyDay:
+        """Return the BusyDay of <date> in this snapshot. It is shared by all
+        scenarios and must not be changed; see Scenario.day.
+        """
+        busy = self._days.get(date)
+        if busy is None:
+            busy = BusyDay()
+            for rid, tid, ttime, _, eid1, eid2, _ in self.trips.get(date, []):
+                busy.add_trip(rid, tid, eid1, eid2, ttime, trip_end(ttime, self.routes[rid][1]))
+            busy.maintenance.update(tid for tid, _ in self.maintenance.get(date, []))
+            self._days[date] = busy
+        return busy
+
+
+class Scenario:
+    """A set of what-if changes on top of a Snapshot. The scheduling methods
+    work like WasteWrangler's and return the same values, but only record
+    their changes; see diff.
+
+    === Instance Attributes ===
+    snapshot: the snapshot this scenario starts from.
+    facilities: {<fid>: <wastetype>} facilities that are up.
+    trucks: {<tid>: (<trucktype>, <capacity>)} including added trucks.
+    new_trucks: [(<tid>, <trucktype>, <capacity>)] added with add_truck.
+    new_trips: [(<rid>, <tid>, <ttime>, <volume>, <eid1>, <eid2>, <fid>)]
+    new_maintenance: [(<tid>, <eid>, <mdate>)]
+    rerouted: {(<rid>, <ttime>): (<old fid>, <new fid>)} trips whose facility
+    changed.
+    """
+    snapshot: Snapshot
+    facilities: dict[int, str]
+    trucks: dict[int, tuple[str, float]]
+    new_trucks: list[tuple[int, str, float]]
+    new_trips: list[tuple]
+    new_maintenance: list[tuple[int, int, dt.date]]
+    rerouted: dict[tuple[int, dt.datetime], tuple[int, int]]
+    _days: dict[dt.date, BusyDay]
+    _trucks_for_waste: dict[str, list[tuple[int, str]]]
+
+    def __init__(self, snapshot: Snapshot) -> None:
+        self.snapshot = snapshot
+        self.facilities = snapshot.facilities
+        self.trucks = snapshot.trucks
+        self.new_trucks = []
+        self.new_trips = []
+        self.new_maintenance = []
+        self.rerouted = {}
+        self._days = {}
+        self._trucks_for_waste = {}
+
+    # ============================ What-if changes =========================== #
+
+    def facility_down(self, fid: int) -> None:
+        """Take facility <fid> out of this scenario. It receives no new trips
+        and is never picked as a replacement, but trips already going there
+        still do until they are rerouted.
+        """
+        if self.facilities is self.snapshot.facilities:
+            self.facilities = dict(self.facilities)
+        self.facilities.pop(fid, None)
+
+    def add_truck(self, tid: int, trucktype: str, capacity: float) -> None:
+        """Add a truck of <trucktype> with <capacity> as <tid> to this
+        scenario.
+        """
+        if self.trucks is self.snapshot.trucks:
+            self.trucks = dict(self.trucks)
+        self.trucks[tid] = (trucktype, capacity)
+        self.new_trucks.append((tid, trucktype, capacity))
+        self._trucks_for_waste = {}
+
+    # ========================== Scheduling methods ========================== #
+
+    def schedule_trip(self, rid: int, time: dt.datetime) -> bool:
+        """See WasteWrangler.schedule_trip."""
+        route = self.snapshot.routes.get(rid)
+        if route is None: # invalid rid
+            return False
+        wastetype, length = route
+        facilities = [fid for fid, f_wastetype in self.facilities.items() if f_wastetype == wastetype]
+        if len(facilities) == 0:
+            return False
+
+        busy = self.day(time.date())
+        crew = choose_crew(busy, rid, time, length, self.trucks_for_waste(wastetype),
+                           self.snapshot.drivers)
+        if crew is None:
+            return False
+        tid, eid1, eid2 = crew
+        busy.add_trip(rid, tid, eid1, eid2, time, trip_end(time, length))
+        self.new_trips.append((rid, tid, time, None, eid1, eid2, min(facilities)))
+        return True
+
+    def schedule_maintenance(self, date: dt.date) -> int:
+        """See WasteWrangler.schedule_maintenance."""
+        before_date = date - dt.timedelta(days=90)
+        after_date = date + dt.timedelta(days=10)
+        one_plus_date = date + dt.timedelta(days=1)
+
+        recent = {tid for tid, _, mdate in self._maintenance_from(before_date) if mdate <= after_date}
+        trucks = sorted((tid, trucktype) for tid, (trucktype, _) in self.trucks.items()
+                        if tid not in recent)
+        if len(trucks) == 0:
+            return 0
+
+        tech_busy = {}
+        truck_busy = {}
+        for tid, eid, mdate in self._maintenance_from(one_plus_date):
+            tech_busy.setdefault(eid, set()).add(mdate)
+            truck_busy.setdefault(tid, set()).add(mdate)
+        for trip in self._trips_from(one_plus_date):
+            truck_busy.setdefault(trip[1], set()).add(trip[2].date())
+
+        calendar = TechnicianCalendar(one_plus_date, self.snapshot.technicians, tech_busy, truck_busy)
+        scheduled = 0
+        for tid, trucktype in trucks:
+            match = calendar.assign(tid, trucktype)
+            if match is not None:
+                eid, mdate = match
+                self.new_maintenance.append((tid, eid, mdate))
+                if mdate in self._days:
+                    self._days[mdate].maintenance.add(tid)
+                scheduled += 1
+        return scheduled
+
+    def reroute_waste(self, fid: int, date: dt.date) -> int:
+        """See WasteWrangler.reroute_waste."""
+        wastetype = self.snapshot.facilities.get(fid)
+        if wastetype is None:
+            return 0
+        others = [other for other, o_wastetype in self.facilities.items()
+                  if o_wastetype == wastetype and other != fid]
+        if len(others) == 0:
+            return 0
+        replacement = min(others)
+
+        day_start = dt.datetime.combine(date, dt.time(0, 0))
+        day_end = day_start + dt.timedelta(days=1)
+        count = 0
+        for i, trip in enumerate(self.new_trips):
+            if trip[6] == fid and day_start < trip[2] < day_end:
+                self.new_trips[i] = trip[:6] + (replacement,)
+                count += 1
+        for rid, _, ttime, _, _, _, t_fid in self.snapshot.trips.get(date, []):
+            old, current = self.rerouted.get((rid, ttime), (t_fid, t_fid))
+            if current == fid and day_start < ttime < day_end:
+                self.rerouted[(rid, ttime)] = (old, replacement)
+                count += 1
+        return count
+
+    # ================================ Results =============================== #
+
+    def diff(self) -> dict[str, dict[str, list]]:
+        """Return what this scenario would change in the database:
+        {'insert': {<table>: [<row>, ...]}, 'update': {<table>: [(<key>,
+        {<column>: (<old>, <new>)}), ...]}}, rows and keys in table column
+        order.
+        """
+        return {
+            'insert': {'Truck': list(self.new_trucks),
+                       'Trip': list(self.new_trips),
+                       'Maintenance': list(self.new_maintenance)},
+            'update': {'Trip': [(key, {'fid': fids}) for key, fids in self.rerouted.items()
+                                if fids[0] != fids[1]]},
+        }
+
+    # ============================ Helper methods ============================ #
+
+    def day(self, date: dt.date) -> BusyDay:
+        """Return this scenario's own BusyDay for <date>, copied from the
+        snapshot the first time it is needed.
+        """
+        busy = self._days.get(date)
+        if busy is None:
+            busy = self.snapshot.day(date).copy()
+            busy.maintenance.update(tid for tid, _, mdate in self.new_maintenance if mdate == date)
+            self._days[date] = busy
+        return busy
+
+    def trucks_for_waste(self, wastetype: str) -> list[tuple[int, str]]:
+        """Return the (<tid>, <trucktype>) of the trucks that can carry
+        <wastetype>, largest capacity first, then lowest tid.
+        """
+        # scenarios without trucks of their own share the snapshot's lists
+        cache = self.snapshot._trucks_for_waste if self.trucks is self.snapshot.trucks else self._trucks_for_waste
+        trucks = cache.get(wastetype)
+        if trucks is None:
+            trucks = sorted(((tid, trucktype) for tid, (trucktype, capacity) in self.trucks.items()
+                             if wastetype in self.snapshot.trucktypes.get(trucktype, ())),
+                            key=lambda truck: (-self.trucks[truck[0]][1], truck[0]))
+            cache[wastetype] = trucks
+        return trucks
+
+    def _trips_from(self, date: dt.date) -> Iterator[tuple]:
+        """Yield every trip of this scenario on or after <date>."""
+        for tdate, trips in self.snapshot.trips.items():
+            if tdate >= date:
+                yield from trips
+        yield from (trip for trip in self.new_trips if trip[2].date() >= date)
+
+    def _maintenance_from(self, date: dt.date) -> Iterator[tuple[int, int, dt.date]]:
+        """Yield (<tid>, <eid>, <mdate>) for all maintenance of this scenario
+        on or after <date>.
+        """
+        for mdate, rows in self.snapshot.maintenance.items():
+            if mdate >= date:
+                for tid, eid in rows:
+                    yield tid, eid, mdate
+        yield from (row for row in self.new_maintenance if row[2] >= date)
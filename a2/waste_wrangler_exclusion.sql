@@ -0,0 +1,88 @@
+-- Lets the database reject trips that bring a truck or driver within 30
+-- minutes of another of their trips, so that schedulers running at the same
+-- time can't double-book anyone.
+--
+-- Every trip gets a busy range, from its start until 30 minutes after its
+-- end (both included). Two trips of the same truck or driver are too close
+-- exactly when their busy ranges overlap. The truck is checked by an
+-- exclusion constraint on Trip itself. A driver can be eID1 on one trip and
+-- eID2 on the other, which one constraint on Trip can't see, so drivers get
+-- a row per trip in TripDriver, kept up to date by triggers, and the
+-- constraint is on that table.
+--
+-- Load this after waste_wrangler_schema.sql and the data: COPY into Trip
+-- without a column list fails once Trip has the busy column. Call
+-- WasteWrangler.enable_exclusion_constraints() afterwards.
+
+set search_path to waste_wrangler;
+
+create extension if not exists btree_gist;
+
+alter table Trip add column busy tsrange;
+
+-- the busy range of a trip on route <rid> starting at <ttime>, trucks travel
+-- at 5 kph (see TRUCK_SPEED in a2.py)
+create or replace function trip_busy(rid integer, ttime timestamp) returns tsrange as $$
+	select tsrange(ttime,
+	               ttime + make_interval(secs => Route.length / 5 * 3600) + interval '30 minutes',
+	               '[]')
+	from Route where Route.rID = trip_busy.rid;
+$$ language sql stable;
+
+create or replace function set_trip_busy() returns trigger as $$
+begin
+	NEW.busy := trip_busy(NEW.rID, NEW.tTime);
+	return NEW;
+end;
+$$ language plpgsql;
+
+create trigger trip_set_busy before insert or update of rID, tTime
+on Trip for each row execute function set_trip_busy();
+
+update Trip set busy = trip_busy(rID, tTime);
+alter table Trip alter column busy set not null;
+
+alter table Trip add constraint trip_truck_busy
+	exclude using gist (tID with =, busy with &&);
+
+-- one row per driver of every trip
+create table TripDriver (
+	eID integer not null references Employee,
+	rID integer not null,
+	tTime timestamp not null,
+	busy tsrange not null,
+	constraint trip_driver_busy exclude using gist (eID with =, busy with &&)
+);
+create index tripdriver_trip_idx on TripDriver (rID, tTime);
+
+create or replace function sync_trip_driver() returns trigger as $$
+begin
+	if TG_OP in ('UPDATE', 'DELETE') then
+		delete from TripDriver where rID = OLD.rID and tTime = OLD.tTime;
+	end if;
+	if TG_OP in ('INSERT', 'UPDATE') then
+		insert into TripDriver values
+			(NEW.eID1, NEW.rID, NEW.tTime, NEW.busy),
+			(NEW.eID2, NEW.rID, NEW.tTime, NEW.busy);
+	end if;
+	return null;
+end;
+$$ language plpgsql;
+
+create trigger trip_sync_driver after insert or delete or update of rID, tTime, eID1, eID2
+on Trip for each row execute function sync_trip_driver();
+
+create or replace function truncate_trip_driver() returns trigger as $$
+begin
+	truncate TripDriver;
+	return null;
+end;
+$$ language plpgsql;
+
+create trigger trip_truncate_driver after truncate
+on Trip for each statement execute function truncate_trip_driver();
+
+insert into TripDriver
+	select eID1, rID, tTime, busy from Trip
+	union all
+	select eID2, rID, tTime, busy from Trip;
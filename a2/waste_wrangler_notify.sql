@@ -0,0 +1,36 @@
+-- Triggers that tell WasteWrangler's reference cache when the slowly
+-- changing tables change. Every insert, update, delete or truncate on one of
+-- these tables sends the table's name on the waste_wrangler_reference
+-- channel, and every WasteWrangler listening on it drops what it cached
+-- from that table.
+-- Load this after waste_wrangler_schema.sql.
+
+set search_path to waste_wrangler;
+
+create or replace function notify_reference_change() returns trigger as $$
+begin
+	perform pg_notify('waste_wrangler_reference', TG_TABLE_NAME);
+	return null;
+end;
+$$ language plpgsql;
+
+create trigger route_notify after insert or update or delete or truncate
+on Route for each statement execute function notify_reference_change();
+
+create trigger facility_notify after insert or update or delete or truncate
+on Facility for each statement execute function notify_reference_change();
+
+create trigger employee_notify after insert or update or delete or truncate
+on Employee for each statement execute function notify_reference_change();
+
+create trigger driver_notify after insert or update or delete or truncate
+on Driver for each statement execute function notify_reference_change();
+
+create trigger technician_notify after insert or update or delete or truncate
+on Technician for each statement execute function notify_reference_change();
+
+create trigger truck_notify after insert or update or delete or truncate
+on Truck for each statement execute function notify_reference_change();
+
+create trigger trucktype_notify after insert or update or delete or truncate
+on TruckType for each statement execute function notify_reference_change();
@@ -0,0 +1,129 @@
+-- Keeps a table of who and what is busy on every day, so that the scheduling
+-- methods read the rows of the day they care about instead of re-deriving
+-- them from Trip and Maintenance on every call.
+--
+-- Occupancy has a row per (day, kind, id) with the busy intervals of that
+-- resource on that day:
+--   * truck, driver: from the start to the end of each of their trips
+--   * route: the trips on that route, a route gets one trip per day
+--   * maintenance: the whole day, for a truck that is being maintained
+--   * technician: the whole day, for a technician maintaining a truck
+-- Every lookup includes the day, so the primary key answers all of them with
+-- a single index probe however much history the tables hold.
+--
+-- Triggers on Trip and Maintenance keep the table current. Route lengths are
+-- assumed not to change once trips use the route.
+--
+-- Load this after waste_wrangler_schema.sql and the data, then call
+-- WasteWrangler.enable_occupancy().
+
+set search_path to waste_wrangler;
+
+create table Occupancy (
+	day date not null,
+	kind varchar(11) not null
+		check (kind in ('truck', 'driver', 'route', 'maintenance', 'technician')),
+	id integer not null,
+	busy tsrange[] not null,
+	primary key (day, kind, id)
+);
+
+-- add <busy> to the intervals of <kind> <id> on <day>
+create or replace function occupy(day date, kind varchar, id integer, busy tsrange) returns void as $$
+begin
+	if id is null then
+		return;
+	end if;
+	insert into Occupancy values (day, kind, id, array[busy])
+	on conflict on constraint occupancy_pkey
+	do update set busy = Occupancy.busy || excluded.busy;
+end;
+$$ language plpgsql;
+
+-- remove <busy> from the intervals of <kind> <id> on <day>
+create or replace function vacate(day date, kind varchar, id integer, busy tsrange) returns void as $$
+begin
+	update Occupancy o set busy = array_remove(o.busy, vacate.busy)
+	where o.day = vacate.day and o.kind = vacate.kind and o.id = vacate.id;
+	delete from Occupancy o
+	where o.day = vacate.day and o.kind = vacate.kind and o.id = vacate.id and o.busy = '{}';
+end;
+$$ language plpgsql;
+
+-- the interval of a trip on route <rid> starting at <ttime>, trucks travel at
+-- 5 kph (see TRUCK_SPEED in a2.py)
+create or replace function trip_interval(rid integer, ttime timestamp) returns tsrange as $$
+	select tsrange(ttime, ttime + make_interval(secs => Route.length / 5 * 3600), '[]')
+	from Route where Route.rID = trip_interval.rid;
+$$ language sql stable;
+
+create or replace function sync_occupancy_trip() returns trigger as $$
+declare
+	busy tsrange;
+begin
+	if TG_OP in ('UPDATE', 'DELETE') then
+		busy := trip_interval(OLD.rID, OLD.tTime);
+		perform vacate(date(OLD.tTime), 'truck', OLD.tID, busy);
+		perform vacate(date(OLD.tTime), 'driver', OLD.eID1, busy);
+		perform vacate(date(OLD.tTime), 'driver', OLD.eID2, busy);
+		perform vacate(date(OLD.tTime), 'route', OLD.rID, busy);
+	end if;
+	if TG_OP in ('INSERT', 'UPDATE') then
+		busy := trip_interval(NEW.rID, NEW.tTime);
+		perform occupy(date(NEW.tTime), 'truck', NEW.tID, busy);
+		perform occupy(date(NEW.tTime), 'driver', NEW.eID1, busy);
+		perform occupy(date(NEW.tTime), 'driver', NEW.eID2, busy);
+		perform occupy(date(NEW.tTime), 'route', NEW.rID, busy);
+	end if;
+	return null;
+end;
+$$ language plpgsql;
+
+create trigger trip_sync_occupancy after insert or delete or update of rID, tID, tTime, eID1, eID2
+on Trip for each row execute function sync_occupancy_trip();
+
+create or replace function sync_occupancy_maintenance() returns trigger as $$
+begin
+	if TG_OP in ('UPDATE', 'DELETE') then
+		perform vacate(OLD.mDATE, 'maintenance', OLD.tID, tsrange(OLD.mDATE, OLD.mDATE + 1));
+		perform vacate(OLD.mDATE, 'technician', OLD.eID, tsrange(OLD.mDATE, OLD.mDATE + 1));
+	end if;
+	if TG_OP in ('INSERT', 'UPDATE') then
+		perform occupy(NEW.mDATE, 'maintenance', NEW.tID, tsrange(NEW.mDATE, NEW.mDATE + 1));
+		perform occupy(NEW.mDATE, 'technician', NEW.eID, tsrange(NEW.mDATE, NEW.mDATE + 1));
+	end if;
+	return null;
+end;
+$$ language plpgsql;
+
+create trigger maintenance_sync_occupancy after insert or delete or update
+on Maintenance for each row execute function sync_occupancy_maintenance();
+
+create or replace function truncate_occupancy() returns trigger as $$
+begin
+	if TG_TABLE_NAME = 'trip' then
+		delete from Occupancy where kind in ('truck', 'driver', 'route');
+	else
+		delete from Occupancy where kind in ('maintenance', 'technician');
+	end if;
+	return null;
+end;
+$$ language plpgsql;
+
+create trigger trip_truncate_occupancy after truncate
+on Trip for each statement execute function truncate_occupancy();
+
+create trigger maintenance_truncate_occupancy after truncate
+on Maintenance for each statement execute function truncate_occupancy();
+
+insert into Occupancy
+	select date(t.tTime), r.kind, r.id, array_agg(trip_interval(t.rID, t.tTime))
+	from Trip t cross join lateral (values ('truck', t.tID), ('driver', t.eID1),
+	                                       ('driver', t.eID2), ('route', t.rID)) r(kind, id)
+	where r.id is not null
+	group by date(t.tTime), r.kind, r.id
+	union all
+	select m.mDATE, r.kind, r.id, array_agg(tsrange(m.mDATE, m.mDATE + 1))
+	from Maintenance m cross join lateral (values ('maintenance', m.tID),
+	                                              ('technician', m.eID)) r(kind, id)
+	group by m.mDATE, r.kind, r.id;